@@ -6,8 +6,9 @@ from typing import Any, Dict, List, Optional, Tuple
 import streamlit as st
 from dotenv import load_dotenv
 
-from lib.bot import XSpaceBot
 from lib.chatbot import Chatbot
+from lib.daemon import RecorderClient, RecorderError
+from lib.space_data import count_space_frames, load_space_data
 from lib.transcript import (
     consolidate_transcript,
     gen_transcript_summary,
@@ -37,7 +38,7 @@ def read_space_metadata(space_id: str) -> Tuple[Optional[Dict[str, Any]], Option
     space_dir = f"data/{space_id}"
     space_data_path = os.path.join(space_dir, "space_data.json")
 
-    space_data = load_json_file(space_data_path)
+    space_data = load_space_data(space_data_path, frames=False)
     if not space_data:
         return None
 
@@ -49,43 +50,57 @@ def read_space_metadata(space_id: str) -> Tuple[Optional[Dict[str, Any]], Option
         "title": space_data.get("title", "Unknown"),
         "started_at": started_at.strftime("%Y-%m-%d %H:%M:%S"),
         "joined_at": joined_at.strftime("%Y-%m-%d %H:%M:%S"),
-        "frames_captured": len(space_data.get("frames", {})),
+        "frames_captured": count_space_frames(space_data_path, space_data),
         "summary_path": os.path.join(space_dir, "transcript_summary.txt"),
         "transcript_path": os.path.join(space_dir, "transcript_updated.json"),
     }
 
 
+# the recordings run in the recorder daemon (main.py daemon), so they outlive page reloads and
+# every session sees the same ones
 def start_recording(
     space_id: str,
     x_cookie_file: str,
-    x_bearer: str,
     headless: bool,
     fetch_audio: bool,
     fetch_space_metadata: bool,
     take_screenshots: bool,
     options: Dict[str, Any],
 ) -> Optional[str]:
-    if "bot" in st.session_state:
-        return "A recording session is already running."
+    try:
+        RecorderClient().start(
+            space_id,
+            x_cookie_file=os.path.abspath(x_cookie_file),
+            headless=headless,
+            fetch_audio=fetch_audio,
+            fetch_space_metadata=fetch_space_metadata,
+            take_screenshots=take_screenshots,
+            opts=options,
+        )
+    except RecorderError as e:
+        return str(e)
 
-    bot = XSpaceBot(x_cookie_file, space_id, x_bearer, headless=headless)
-    st.session_state.bot = bot
 
-    bot.run(
-        fetch_audio=fetch_audio,
-        fetch_space_metadata=fetch_space_metadata,
-        take_screenshots=take_screenshots,
-        opts=options,
-    )
+def stop_recording_session(space_id: str) -> Optional[str]:
+    try:
+        RecorderClient().stop(space_id)
+    except RecorderError as e:
+        return str(e)
 
 
-def stop_recording_session() -> Optional[str]:
-    bot = st.session_state.get("bot")
-    if bot:
-        bot.stop()
-        del st.session_state.bot
-    else:
-        return "No active recording session to stop."
+def list_recordings() -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    try:
+        return RecorderClient().list(), None
+    except RecorderError as e:
+        return [], str(e)
+
+
+def stop_all_recordings() -> Optional[str]:
+    recordings, err = list_recordings()
+    for recording in recordings:
+        if recording["state"] in ("joining", "recording"):
+            err = stop_recording_session(recording["space_id"]) or err
+    return err
 
 
 def transcribe(space_id: str, hf_token: str, openai_api_key: str) -> None:
@@ -206,7 +221,6 @@ def main() -> None:
                 err = start_recording(
                     space_id=space_id,
                     x_cookie_file=x_cookie,
-                    x_bearer=x_bearer,
                     headless=headless,
                     fetch_audio=True,
                     fetch_space_metadata=True,
@@ -220,13 +234,26 @@ def main() -> None:
                     st.session_state.recording_in_progress = True
 
         if st.button("Stop Recording"):
-            err = stop_recording_session()
+            err = stop_recording_session(space_id)
             if err:
                 st.write(err)
             if not err:
                 st.write("Recording stopped.")
                 st.session_state.recording_in_progress = False
 
+        recordings, err = list_recordings()
+        if err:
+            st.caption(err)
+        if recordings:
+            st.subheader("Recordings")
+        for recording in recordings:
+            st.write(
+                f"**{recording['space_id']}**: {recording['state']}, "
+                f"{recording['frames']} frames ({recording['fps'] or 0} fps), "
+                f"{recording['audio_bytes'] / 2**20:.1f} MB of audio, "
+                f"{len(recording['speakers_seen'])} speakers seen"
+            )
+
     with transcribe_tab:
         # ensure that data folder exists
         if not os.path.exists("data"):
@@ -300,7 +327,7 @@ def main() -> None:
     st.sidebar.markdown("---")
     st.sidebar.header("Control")
     if st.sidebar.button("Shutdown Recording Session"):
-        success, err = stop_recording_session()
+        err = stop_all_recordings()
         st.write(err)
 
 
@@ -0,0 +1,87 @@
+import time
+from collections import deque
+from typing import Iterable, Optional
+
+# effective speaker sampling rates over time, one record per change
+SAMPLE_RATES_STREAM = "sample_rates"
+
+# reasons for a rate change
+RATE_SPEAKER_CHANGE = "speaker_change"
+RATE_OVERLAP = "overlap"
+RATE_HOLD = "hold"
+RATE_BUDGET = "budget"
+
+
+class AdaptiveRate:
+    """
+    Speaker sampling rate that follows the activity of the space.
+
+    A change of the speaker set or several speakers talking at once jumps to max_fps, so fast
+    back-and-forth is sampled finely. Once the same speakers (or silence) held for hold_ticks
+    ticks, the rate backs off by backoff per tick down to min_fps. Whatever the activity, the
+    rate is kept under calls_per_minute webdriver calls, measured over the last minute; the
+    budget wins over min_fps.
+    """
+
+    def __init__(
+        self,
+        min_fps: float = 0.5,
+        max_fps: float = 4,
+        calls_per_minute: float = 240,
+        hold_ticks: int = 5,
+        backoff: float = 0.75,
+    ):
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.calls_per_minute = calls_per_minute
+        self.hold_ticks = hold_ticks
+        self.backoff = backoff
+        self.fps = min_fps
+        self._speakers = None
+        self._stable_ticks = 0
+        # (time, webdriver calls) of the ticks of the last minute
+        self._ticks = deque()
+
+    def interval(self) -> float:
+        return 1 / self.fps
+
+    def observe(self, speakers: Iterable[str], calls: int, now: Optional[float] = None):
+        """
+        Adapt the rate to the usernames speaking in a tick that made calls webdriver calls.
+        Returns the reason if the rate changed, else None
+        """
+        now = time.time() if now is None else now
+        self._ticks.append((now, calls))
+        while self._ticks[0][0] < now - 60:
+            self._ticks.popleft()
+
+        speakers = frozenset(speakers)
+        changed = speakers != self._speakers
+        self._speakers = speakers
+        if changed:
+            fps, reason = self.max_fps, RATE_SPEAKER_CHANGE
+            self._stable_ticks = 0
+        elif len(speakers) > 1:
+            fps, reason = self.max_fps, RATE_OVERLAP
+            self._stable_ticks = 0
+        else:
+            self._stable_ticks += 1
+            fps, reason = self.fps, RATE_HOLD
+            if self._stable_ticks >= self.hold_ticks:
+                fps = max(self.min_fps, self.fps * self.backoff)
+
+        budget_fps = self._budget_fps()
+        if fps > budget_fps:
+            fps, reason = budget_fps, RATE_BUDGET
+
+        if round(fps, 3) == round(self.fps, 3):
+            return None
+        self.fps = fps
+        return reason
+
+    # highest rate the budget allows, at the calls per tick of the last minute
+    def _budget_fps(self) -> float:
+        calls_per_tick = sum(calls for _, calls in self._ticks) / len(self._ticks)
+        if not calls_per_tick:
+            return self.max_fps
+        return self.calls_per_minute / 60 / calls_per_tick
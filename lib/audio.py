@@ -0,0 +1,260 @@
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+import psutil
+
+from utils import convert_m4a_to_wav
+
+from .hls import ASR_SAMPLE_RATE
+
+# seconds of audio in each chunk of iter_chunks
+CHUNK_SECONDS = 30
+# pcm wav sample formats that map straight to an array: (format tag, bits) -> dtype
+_WAV_DTYPES = {(1, 16): np.int16, (3, 32): np.float32}
+_RIFF = struct.Struct("<4sI4s")
+_CHUNK = struct.Struct("<4sI")
+_FMT = struct.Struct("<HHIIHH")
+
+
+def _wav_layout(path: str) -> Optional[Dict[str, int]]:
+    """Sample format and place of the samples of a wav file, None for other files"""
+    with open(path, "rb") as f:
+        riff, _, wave = _RIFF.unpack(f.read(_RIFF.size))
+        if riff != b"RIFF" or wave != b"WAVE":
+            return None
+        layout = {}
+        while True:
+            header = f.read(_CHUNK.size)
+            if len(header) < _CHUNK.size:
+                return None
+            chunk_id, size = _CHUNK.unpack(header)
+            if chunk_id == b"fmt ":
+                tag, channels, rate, _, _, bits = _FMT.unpack(f.read(_FMT.size))
+                layout.update(tag=tag, channels=channels, rate=rate, bits=bits)
+                f.seek(size - _FMT.size + (size & 1), os.SEEK_CUR)
+            elif chunk_id == b"data":
+                # a streamed wav leaves the size unset, the samples run to the end of the file
+                end = os.path.getsize(path)
+                size = size if size and f.tell() + size <= end else end - f.tell()
+                return {**layout, "offset": f.tell(), "size": size} if layout else None
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+def map_pcm(path: str, sample_rate: int = ASR_SAMPLE_RATE) -> Optional[np.ndarray]:
+    """
+    The samples of a mono 16-bit or float pcm wav at sample_rate, mapped from disk rather than
+    read. None for any other file, those have to be decoded
+    """
+    try:
+        layout = _wav_layout(path)
+    except (OSError, struct.error):
+        return None
+    if not layout or layout["channels"] != 1 or layout["rate"] != sample_rate:
+        return None
+    dtype = _WAV_DTYPES.get((layout["tag"], layout["bits"]))
+    if dtype is None:
+        return None
+    count = layout["size"] // np.dtype(dtype).itemsize
+    return np.memmap(path, dtype, "r", layout["offset"], shape=(count,))
+
+
+def _to_float32(samples: np.ndarray) -> np.ndarray:
+    if samples.dtype == np.int16:
+        return np.multiply(samples, 1 / 32768, dtype=np.float32)
+    return np.asarray(samples, dtype=np.float32)
+
+
+def _decoder(path: str, sample_rate: int) -> subprocess.Popen:
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-v",
+        "error",
+        "-i",
+        path,
+        "-f",
+        "f32le",
+        "-ac",
+        "1",
+        "-ar",
+        str(sample_rate),
+        "-",
+    ]
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def _read_into(stream, buffer: np.ndarray) -> int:
+    """Fill buffer with samples from stream, returns how many, fewer only at its end"""
+    view = memoryview(buffer).cast("B")
+    filled = 0
+    while filled < len(view):
+        read = stream.readinto(view[filled:])
+        if not read:
+            break
+        filled += read
+    return filled // buffer.itemsize
+
+
+def _check(process: subprocess.Popen, path: str) -> None:
+    stderr = process.stderr.read().decode("utf-8", "replace").strip()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {path}: {stderr}")
+
+
+def decode(path: str, sample_rate: int = ASR_SAMPLE_RATE) -> np.ndarray:
+    """
+    Float32 mono samples at sample_rate of any file ffmpeg reads, piped from ffmpeg straight
+    into the array, with no temporary file
+    """
+    process = _decoder(path, sample_rate)
+    buffer = np.empty(sample_rate * 60, np.float32)
+    count = 0
+    with process:
+        while True:
+            count += _read_into(process.stdout, buffer[count:])
+            if count < len(buffer):
+                break
+            grown = np.empty(len(buffer) * 2, np.float32)
+            grown[:count] = buffer
+            buffer = grown
+        _check(process, path)
+    return buffer[:count]
+
+
+def load_audio(path: str, sample_rate: int = ASR_SAMPLE_RATE) -> np.ndarray:
+    """Float32 mono samples at sample_rate, mapped from a matching pcm wav or else decoded"""
+    mapped = map_pcm(path, sample_rate)
+    if mapped is not None:
+        return _to_float32(mapped)
+    return decode(path, sample_rate)
+
+
+def iter_chunks(
+    path: str, chunk_seconds: float = CHUNK_SECONDS, sample_rate: int = ASR_SAMPLE_RATE
+) -> Iterator[np.ndarray]:
+    """
+    Float32 mono samples at sample_rate, chunk_seconds at a time, so a stage can stream a long
+    space without holding all of it. A matching pcm wav is mapped, anything else is decoded
+    as the chunks are taken
+    """
+    size = int(chunk_seconds * sample_rate)
+    mapped = map_pcm(path, sample_rate)
+    if mapped is not None:
+        for start in range(0, len(mapped), size):
+            yield _to_float32(mapped[start : start + size])
+        return
+
+    process = _decoder(path, sample_rate)
+    finished = False
+    try:
+        while True:
+            chunk = np.empty(size, np.float32)
+            count = _read_into(process.stdout, chunk)
+            if count:
+                yield chunk[:count]
+            if count < size:
+                break
+        finished = True
+    finally:
+        # the consumer may stop early, ffmpeg is stopped with it
+        if not finished:
+            process.kill()
+        with process:
+            if finished:
+                _check(process, path)
+
+
+class PeakMemory:
+    """Peak resident memory of this process and its children (ffmpeg) over a block"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+        self.start = self.peak = 0
+
+    def _rss(self) -> int:
+        total = self._process.memory_info().rss
+        for child in self._process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+    def __enter__(self) -> "PeakMemory":
+        self.start = self.peak = self._rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+    @property
+    def peak_mb(self) -> float:
+        """Growth of the peak over the memory at the start of the block"""
+        return round((self.peak - self.start) / 2**20, 1)
+
+
+def benchmark_decode(audio_path: str, sample_rate: int = ASR_SAMPLE_RATE) -> Dict[str, Dict]:
+    """
+    Time, peak memory and temporary disk of getting the samples of audio_path three ways.
+    "wav_then_pipe" is what transcription used to do: a full rate wav written beside the audio,
+    which the transcriber then decoded through ffmpeg again, convert_seconds of it the writing.
+    "pipe" decodes the audio in one pipe, "chunks" in chunks
+    """
+    results = {}
+
+    # on the same disk as the audio, as the wav used to be
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(audio_path))) as tmp:
+        wav_path = os.path.join(tmp, "audio.wav")
+        started_at = time.time()
+        with PeakMemory() as memory:
+            if not convert_m4a_to_wav(audio_path, wav_path):
+                raise RuntimeError(f"failed to convert {audio_path} to wav")
+            converted_at = time.time()
+            # not the 16 kHz mono map_pcm takes, decoded like any other file
+            samples = len(decode(wav_path, sample_rate))
+        results["wav_then_pipe"] = {
+            "seconds": round(time.time() - started_at, 2),
+            "convert_seconds": round(converted_at - started_at, 2),
+            "peak_mb": memory.peak_mb,
+            "disk_mb": round(os.path.getsize(wav_path) / 2**20, 1),
+            "samples": samples,
+        }
+
+    started_at = time.time()
+    with PeakMemory() as memory:
+        samples = len(load_audio(audio_path, sample_rate))
+    results["pipe"] = {
+        "seconds": round(time.time() - started_at, 2),
+        "peak_mb": memory.peak_mb,
+        "disk_mb": 0,
+        "samples": samples,
+    }
+
+    started_at = time.time()
+    with PeakMemory() as memory:
+        samples = sum(len(chunk) for chunk in iter_chunks(audio_path, sample_rate=sample_rate))
+    results["chunks"] = {
+        "seconds": round(time.time() - started_at, 2),
+        "peak_mb": memory.peak_mb,
+        "disk_mb": 0,
+        "samples": samples,
+    }
+    return results
@@ -1,14 +1,15 @@
 from datetime import datetime
-import json
 import time
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from PIL import Image
-import io
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    SessionNotCreatedException,
+    TimeoutException,
+)
 from time import sleep
 import threading
 import os
@@ -24,11 +25,55 @@ import logging
 # from lib.wrapped_twspace_dl import WrappedTwspaceDL
 from lib.twspace_dl import TwspaceDL
 
+from .adaptive_rate import SAMPLE_RATES_STREAM, AdaptiveRate
+from .cdp_capture import (
+    BACKEND_CLIP,
+    BACKEND_SCREENCAST,
+    BACKEND_WEBDRIVER,
+    capture_clip,
+    participants_clip,
+    run_screencast,
+    screencast_format,
+)
+from .frame_pipeline import DROP_OLDEST, FramePipeline, ImageFileSink, VideoSink
+from .hls import ASR_FLAC, ASR_FORMATS
+from .intervals import INTERVALS_CLOSED_AT, INTERVALS_STREAM, IntervalBuilder
+from .isolation import JitterMeter, ProcessIsolation, write_frames
+from .lean_browser import (
+    LEAN_CHROME_ARGS,
+    BrowserProcessUsage,
+    enable_network_log,
+    measure_page,
+    prepare_page,
+    read_network_log,
+)
+from .memory_watchdog import (
+    BROWSER_RSS_LIMIT_MB,
+    MEMORY_CHECK_INTERVAL,
+    PYTHON_RSS_LIMIT_MB,
+    MemoryWatchdog,
+)
+from .page_scripts import (
+    CANVAS_SCORE_JS,
+    JOIN_STATE_JS,
+    ROSTER_VERSION_JS,
+    SPEAKER_SAMPLER_DRAIN_JS,
+    SPEAKER_SAMPLER_INSTALL_JS,
+    SPEAKER_SNAPSHOT_JS,
+)
+from .roster import RosterCache
+from .scheduler import (
+    PRIORITY_HOUSEKEEPING,
+    PRIORITY_SCREENSHOTS,
+    PRIORITY_SPEAKERS,
+    CommandExpired,
+    DriverScheduler,
+)
+from .space_data import DEFAULT_FSYNC_INTERVAL, FRAMES_STREAM, SpaceDataStore
 from .xapi import XAPI
 
 from webdriver_manager.chrome import ChromeDriverManager
 
-
 # from .helpers import animation_above_threshold, parse_space_id
 
 logging.basicConfig(level=logging.DEBUG)
@@ -36,29 +81,208 @@ logger = logging.getLogger(__name__)
 
 # TODO: broadcasts
 
-SPACE_JSON = "space_data.json"
-
-# we can use data urls from the animated speaker canvas to determine if a user is speaking
-# since the canvas has a transparent bg, we can generally assume that the longer the data url,
-# the more likely that the user is speaking. this isn't perfect but it's a start. moreover,
-# x users often mute and unmute, so this is a simple heuristic to filter out the silent frames
-DATA_URL_EMPTY = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAACAAAAAgCAYAAABzenr0AAAAAXNSR0IArs4c6QAAAC1JREFUWEft0EERAAAAAUH6lxbDZxU4s815PffjAAECBAgQIECAAAECBAgQIDAaPwAh6O5R/QAAAABJRU5ErkJggg=="
-DATA_URL_NOT_SPEAKING = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAACAAAAAgCAYAAABzenr0AAAAAXNSR0IArs4c6QAAAMRJREFUWEftlkESgjAMRX+8mHAJ9CjdIbseRb0E5WLGCR0YkcTpximLdP35/+elDBAqH6qcDy/gBJyAE3ACxyAQrtyA0YMxxSfdrO/Dh64BMBRqJ/GztBQ6lsB+DSWk+KBWKxEuPIIh4csxS4SOeeNxQhvvlL59pcBWKApFPE//wrgxMMruhpKHDC0pU5UXyGh390j1NFb2lxVotLSiGQyAFRkhgTBou1rQz1rCuUiXE35qj/Ea1vwtcwJOwAk4ASdQncAb839mISC0yNAAAAAASUVORK5CYII="
-DATA_URL_MAYBE_SPEAKING = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAYAAAAf8/9hAAAAAXNSR0IArs4c6QAAAJFJREFUOE/FkkEOgyAQRf/3YsVL2B6FnbDjKNVLyMkcAy2JaRCDpJEt/DdvhiEaDxvzaAfolyisUG6mObPJvaUeRGKQ8G5ifwT5hpd436F3b/oY+xsgVExVQqUqAz1ImMe4b6sO8JQFAnUZEJWDRQef2qgyyP3EMSDpAra0CyUDA+IBwu6nnrX4aeuzPo3nfsAGQiaBEfCZ9OsAAAAASUVORK5CYII="
+# the logs a new recording of the space starts over. the audio segments, screenshot timestamps,
+# memory samples and sample rates stay, the live tail resumes from its segments
+RUN_STREAMS = (FRAMES_STREAM, INTERVALS_STREAM)
+# screenshots encoded into a single video, with a jsonl sidecar of frame timestamps
+SCREENSHOTS_VIDEO = "screenshots.mp4"
+# clipped screenshots re-measure the participants region every this many frames
+CLIP_REFRESH_FRAMES = 30
+
+# participant rows inside the space's ParticipantsWrapper
+PARTICIPANT_XPATH = (
+    "//div[@id='ParticipantsWrapper']//div[contains(@class, 'css-175oi2r')"
+    " and contains(@class, 'r-1awozwy') and contains(@class, 'r-6koalj')"
+    " and contains(@class, 'r-18u37iz') and contains(@class, 'r-1777fci')]"
+)
+# username span, relative to a participant row
+USERNAME_XPATH = (
+    "./ancestor::div[contains(@class, 'css-175oi2r') and contains(@class, 'r-1awozwy')]"
+    "//span[contains(@class, 'css-1jxf684') and contains(@class, 'r-poiln3')]"
+)
+
+# speaker capture modes
+# "script" gathers every participant with a single injected script call per tick
+# "elements" walks the participants with several webdriver calls each (fallback)
+# "sampler" samples in the page at a high rate and python drains the speaking transitions
+SPEAKER_CAPTURE_SCRIPT = "script"
+SPEAKER_CAPTURE_ELEMENTS = "elements"
+SPEAKER_CAPTURE_SAMPLER = "sampler"
+# consecutive snapshot script failures before the capture loop gives up on script mode
+SPEAKER_SNAPSHOT_MAX_FAILURES = 5
+
+# audio files written by twspace_dl, counted in the status of a recording
+AUDIO_EXTENSIONS = (".m4a", ".aac", ".ts", ".mp3")
+
+# speaker sampling rates of the script and elements modes
+# "fixed" samples at speaker_data_fps for the whole space
+# "adaptive" follows the activity between speaker_min_fps and speaker_max_fps, within a budget of
+# webdriver_calls_per_minute (see AdaptiveRate)
+SPEAKER_RATE_FIXED = "fixed"
+SPEAKER_RATE_ADAPTIVE = "adaptive"
+
+# seconds between forced refreshes of the cached participant usernames
+ROSTER_REFRESH_INTERVAL = 60
+
+# capture engines behind run, picked with opts engine
+# "webdriver" runs a thread per task, each polling through selenium
+# "cdp" runs every task as a coroutine on one event loop, over a devtools websocket (see engine)
+ENGINE_WEBDRIVER = "webdriver"
+ENGINE_CDP = "cdp"
+
+# how the webdriver engine runs a recording, picked with opts isolation
+# "threads" captures, downloads the audio and writes the frames in threads of this process
+# "processes" leaves capture alone in this process, see ProcessIsolation
+ISOLATION_THREADS = "threads"
+ISOLATION_PROCESSES = "processes"
+
+# states of the space page while joining, see JOIN_STATE_JS
+JOIN_ENDED = "ended"
+JOIN_START_LISTENING = "start_listening"
+JOIN_LOGIN_WALL = "login_wall"
+JOIN_ERROR = "error"
+# seconds to wait for the space page to show any of them
+JOIN_TIMEOUT = 20
+# why a space couldn't be joined, by the state the page showed (None: none in time)
+JOIN_FAILURES = {
+    None: "the join button was not found",
+    JOIN_ENDED: "the space has ended",
+    JOIN_LOGIN_WALL: "not logged in, check the cookie file",
+    JOIN_ERROR: "the space page shows an error",
+}
+
+# speaker frames buffered for the frame batch writer past which they are written out right away
+MAX_BUFFERED_FRAMES = 600
+
+# in-page sampler defaults: sample rate (hz), seconds between drains and max buffered events
+SAMPLER_HZ = 15
+SAMPLER_DRAIN_INTERVAL = 3
+SAMPLER_MAX_EVENTS = 10000
+
+# we can use the animated speaker canvas to determine if a user is speaking. the canvas has a
+# transparent bg and the speaking ring grows with the user's volume, so the share of covered
+# pixels (mean alpha, computed in the page) is a decent speaking score. the reference canvases
+# score 0.067 for a muted/silent ring and 0.199 for a speaking one. x users often mute and
+# unmute, so this is a simple heuristic to filter out the silent frames. tune with opts
+# speaking_threshold.
+SPEAKING_SCORE_THRESHOLD = 0.15
+
+
+def score_above_threshold(score, threshold=SPEAKING_SCORE_THRESHOLD):
+    return score is not None and score >= threshold
+
+
+# ChromeDriverManager looks up the latest chromedriver online, so the resolved binary is
+# remembered for the process and, across runs, in this file
+CHROMEDRIVER_PATH_CACHE = os.path.join(
+    os.path.expanduser("~"), ".cache", "xspacecadet", "chromedriver_path"
+)
+_chromedriver_path = None
+_chromedriver_lock = threading.Lock()
+
+
+# path of the chromedriver binary, resolved online only when there is no usable cached one
+def chromedriver_path(refresh=False):
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path and not refresh:
+            return _chromedriver_path
+
+        if not refresh and os.path.exists(CHROMEDRIVER_PATH_CACHE):
+            with open(CHROMEDRIVER_PATH_CACHE, "r") as f:
+                cached_path = f.read().strip()
+            if os.path.isfile(cached_path):
+                _chromedriver_path = cached_path
+                return _chromedriver_path
+
+        _chromedriver_path = ChromeDriverManager().install()
+        try:
+            os.makedirs(os.path.dirname(CHROMEDRIVER_PATH_CACHE), exist_ok=True)
+            with open(CHROMEDRIVER_PATH_CACHE, "w") as f:
+                f.write(_chromedriver_path)
+        except OSError as e:
+            logger.warning(f"failed to cache the chromedriver path: {e}")
+        return _chromedriver_path
+
+
+# mobile sized chrome options, extra_args are appended to the default chrome flags.
+# user_data_dir keeps the profile (cookies, cache) between launches, one chrome at a time
+def build_chrome_options(headless=True, extra_args=(), user_data_dir=None):
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+    options.add_argument("--mute-audio")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    # TODO: make this frame longer to capture more speakers without having to scroll
+    options.add_argument("--window-size=375,2000")
+    options.add_argument(
+        "--user-agent=Mozilla/5.0 (iPhone; CPU iPhone OS 13_2_3 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.0.3 Mobile/15E148 Safari/604.1"
+    )
+    if user_data_dir:
+        options.add_argument(f"--user-data-dir={user_data_dir}")
+    for arg in extra_args:
+        options.add_argument(arg)
+    # the bytes the pages receive are counted from the logged network events
+    enable_network_log(options)
+    return options
+
+
+# start a chrome with the build_chrome_options options
+def create_webdriver(headless=True, extra_args=(), user_data_dir=None):
+    options = build_chrome_options(headless, extra_args, user_data_dir)
+    try:
+        return webdriver.Chrome(service=Service(chromedriver_path()), options=options)
+    except SessionNotCreatedException as e:
+        # chrome updated since the driver was cached, get the matching one
+        logger.warning(f"cached chromedriver failed, resolving it again: {e}")
+        return webdriver.Chrome(service=Service(chromedriver_path(refresh=True)), options=options)
 
 
-def animation_above_threshold(data_url):
-    # TODO: improve this heuristic
-    # 273 is the estimated length of the base64 encoded data url for a speaking user. we use this
-    # heuristic to filter out silent frames but can be improved upon. we used to try to compare to
-    # DATA_URL_NOT_SPEAKING but it seems X changes the length of the data url every so often.
-    if len(data_url) <= 273:
-        return False
-    return True
+# read a netscape cookie file
+def read_cookie_file(cookie_file):
+    try:
+        with open(cookie_file, "r") as f:
+            cookies = f.readlines()
+    except FileNotFoundError:
+        logger.error(f"cookie file not found: {cookie_file}")
+        raise
+    except Exception as e:
+        logger.error(f"Error loading cookies: {e}")
+        raise
+
+    cookie_dicts = []
+    for cookie in cookies:
+        fields = cookie.strip().split("\t")
+        if len(fields) >= 7:
+            # curl style files mark http only cookies with a prefix on the domain
+            http_only = fields[0].startswith("#HttpOnly_")
+            cookie_dict = {
+                "name": fields[5],
+                "value": fields[6],
+                "domain": fields[0][len("#HttpOnly_") :] if http_only else fields[0],
+                "path": fields[2],
+                "secure": fields[3] == "TRUE",
+                "httpOnly": http_only,
+            }
+            # session cookies have no expiry
+            if fields[4].isdigit() and int(fields[4]):
+                cookie_dict["expires"] = int(fields[4])
+            cookie_dicts.append(cookie_dict)
+    return cookie_dicts
+
+
+# Load the cookies of a netscape cookie file into the browser, all in one devtools call. unlike
+# add_cookie this doesn't need a page of the cookies' domain to be open
+def load_cookies_into_driver(driver, cookie_file):
+    driver.execute_cdp_cmd("Network.setCookies", {"cookies": read_cookie_file(cookie_file)})
 
 
 class XSpaceBot:
-    def __init__(self, x_cookie_file, space_id, x_bearer, headless=True):
+    # driver: an already running driver to record in, e.g. a window of a browser shared with
+    # other spaces. the bot then leaves the driver running on shutdown
+    # pool: a DriverPool to check a warm, logged in browser out of, handed back on shutdown
+    def __init__(self, x_cookie_file, space_id, x_bearer, headless=True, driver=None, pool=None):
         logging.debug("XSpaceBot init:")
         logging.debug(f"x_cookie_file: {x_cookie_file}")
         logging.debug(f"cookie file exists: {os.path.exists(x_cookie_file)}")
@@ -71,7 +295,9 @@ class XSpaceBot:
         self.x_cookie_file = x_cookie_file
         self.space_id = space_id
         self.space_url = f"https://x.com/i/spaces/{space_id}"
-        self.driver = None
+        self.driver = driver
+        self.pool = pool
+        self.owns_driver = driver is None and pool is None
         self.stop_event = threading.Event()
         self.headless = headless
 
@@ -81,8 +307,9 @@ class XSpaceBot:
         self.output_dir = os.path.join(os.getcwd(), "data", f"{space_id}")
         os.makedirs(self.output_dir, exist_ok=True)
 
-        # space data json file
-        self.space_data_json_file = os.path.join(self.output_dir, SPACE_JSON)
+        # space data: metadata json file plus append-only frame log
+        self.store = SpaceDataStore(self.output_dir)
+        self.space_data_json_file = self.store.metadata_path
 
         # create frames folder
         self.captured_frames_dir = os.path.join(self.output_dir, "frames")
@@ -97,93 +324,115 @@ class XSpaceBot:
         # self.twspace_dl = WrappedTwspaceDL(twspace, "audio")
         self.twspace_dl = TwspaceDL(twspace, "audio")
         self.twspace_dl_thread = None
+        self.frame_pipeline = None
 
         self.joined_space_at = None
+        # seconds from the join request to each join milestone, to track join latency
+        self.join_started_at = None
+        self.join_latency = {}
+        # the space's tasks on the cdp engine, if it records with it
+        self.engine_space = None
+        # runs the capture threads' driver commands one at a time, by priority
+        self.scheduler = DriverScheduler(f"DriverScheduler-{space_id}")
+        self.frame_batch_buffer = {}
+        self.max_buffered_frames = MAX_BUFFERED_FRAMES
+        self.batch_lock = threading.Lock()
+        # merges the written frames into speaking intervals
+        self.interval_builder = IntervalBuilder()
+        self.frame_write_lock = threading.Lock()
+        self.speaking_threshold = SPEAKING_SCORE_THRESHOLD
+        # participant usernames cached across ticks. the script and sampler modes cache them in
+        # the page and report their counters, the elements mode caches them here
+        self.roster_cache = RosterCache(ROSTER_REFRESH_INTERVAL)
+        self.page_roster_stats = None
+        # the version of the participant rows the elements mode cache was built from
+        self.roster_version = None
+
+        # speaker capture state, advanced one tick at a time by capture_speaker_tick
+        self.speaker_capture_mode = SPEAKER_CAPTURE_SCRIPT
+        self.speaker_data_fps = 1
+        self.sampler_hz = SAMPLER_HZ
+        self.sampler_drain_interval = SAMPLER_DRAIN_INTERVAL
+        self.sampler_installed = False
+        self.sampler_speaking = {}  # username -> confidence of the users currently speaking
+        self.speaker_frame_number = 0
+        self.snapshot_failures = 0
+        self.speakers_seen = set()
+        self.unreadable_canvases = set()
+        self.adaptive_rate = None
+        # webdriver calls made by the speaker capture, for the adaptive rate's budget
+        self.webdriver_calls = 0
+
+        # opts lean_browser blocks the media and assets the recording doesn't need
+        self.lean_browser = False
+        # usage of the browser and of the space page, measured with or without lean_browser
+        self.process_usage = None
+        self.page_usage = None
+        self.memory_watchdog = None
+        # the audio and persistence processes, with opts isolation processes
+        self.isolation = None
+        # how far off its interval each speaker capture tick runs
+        self.capture_jitter = JitterMeter()
+        # why the recording ended on its own before it could start, None if it didn't
+        self.failure = None
+        # run holds the driver while it joins, a stop meanwhile leaves the driver to it
+        self._joining = False
+        self._driver_lock = threading.Lock()
+        self._shutdown_lock = threading.Lock()
+        self._shut_down = False
 
     def run(self, fetch_space_metadata=True, fetch_audio=True, take_screenshots=False, opts={}):
         logger.info("running...")
+        self.join_started_at = time.time()
 
-        print("fetch_space_metadata", fetch_space_metadata)
-
-        # create space data json file
-        self._create_space_data_json_file()
-
-        if fetch_space_metadata:
-            # fetch space metadata and write to json file
-            try:
-                space_data = self.x_api.get_space_metadata(self.space_id)
-            except Exception as e:
-                logger.error(f"Failed to fetch space metadata: {str(e)}")
-                self._shutdown()
-                return
-
-            logger.info(f"Space data: {space_data}")
-            print(f"Space data: {space_data}")
-            # Convert started_at to unix timestamp
-            if "started_at" in space_data:
-                started_at = datetime.fromisoformat(space_data["started_at"])
-                space_data["started_at"] = int(started_at.timestamp())
-            if space_data is not None:
-                with open(self.space_data_json_file, "w") as f:
-                    json.dump(space_data, f, indent=2)
-                logger.info(f"Space data written to {self.space_data_json_file}")
-            else:
-                logger.error("Failed to fetch space metadata. space_data is None.")
-                self._shutdown()
-
-        # TODO: check if space has ended
+        self._configure(opts)
 
-        # set up selenium driver
-        self._setup_webdriver()
+        print("fetch_space_metadata", fetch_space_metadata)
 
-        # browser open x.com
-        logger.info("opening x.com...")
-        self.driver.get("https://x.com")
+        if not self._prepare_space_data(fetch_space_metadata, opts):
+            return
+        self.mark_join_latency("space_data")
 
-        # browser login with cookies
-        logger.info("loading cookies...")
+        with self._driver_lock:
+            self._joining = True
         try:
-            self._load_cookies()
-        except:
-            self._shutdown()
+            if not self._join(fetch_audio, take_screenshots, opts):
+                return
+        except Exception:
+            # the driver is the shutdown's to release now
+            self._joining_stopped(done=True)
+            raise
 
-        # browser navigate to the space
-        logger.info("joining space...")
-        self.driver.get(self.space_url)
+        # from here on the capture threads share the driver through the scheduler
+        self.scheduler.start()
 
-        # browser check if the space ended UI is shown
-        if self._get_button("Play recording", timeout=10):
-            logger.info("Space has ended. Quitting.")
-            self._shutdown()
-            return
+        # keeps the memory of long recordings in check, see MemoryWatchdog
+        self._start_memory_watchdog(opts, take_screenshots)
 
-        # browser click the join button
-        if start_listening_btn := self._get_button("Start listening", timeout=10):
-            start_listening_btn.click()
-            self.joined_space_at = int(time.time())
-            self._update_space_data("joined_at", self.joined_space_at)
-        else:
-            logger.error("Failed to join the X Space. The join button was not found.")
-            self._shutdown()
-            return
+        # sometimes there is an acknowledgement button that needs to be clicked, and the logged
+        # network events are counted before they pile up
+        def housekeeping():
+            self.dismiss_got_it()
+            read_network_log(self.driver)
 
-        # sometimes there is an acknowledgement button that needs to be clicked
         def dismiss_got_it():
-            while not self.stop_event.is_set():
-                try:
-                    if got_it_btn := self._get_button("Got it"):
-                        got_it_btn.click()
-                except:
-                    pass
-                sleep(10)
+            self._run_ticks(housekeeping, PRIORITY_HOUSEKEEPING, "housekeeping", lambda: 10)
 
         # Start the dismiss_got_it thread
         dismiss_thread = threading.Thread(target=dismiss_got_it, daemon=True)
         dismiss_thread.start()
         self.threads.append(dismiss_thread)
 
+        if opts.get("isolation", ISOLATION_THREADS) == ISOLATION_PROCESSES:
+            self.isolation = ProcessIsolation(self.output_dir, self.store.fsync_interval)
+            self.isolation.start_persistence()
+            if fetch_audio:
+                self.isolation.start_audio_download(
+                    self.x_cookie_file, self.space_url, self.twspace_dl.asr_format
+                )
+
         # Start the download_space_audio thread if fetching audio
-        if fetch_audio:
+        if fetch_audio and not self.isolation:
             self.twspace_dl_thread = threading.Thread(
                 target=self._download_space_audio, daemon=True
             )
@@ -191,17 +440,21 @@ class XSpaceBot:
             self.threads.append(self.twspace_dl_thread)
 
         # Start the capture_speaker_data thread
-        capture_thread = threading.Thread(
-            target=self._capture_speaker_data, args=(opts.get("speaker_data_fps", 1),), daemon=True
-        )
+        capture_thread = threading.Thread(target=self._capture_speaker_data, daemon=True)
         capture_thread.start()
         self.threads.append(capture_thread)
 
         # Optionally start the capture_webdriver_frames thread
         if take_screenshots:
             screenshot_fps = opts.get("screenshot_fps", 1)
+            self.frame_pipeline = self._build_frame_pipeline(opts)
+            screenshot_backend = opts.get("screenshot_backend", BACKEND_WEBDRIVER)
+            # chrome encodes clip and screencast frames straight to the output format
+            screenshot_format = opts.get("screenshot_format", "png").replace("jpg", "jpeg")
             screenshot_thread = threading.Thread(
-                target=self._capture_webdriver_frames, args=(screenshot_fps,), daemon=True
+                target=self._capture_webdriver_frames,
+                args=(screenshot_fps, screenshot_backend, screenshot_format),
+                daemon=True,
             )
             screenshot_thread.start()
             self.threads.append(screenshot_thread)
@@ -219,16 +472,333 @@ class XSpaceBot:
 
         logger.info("XSpaceBot run completed.")
 
+    # get the driver and join the space with it. the driver is held until joined (see
+    # _joining_stopped), returns True once the capture can start
+    def _join(self, fetch_audio, take_screenshots, opts):
+        if self._joining_stopped():
+            return False
+
+        if self.pool:
+            # a pooled browser is already logged in, go straight to the space
+            checkout_started_at = time.time()
+            self.driver = self.pool.checkout()
+            logger.info(f"checked out a browser in {time.time() - checkout_started_at:.2f}s")
+        elif self.owns_driver:
+            # set up selenium driver
+            self._setup_webdriver()
+
+            # browser login with cookies, no need to open x.com first
+            logger.info("loading cookies...")
+            try:
+                self._load_cookies()
+            except Exception as e:
+                if not self._joining_stopped(done=True):
+                    self.failure = f"failed to load cookies: {e}"
+                    self._shutdown()
+                return False
+        if self._joining_stopped():
+            return False
+        self.mark_join_latency("driver_ready")
+
+        if opts.get("engine", ENGINE_WEBDRIVER) == ENGINE_CDP:
+            # the engine joins on its own page, a stop from here on stops the engine first
+            if self._joining_stopped(done=True):
+                return False
+            # the engine prepares its own page, the engine imports this module's constants
+            from .engine import default_engine
+
+            # joining and every capture task run as coroutines on the shared engine
+            self.engine_space = default_engine().record(self, fetch_audio, take_screenshots, opts)
+            logger.info("XSpaceBot run handed over to the cdp engine.")
+            return False
+
+        # browser navigate to the space
+        logger.info("joining space...")
+        self.prepare_window(keep_avatars=take_screenshots)
+        self.driver.get(self.space_url)
+        self.mark_join_latency("page_loaded")
+        if self._joining_stopped():
+            return False
+
+        # wait for whichever state the space page shows first and click the join button
+        state = self.poll_join(timeout=JOIN_TIMEOUT)
+        if self._joining_stopped(done=True):
+            return False
+        if state != "joined":
+            self.failure = f"failed to join: {JOIN_FAILURES.get(state, state)}"
+            self._shutdown()
+            return False
+        return True
+
+    # Record in the current window of a driver shared with other spaces. the caller (see
+    # SpaceSupervisor) owns the driver, so it navigates to space_url, joins with poll_join and
+    # drives capture_speaker_tick. only the threads that don't touch the driver start here
+    def start_supervised(self, fetch_space_metadata=True, opts={}):
+        self.join_started_at = time.time()
+        self._configure(opts)
+        if not self._prepare_space_data(fetch_space_metadata, opts):
+            return False
+        self.mark_join_latency("space_data")
+        return True
+
+    # Once joined in supervised mode, start downloading the audio and writing the frames
+    def start_supervised_threads(self, fetch_audio=True):
+        if fetch_audio:
+            self.start_audio_download()
+        self._start_frame_batch_writer()
+
+    # Start the download_space_audio thread
+    def start_audio_download(self):
+        self.twspace_dl_thread = threading.Thread(target=self._download_space_audio, daemon=True)
+        self.twspace_dl_thread.start()
+        self.threads.append(self.twspace_dl_thread)
+
+    # Wait up to timeout (or only look once) for the space page to show any of the join states
+    # and click the join button if it is shown. returns "joined", the state that prevents
+    # joining, or None if the page showed nothing known in time. rejoin joins the space again in
+    # another window, without moving the join time the frames are timed from
+    def poll_join(self, timeout=None, rejoin=False):
+        def detect_join_state(driver):
+            # a stop ends the wait, with nothing found
+            return self.stop_event.is_set() or driver.execute_script(JOIN_STATE_JS)
+
+        try:
+            if timeout:
+                found = WebDriverWait(self.driver, timeout, poll_frequency=0.1).until(
+                    detect_join_state
+                )
+            else:
+                found = detect_join_state(self.driver)
+        except TimeoutException:
+            found = None
+
+        if self.stop_event.is_set():
+            return None
+        if not found:
+            if timeout:
+                logger.error("Failed to join the X Space. The join button was not found.")
+            return None
+
+        state = found["state"]
+        if not rejoin:
+            self.mark_join_latency(state)
+        if state == JOIN_ENDED:
+            logger.info("Space has ended. Quitting.")
+        elif state == JOIN_LOGIN_WALL:
+            logger.error("Failed to join the X Space. Not logged in, check the cookie file.")
+        elif state == JOIN_ERROR:
+            logger.error("Failed to join the X Space. The space page shows an error.")
+        else:
+            try:
+                found["element"].click()
+            except Exception as e:
+                # e.g. covered by an overlay for a moment, wait for it to become clickable
+                logger.warning(f"join button click failed, retrying: {e}")
+                start_listening_btn = self._get_button("Start listening", timeout=5)
+                if not start_listening_btn:
+                    return None
+                start_listening_btn.click()
+            if not rejoin:
+                self._mark_joined()
+            return "joined"
+        return state
+
+    # Click away the acknowledgement button, if it is shown
+    def dismiss_got_it(self):
+        try:
+            if got_it_btn := self._get_button("Got it", timeout=None):
+                got_it_btn.click()
+        except:
+            pass
+
+    # a screencast is tied to its window, so its recording can't move to a fresh one
+    def _start_memory_watchdog(self, opts, take_screenshots):
+        screencast = opts.get("screenshot_backend", BACKEND_WEBDRIVER) == BACKEND_SCREENCAST
+        try:
+            self.memory_watchdog = MemoryWatchdog(
+                self,
+                check_interval=float(opts.get("memory_check_interval", MEMORY_CHECK_INTERVAL)),
+                browser_rss_limit_mb=float(opts.get("browser_rss_limit_mb", BROWSER_RSS_LIMIT_MB)),
+                python_rss_limit_mb=float(opts.get("python_rss_limit_mb", PYTHON_RSS_LIMIT_MB)),
+                recycle=not (take_screenshots and screencast),
+            )
+            self.memory_watchdog.start()
+        except Exception as e:
+            logger.warning(f"failed to start the memory watchdog: {e}")
+
+    # the pipeline saving the screenshots, as configured by opts
+    def _build_frame_pipeline(self, opts):
+        screenshot_fps = opts.get("screenshot_fps", 1)
+        # "frames" saves every screenshot as an image, "video" encodes one video file
+        if opts.get("screenshot_output", "frames") == "video":
+            sink = VideoSink(os.path.join(self.output_dir, SCREENSHOTS_VIDEO), screenshot_fps)
+        else:
+            sink = ImageFileSink(self.captured_frames_dir, opts.get("screenshot_format", "png"))
+        return FramePipeline(
+            sink,
+            workers=int(opts.get("screenshot_workers", 2)),
+            max_queue=int(opts.get("screenshot_queue_size", 32)),
+            drop_policy=opts.get("screenshot_drop_policy", DROP_OLDEST),
+        )
+
+    # read the capture options
+    def _configure(self, opts):
+        self.speaking_threshold = float(opts.get("speaking_threshold", SPEAKING_SCORE_THRESHOLD))
+        self.roster_cache.refresh_interval = float(
+            opts.get("roster_refresh_interval", ROSTER_REFRESH_INTERVAL)
+        )
+        self.speaker_capture_mode = opts.get("speaker_capture_mode", SPEAKER_CAPTURE_SCRIPT)
+        self.speaker_data_fps = float(opts.get("speaker_data_fps", 1))
+        if opts.get("speaker_rate", SPEAKER_RATE_FIXED) == SPEAKER_RATE_ADAPTIVE:
+            self.adaptive_rate = AdaptiveRate(
+                min_fps=float(opts.get("speaker_min_fps", 0.5)),
+                max_fps=float(opts.get("speaker_max_fps", 4)),
+                calls_per_minute=float(opts.get("webdriver_calls_per_minute", 240)),
+            )
+        self.max_buffered_frames = int(opts.get("max_buffered_frames", MAX_BUFFERED_FRAMES))
+        self.sampler_hz = float(opts.get("sampler_hz", SAMPLER_HZ))
+        self.sampler_drain_interval = float(
+            opts.get("sampler_drain_interval", SAMPLER_DRAIN_INTERVAL)
+        )
+        self.lean_browser = str(opts.get("lean_browser", False)).lower() in ("1", "true", "yes")
+        # the audio is also written as 16 kHz mono flac (or wav) for transcription, "none" skips it
+        asr_format = opts.get("asr_audio", ASR_FLAC)
+        self.twspace_dl.asr_format = asr_format if asr_format in ASR_FORMATS else None
+
+    # reset the space data and write the space metadata, returns False if the bot shut down
+    def _prepare_space_data(self, fetch_space_metadata, opts):
+        # create space data json file
+        fsync_interval = opts.get("fsync_interval", DEFAULT_FSYNC_INTERVAL)
+        self.store.fsync_interval = None if fsync_interval is None else float(fsync_interval)
+        self.store.reset(RUN_STREAMS)
+
+        if fetch_space_metadata:
+            # fetch space metadata and write to json file
+            try:
+                space_data = self.x_api.get_space_metadata(self.space_id)
+            except Exception as e:
+                logger.error(f"Failed to fetch space metadata: {str(e)}")
+                self.failure = f"failed to fetch the space metadata: {e}"
+                self._shutdown()
+                return False
+
+            logger.info(f"Space data: {space_data}")
+            print(f"Space data: {space_data}")
+            if space_data is None:
+                logger.error("Failed to fetch space metadata. space_data is None.")
+                self.failure = "failed to fetch the space metadata"
+                self._shutdown()
+                return False
+            # Convert started_at to unix timestamp
+            if "started_at" in space_data:
+                started_at = datetime.fromisoformat(space_data["started_at"])
+                space_data["started_at"] = int(started_at.timestamp())
+            self.store.write_metadata(space_data)
+            logger.info(f"Space data written to {self.space_data_json_file}")
+        return True
+
+    def _mark_joined(self):
+        self.joined_space_at = time.time()
+        self._update_space_data("joined_at", self.joined_space_at)
+        self.mark_join_latency("joined")
+
+    # seconds from the join request to a join milestone, saved with the space data
+    def mark_join_latency(self, milestone):
+        if self.join_started_at is None:
+            return
+        self.join_latency[milestone] = round(time.time() - self.join_started_at, 3)
+        self._update_space_data("join_latency", self.join_latency)
+
     # Stop all threads and quit the driver
     def stop(self):
         self._shutdown()
 
+    # progress of the recording: frames captured, the rate achieved, audio downloaded and the
+    # users heard so far
+    def status(self):
+        recording_seconds = time.time() - self.joined_space_at if self.joined_space_at else None
+        return {
+            "space_id": self.space_id,
+            "joined_at": self.joined_space_at,
+            "frames": self.speaker_frame_number,
+            "fps": (
+                round(self.speaker_frame_number / recording_seconds, 2)
+                if recording_seconds
+                else None
+            ),
+            "audio_bytes": self._audio_bytes(),
+            "speakers_seen": sorted(self.speakers_seen),
+        }
+
+    def _audio_bytes(self):
+        total = 0
+        for root, dirs, files in os.walk(self.output_dir):
+            # skip the screenshots
+            dirs[:] = [d for d in dirs if os.path.join(root, d) != self.captured_frames_dir]
+            for name in files:
+                if name.endswith(AUDIO_EXTENSIONS):
+                    try:
+                        total += os.path.getsize(os.path.join(root, name))
+                    except OSError:
+                        pass
+        return total
+
+    # hit/miss counters of the participant username caches, for tuning
+    def roster_cache_stats(self):
+        return {"page": self.page_roster_stats, "elements": self.roster_cache.stats()}
+
+    # stop the recording once, later calls only let go of a driver the run got hold of while
+    # joining after the stop
     def _shutdown(self):
+        with self._shutdown_lock:
+            if not self._shut_down:
+                self._shut_down = True
+                self._stop_recording()
+            self._release_driver()
+        logger.info("Shutdown complete.")
+
+    # the run checks between the join steps whether the bot was stopped meanwhile, and if so
+    # releases the driver the stop left to it and ends. done hands the driver over either way
+    def _joining_stopped(self, done=False):
+        with self._driver_lock:
+            stopped = self.stop_event.is_set()
+            if stopped or done:
+                self._joining = False
+        if stopped:
+            logger.info("stopped while joining the space")
+            self._shutdown()
+        return stopped
+
+    def _stop_recording(self):
         logger.info("Initiating shutdown...")
         self.stop_event.set()  # Signal all threads to stop
+        # the recording stops now, the speaking intervals still open end here
+        stopped_at = None
+        if self.joined_space_at is not None:
+            stopped_at = round(time.time() - self.joined_space_at, 3)
 
         self.twspace_dl.cancel_download()
 
+        # stop the engine's tasks before their frames are flushed
+        if self.engine_space:
+            self.engine_space.stop()
+
+        # let the running driver command finish and drop the queued ones
+        self.scheduler.stop()
+        if driver_command_stats := self.scheduler.stats():
+            logger.info(f"driver commands: {driver_command_stats}")
+            self.store.update("driver_commands", driver_command_stats)
+
+        # the persistence process writes the frames still in the ring before it exits
+        tick_jitter = {"capture": self.capture_jitter.stats()}
+        # the persistence process closes the intervals it builds, reporting when it did
+        intervals_closed = not self.isolation
+        if self.isolation:
+            tick_jitter.update(self.isolation.stop(stopped_at))
+            intervals_closed = "intervals_closed_at" in tick_jitter.get("persistence", {})
+        logger.info(f"tick jitter: {tick_jitter}")
+        self.store.update("tick_jitter", tick_jitter)
+
         # Wait for all threads to finish with a timeout
         # for thread in self.threads:
         #     thread_name = thread.name if hasattr(thread, "name") else "Unknown"
@@ -237,184 +807,431 @@ class XSpaceBot:
         #     if thread.is_alive():
         #         logger.warning(f"Thread {thread_name} did not finish in time.")
 
-        # Quit the Selenium driver
-        if self.driver:
+        self._save_browser_usage()
+
+        # save the screenshots still queued
+        if self.frame_pipeline:
+            self.frame_pipeline.stop()
+            screenshot_stats = self.frame_pipeline.stats()
+            logger.info(f"screenshots: {screenshot_stats}")
+            self.store.update("screenshot_stats", screenshot_stats)
+
+        self.store.update("roster_cache", self.roster_cache_stats())
+
+        # flush the frames still buffered and the intervals still open
+        with self.batch_lock:
+            frame_batch = self.frame_batch_buffer.copy()
+            self.frame_batch_buffer.clear()
+        with self.frame_write_lock:
+            self._write_frames(frame_batch)
+            intervals = self.interval_builder.close(stopped_at)
+            self.store.append(INTERVALS_STREAM, (interval._asdict() for interval in intervals))
+        # mark the interval log complete, a crashed run's is rebuilt from its frames instead
+        if stopped_at is not None and intervals_closed:
+            self.store.update(INTERVALS_CLOSED_AT, stopped_at)
+        self.store.close()
+
+    # hand a pooled driver back or quit our own, unless the run is still joining with it
+    def _release_driver(self):
+        with self._driver_lock:
+            # a driver shared with other spaces is left to its owner
+            if self._joining or not self.driver or not (self.pool or self.owns_driver):
+                return
+            driver, self.driver = self.driver, None
+
+        # a space that was never joined may have broken the browser
+        if self.pool:
+            logger.info("Returning browser to the pool...")
+            self.pool.checkin(driver, recycle=self.joined_space_at is None)
+        else:
             logger.info("Quitting Selenium driver...")
             try:
-                self.driver.quit()
+                driver.quit()
             except Exception as e:
                 logger.error(f"Error quitting Selenium driver: {e}")
 
-        logger.info("Shutdown complete.")
-
     # Set up the selenium driver
     def _setup_webdriver(self):
-        options = webdriver.ChromeOptions()
-        if self.headless:
-            options.add_argument("--headless=new")
-        options.add_argument("--mute-audio")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        # TODO: make this frame longer to capture more speakers without having to scroll
-        options.add_argument("--window-size=375,2000")
-        options.add_argument(
-            "--user-agent=Mozilla/5.0 (iPhone; CPU iPhone OS 13_2_3 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.0.3 Mobile/15E148 Safari/604.1"
-        )
+        self.driver = create_webdriver(self.headless, LEAN_CHROME_ARGS if self.lean_browser else ())
 
-        # Use Service class to set up ChromeDriver
-        service = Service(ChromeDriverManager().install())
-        self.driver = webdriver.Chrome(service=service, options=options)
+    # set up the driver's current window before it navigates to the space: measure its usage
+    # and, with lean_browser, block the requests it doesn't need. avatars are only needed in
+    # screenshots
+    def prepare_window(self, keep_avatars=True):
+        try:
+            prepare_page(self.driver, self.lean_browser, keep_avatars)
+        except Exception as e:
+            logger.warning(f"failed to prepare the browser window: {e}")
+        self._track_browser_usage()
 
-    # Load cookies into the selenium driver
-    def _load_cookies(self):
+    def _track_browser_usage(self):
         try:
-            with open(self.x_cookie_file, "r") as f:
-                cookies = f.readlines()
-        except FileNotFoundError:
-            logger.error(f"cookie file not found: {self.x_cookie_file}")
-            raise
+            self.process_usage = BrowserProcessUsage(self.driver)
         except Exception as e:
-            logger.error(f"Error loading cookies: {e}")
-            raise
+            logger.warning(f"failed to track the browser usage: {e}")
+
+    # usage of the space page, in the driver's current window
+    def measure_page_usage(self):
+        try:
+            self.page_usage = measure_page(self.driver)
+        except Exception as e:
+            logger.warning(f"failed to measure the page usage: {e}")
+
+    # bandwidth and cpu of the recording, to compare runs with and without lean_browser
+    def _save_browser_usage(self):
+        # a shared browser's window is measured by its owner, the engine measures its own page
+        own_window = self.owns_driver or self.pool
+        if self.driver and own_window and not self.engine_space and self.page_usage is None:
+            self.measure_page_usage()
+        if self.process_usage is None and self.page_usage is None:
+            return
 
-        for cookie in cookies:
-            fields = cookie.strip().split("\t")
-            if len(fields) >= 7:
-                cookie_dict = {
-                    "name": fields[5],
-                    "value": fields[6],
-                    "domain": fields[0],
-                    "path": fields[2],
-                    "expires": int(fields[4]) if fields[4].isdigit() else None,
-                    "secure": fields[3] == "TRUE",
-                }
-                self.driver.add_cookie(cookie_dict)
+        browser_usage = {
+            "lean": self.lean_browser,
+            "page": self.page_usage,
+            "browser": self.process_usage.usage() if self.process_usage else None,
+        }
+        logger.info(f"browser usage: {browser_usage}")
+        self.store.update("browser_usage", browser_usage)
+
+    # Load cookies into the selenium driver
+    def _load_cookies(self):
+        load_cookies_into_driver(self.driver, self.x_cookie_file)
 
     # Capture and save webdriver frames at a specified frame rate
-    def _capture_webdriver_frames(self, fps=1):
+    def _capture_webdriver_frames(self, fps=1, backend=BACKEND_WEBDRIVER, image_format="png"):
         try:
-            logger.info("recording frames...")
+            logger.info(f"recording frames ({backend})...")
             frame_number = 0
-            buffer = []
             interval = 1 / fps
+            self.frame_pipeline.start()
 
-            def save_frames():
-                while not self.stop_event.is_set():
-                    if buffer:
-                        frame_data = buffer.pop(0)
-                        frame_data[0].save(
-                            os.path.join(self.captured_frames_dir, f"{frame_data[1]:05d}.png")
-                        )
+            if backend == BACKEND_SCREENCAST:
+                frame_format = screencast_format(image_format)
 
-            threading.Thread(target=save_frames, daemon=True).start()
+                def on_frame(data, captured_at):
+                    nonlocal frame_number
+                    timestamp = round(captured_at - self.joined_space_at, 3)
+                    self.frame_pipeline.submit(data, frame_number, timestamp, frame_format)
+                    frame_number += 1
 
-            while not self.stop_event.is_set():
+                run_screencast(self.driver, on_frame, self.stop_event, frame_format, fps=fps)
+                return
+
+            clip = None
+
+            def capture_frame():
+                nonlocal clip, frame_number
                 start_time = time.time()
 
-                screenshot = self.driver.get_screenshot_as_png()
-                image = Image.open(io.BytesIO(screenshot))
-                buffer.append((image, frame_number))
+                if backend == BACKEND_CLIP:
+                    # the participants move as people join the stage, refresh the clip now and then
+                    if clip is None or frame_number % CLIP_REFRESH_FRAMES == 0:
+                        clip = participants_clip(self.driver)
+                    screenshot = capture_clip(self.driver, clip, image_format)
+                    screenshot_format = image_format
+                else:
+                    screenshot = self.driver.get_screenshot_as_png()
+                    screenshot_format = "png"
+                timestamp = round(start_time - self.joined_space_at, 3)
+                self.frame_pipeline.submit(screenshot, frame_number, timestamp, screenshot_format)
                 frame_number += 1
 
-                # Calculate sleep time to maintain desired fps
-                elapsed_time = time.time() - start_time
-                sleep_time = max(0, interval - elapsed_time)
-                time.sleep(sleep_time)
+            self._run_ticks(capture_frame, PRIORITY_SCREENSHOTS, "screenshots", lambda: interval)
         except Exception as e:
             logger.error(f"failed to capture frames: {e}")
             raise
 
-    # capture and save which users are speaking at a specified fps
-    def _capture_speaker_data(self, fps=1):
+    # capture and save which users are speaking, one tick at a time
+    def _capture_speaker_data(self):
         try:
-            logger.info("recording speaker data...")
-            frame_number = 0
-            interval = 1 / fps
-            frame_batch_buffer = {}
-
-            def write_batch():
-                while not self.stop_event.is_set():
-                    if frame_batch_buffer:
-                        with self.batch_lock:
-                            frame_batch = frame_batch_buffer.copy()
-                            frame_batch_buffer.clear()
-                        self._update_space_data_frames(frame_batch)
-                    time.sleep(1)  # Adjust sleep time as needed
-
-            # Start the batch writing thread
-            self.batch_lock = threading.Lock()
-            threading.Thread(target=write_batch, daemon=True).start()
-            self.threads.append(threading.current_thread())  # Track the write_batch thread
-
-            while not self.stop_event.is_set():
-                capture_started_at = time.time()
-
-                speaking_elements = self.driver.find_elements(
-                    By.XPATH,
-                    "//div[@id='ParticipantsWrapper']//div[contains(@class, 'css-175oi2r') and contains(@class, 'r-1awozwy') and contains(@class, 'r-6koalj') and contains(@class, 'r-18u37iz') and contains(@class, 'r-1777fci')]",
-                )
-
-                speaker_data = {
-                    "timestamp": int(time.time()) - self.joined_space_at,  # Use relative timestamp
-                    "speakers": [],
-                }
-                if speaking_elements:
-                    print(f"speaking_elements: {speaking_elements}")
-                    for speaking_elem in speaking_elements:
-                        try:
-                            canvas = speaking_elem.find_element(By.TAG_NAME, "canvas")
-                            if not canvas:
-                                continue
-
-                            data_url = self.driver.execute_script(
-                                "return arguments[0].toDataURL('image/png');", canvas
-                            )
-
-                            # TODO: we should be able to determine how likely a user is to be speaking
-                            # by how much their canvas is filling the screen
-                            if not animation_above_threshold(data_url):
-                                continue
-
-                            # Fetch the username
-                            try:
-                                username_elem = speaking_elem.find_element(
-                                    By.XPATH,
-                                    "./ancestor::div[contains(@class, 'css-175oi2r') and contains(@class, 'r-1awozwy')]"
-                                    "//span[contains(@class, 'css-1jxf684') and contains(@class, 'r-poiln3')]",
-                                )
-                                username = (
-                                    username_elem.text.strip() if username_elem else "Unknown"
-                                )
-                            except Exception as e:
-                                logger.error(f"Failed to retrieve username: {e}")
-                                username = "Unknown"
-
-                            speaker = {
-                                # TODO: we should be able to determine how likely a user is to be speaking
-                                # by how much their canvas is filling the screen
-                                "username": username,
-                            }
-                            speaker_data["speakers"].append(speaker)
-                        except Exception as e:
-                            logger.error(f"Failed to capture canvas data: {e}")
-
-                with self.batch_lock:
-                    frame_batch_buffer[str(frame_number)] = speaker_data
-
-                frame_number += 1
-
-                # Calculate sleep time to maintain desired fps
-                elapsed_time = time.time() - capture_started_at
-                sleep_time = max(0, interval - elapsed_time)
-                time.sleep(sleep_time)
-
+            logger.info(f"recording speaker data ({self.speaker_capture_mode})...")
+            # isolated, the frames are written by the persistence process
+            if not self.isolation:
+                self._start_frame_batch_writer()
+            self._run_ticks(
+                self.capture_speaker_tick,
+                PRIORITY_SPEAKERS,
+                "speakers",
+                self.speaker_tick_interval,
+            )
         except Exception as e:
             logger.error(f"failed to capture speaker data: {e}")
             raise
 
+    # submit fn to the driver scheduler every interval() seconds until the bot stops, without
+    # waiting for it. a tick still queued absorbs the next one, and a tick queued for longer
+    # than an interval is dropped as stale
+    def _run_ticks(self, fn, priority, kind, interval):
+        def log_failure(future):
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None and not isinstance(error, CommandExpired):
+                logger.error(f"{kind} tick failed: {error}")
+
+        next_tick = time.time()
+        last_future = None
+        while not self.stop_event.is_set():
+            tick_interval = interval()
+            future = self.scheduler.submit(
+                fn, priority, kind, deadline=tick_interval, coalesce_key=kind
+            )
+            if future is not last_future:
+                future.add_done_callback(log_failure)
+                last_future = future
+
+            # a late tick is not made up for
+            next_tick = max(next_tick + tick_interval, time.time())
+            self.stop_event.wait(next_tick - time.time())
+
+    # seconds between speaker capture ticks
+    def speaker_tick_interval(self):
+        if self.speaker_capture_mode == SPEAKER_CAPTURE_SAMPLER:
+            return self.sampler_drain_interval
+        if self.adaptive_rate:
+            return self.adaptive_rate.interval()
+        return 1 / self.speaker_data_fps
+
+    # Capture one tick of speaker data in the driver's current window: a single frame, or the
+    # transitions drained from the in-page sampler. returns the number of frames buffered
+    def capture_speaker_tick(self):
+        self.capture_jitter.tick(self.speaker_tick_interval())
+        if self.speaker_capture_mode == SPEAKER_CAPTURE_SAMPLER:
+            frames = self._drain_speaker_sampler()
+        else:
+            calls = self.webdriver_calls
+            frames = [self._capture_speaker_frame()]
+            if self.adaptive_rate:
+                self._adapt_speaker_rate(frames[0], self.webdriver_calls - calls)
+
+        return self.buffer_frames(frames)
+
+    # let the adaptive rate follow the frame's speakers, changes are saved with the space data
+    def _adapt_speaker_rate(self, frame, calls):
+        usernames = [speaker["username"] for speaker in frame["speakers"]]
+        reason = self.adaptive_rate.observe(usernames, calls)
+        if reason:
+            fps = round(self.adaptive_rate.fps, 3)
+            logger.debug(f"speaker sampling at {fps} fps ({reason})")
+            self.store.append(
+                SAMPLE_RATES_STREAM,
+                [{"timestamp": frame["timestamp"], "fps": fps, "reason": reason}],
+            )
+
+    # number the captured frames and buffer them for the frame batch writer. past
+    # max_buffered_frames the writer is falling behind and the frames are written out right away
+    def buffer_frames(self, frames):
+        for frame in frames:
+            self.speakers_seen.update(speaker["username"] for speaker in frame["speakers"])
+
+        if frames and self.isolation:
+            with self.batch_lock:
+                for frame in frames:
+                    if not self.isolation.push_frame(self.speaker_frame_number, frame):
+                        logger.warning(f"frame ring is full, dropped {self.speaker_frame_number}")
+                    self.speaker_frame_number += 1
+            return len(frames)
+
+        if frames:
+            with self.batch_lock:
+                for frame in frames:
+                    self.frame_batch_buffer[str(self.speaker_frame_number)] = frame
+                    self.speaker_frame_number += 1
+                buffered = len(self.frame_batch_buffer)
+            if buffered > self.max_buffered_frames:
+                logger.warning(f"{buffered} frames buffered, writing them out")
+                self.flush_frame_batch()
+        return len(frames)
+
+    # the users speaking right now
+    def _capture_speaker_frame(self):
+        speakers = None
+        if self.speaker_capture_mode == SPEAKER_CAPTURE_SCRIPT:
+            try:
+                speakers = self._snapshot_speakers()
+                self.snapshot_failures = 0
+            except Exception as e:
+                self.snapshot_failures += 1
+                logger.error(f"speaker snapshot failed, falling back to elements: {e}")
+                if self.snapshot_failures >= SPEAKER_SNAPSHOT_MAX_FAILURES:
+                    logger.warning("speaker snapshot keeps failing, switching to elements")
+                    self.speaker_capture_mode = SPEAKER_CAPTURE_ELEMENTS
+        if speakers is None:
+            speakers = self._find_speakers_by_element()
+
+        return {
+            # relative timestamp, in seconds with millisecond precision
+            "timestamp": round(time.time() - self.joined_space_at, 3),
+            "speakers": speakers,
+        }
+
+    # drain the speaking transitions sampled in the page since the last drain. every
+    # transition becomes a frame holding the set of users speaking from that moment on
+    def _drain_speaker_sampler(self):
+        if not self.sampler_installed:
+            logger.info(f"installing speaker sampler ({self.sampler_hz}hz)...")
+            self._install_speaker_sampler(self.sampler_hz)
+            self.sampler_installed = True
+            return []
+
+        drained = self.driver.execute_script(SPEAKER_SAMPLER_DRAIN_JS)
+        if drained is None:
+            logger.warning("speaker sampler is gone, reinstalling")
+            self._install_speaker_sampler(self.sampler_hz)
+            # the fresh sampler only reports transitions from now on, whoever was speaking in
+            # the lost one is closed with an empty frame rather than left speaking
+            if not self.sampler_speaking:
+                return []
+            self.sampler_speaking = {}
+            # relative timestamp, in seconds with millisecond precision
+            return [{"timestamp": round(time.time() - self.joined_space_at, 3), "speakers": []}]
+        return self._frames_from_sampler_drain(drained)
+
+    # turn the transitions drained from the sampler into frames
+    def _frames_from_sampler_drain(self, drained):
+        self.page_roster_stats = drained["roster"]
+        if drained["dropped"]:
+            logger.warning(f"speaker sampler dropped {drained['dropped']} events")
+        for username in drained.get("unreadable", []):
+            self._warn_unreadable_canvas(username)
+
+        frames = []
+        speaking = self.sampler_speaking
+        for event in drained["events"]:
+            if event["speaking"]:
+                speaking[event["username"]] = round(event["score"], 3)
+            else:
+                speaking.pop(event["username"], None)
+
+            # relative timestamp, in seconds with millisecond precision
+            timestamp = round(event["t"] / 1000 - self.joined_space_at, 3)
+            speakers = [
+                {"username": username, "confidence": confidence}
+                for username, confidence in speaking.items()
+            ]
+            # transitions sampled at the same moment collapse into one frame
+            if frames and frames[-1]["timestamp"] == timestamp:
+                frames[-1]["speakers"] = speakers
+                continue
+            frames.append({"timestamp": timestamp, "speakers": speakers})
+        return frames
+
+    # a canvas whose pixels can't be read always counts as not speaking, say so once per user
+    # rather than recording silence without a trace
+    def _warn_unreadable_canvas(self, username):
+        if username in self.unreadable_canvases:
+            return
+        self.unreadable_canvases.add(username)
+        logger.warning(f"can't read the speaker canvas of {username}, their speaking is not scored")
+
+    def _install_speaker_sampler(self, hz):
+        self.driver.execute_script(
+            SPEAKER_SAMPLER_INSTALL_JS,
+            PARTICIPANT_XPATH,
+            USERNAME_XPATH,
+            hz,
+            self.speaking_threshold,
+            SAMPLER_MAX_EVENTS,
+            self.roster_cache.refresh_interval * 1000,
+        )
+
+    # periodically flush the buffered frames to the space data json file
+    def _start_frame_batch_writer(self):
+        def write_batch():
+            while not self.stop_event.is_set():
+                self.flush_frame_batch()
+                time.sleep(1)  # Adjust sleep time as needed
+
+        # Start the batch writing thread
+        threading.Thread(target=write_batch, daemon=True).start()
+        self.threads.append(threading.current_thread())  # Track the write_batch thread
+
+    # write the buffered frames to the space data
+    def flush_frame_batch(self):
+        if self.frame_batch_buffer:
+            with self.batch_lock:
+                frame_batch = self.frame_batch_buffer.copy()
+                self.frame_batch_buffer.clear()
+            self._update_space_data_frames(frame_batch)
+
+    # Get the speaking users with a single injected script call
+    def _snapshot_speakers(self):
+        self.webdriver_calls += 1
+        snapshot = self.driver.execute_script(
+            SPEAKER_SNAPSHOT_JS,
+            PARTICIPANT_XPATH,
+            USERNAME_XPATH,
+            self.roster_cache.refresh_interval * 1000,
+        )
+        return self._speakers_from_snapshot(snapshot)
+
+    # the speaking users of a SPEAKER_SNAPSHOT_JS result
+    def _speakers_from_snapshot(self, snapshot):
+        if snapshot is None:
+            raise RuntimeError("speaker snapshot script returned nothing")
+
+        self.page_roster_stats = snapshot["roster"]
+        participants = snapshot["participants"]
+        for participant in participants:
+            if participant["score"] is None:
+                self._warn_unreadable_canvas(participant["username"])
+        return [
+            {"username": participant["username"], "confidence": round(participant["score"], 3)}
+            for participant in participants
+            if score_above_threshold(participant["score"], self.speaking_threshold)
+        ]
+
+    # Get the speaking users by querying each participant element separately
+    def _find_speakers_by_element(self):
+        speakers = []
+        # a re-rendered row can keep its element and show someone else, so the cached usernames
+        # are dropped whenever the rows change
+        roster_version = self.driver.execute_script(ROSTER_VERSION_JS)
+        if roster_version != self.roster_version:
+            if self.roster_version is not None:
+                self.roster_cache.invalidate()
+            self.roster_version = roster_version
+
+        speaking_elements = self.driver.find_elements(By.XPATH, PARTICIPANT_XPATH)
+        # the version and the lookup, then the canvas and its score per participant
+        self.webdriver_calls += 2 + 2 * len(speaking_elements)
+        for speaking_elem in speaking_elements:
+            try:
+                canvas = speaking_elem.find_element(By.TAG_NAME, "canvas")
+                if not canvas:
+                    continue
+
+                score = self.driver.execute_script(CANVAS_SCORE_JS, canvas)
+                if score is None:
+                    self._warn_unreadable_canvas(self._element_username(speaking_elem))
+                if not score_above_threshold(score, self.speaking_threshold):
+                    continue
+
+                username = self._element_username(speaking_elem)
+                speakers.append({"username": username, "confidence": round(score, 3)})
+            except Exception as e:
+                logger.error(f"Failed to capture canvas data: {e}")
+        return speakers
+
+    # the username of a participant element, cached by its element id until the rows change
+    def _element_username(self, speaking_elem):
+        username = self.roster_cache.get(speaking_elem.id)
+        if username is None:
+            self.webdriver_calls += 2
+            try:
+                username_elem = speaking_elem.find_element(By.XPATH, USERNAME_XPATH)
+                username = username_elem.text.strip() if username_elem else "Unknown"
+                self.roster_cache.put(speaking_elem.id, username)
+            except Exception as e:
+                logger.error(f"Failed to retrieve username: {e}")
+                username = "Unknown"
+        return username
+
     # Download space audio using twspace_dl
-    # if the space is already running, the audio will be downloaded from the live stream
-    # starting from the joined_at timestamp
+    # if the space is already running, the live playlist is tailed from the joined_at timestamp,
+    # appending only the new segments (see LiveTail), until the space ends or the bot stops. the
+    # replay of the space up to then is fetched meanwhile and muxed in before the tail
     def _download_space_audio(self):
         try:
             logger.info("downloading audio...")
@@ -422,8 +1239,8 @@ class XSpaceBot:
             # os.makedirs(self.downloaded_audio_dir, exist_ok=True)
             # os.chdir(self.downloaded_audio_dir)
 
-            while not self.stop_event.is_set():
-                self.twspace_dl.download(self.output_dir)
+            self.twspace_dl.live_tail(self.output_dir, self.store)
+            self.store.update("playlist_requests", self.twspace_dl.playlist_cache.stats())
 
             # os.chdir(current_dir)
         except Exception as e:
@@ -439,34 +1256,23 @@ class XSpaceBot:
                     EC.element_to_be_clickable(locator)
                 )
             return self.driver.find_element(*locator)
-        except TimeoutException:
+        except (TimeoutException, NoSuchElementException):
             return None
 
-    # Create space data json file
-    def _create_space_data_json_file(self):
-        with open(self.space_data_json_file, "w") as f:
-            json.dump({}, f, indent=2)
-
     # Update space data json file
     def _update_space_data(self, key, value):
-        with open(self.space_data_json_file, "r") as f:
-            space_data = json.load(f)
-        space_data[key] = value
-        with open(self.space_data_json_file, "w") as f:
-            json.dump(space_data, f, indent=2)
+        self.store.update(key, value)
         # logger.info(f"Updated space data with {key}: {value}")
 
-    # Update space data json file in batches
+    # Append frames to the space's frame log in batches
     def _update_space_data_frames(self, frame_batch_data):
         logging.info(frame_batch_data)
-        with open(self.space_data_json_file, "r+") as f:
-            space_data = json.load(f)
-            if "frames" not in space_data:
-                space_data["frames"] = {}
-            space_data["frames"].update(frame_batch_data)
-            f.seek(0)
-            json.dump(space_data, f, indent=2)
-            f.truncate()
+        with self.frame_write_lock:
+            self._write_frames(frame_batch_data)
+
+    # log the frames and the speaking intervals they close
+    def _write_frames(self, frame_batch_data):
+        write_frames(self.store, self.interval_builder, frame_batch_data)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+import asyncio
+import itertools
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+import websockets
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait for chrome to answer a command
+COMMAND_TIMEOUT = 30
+
+
+class CDPError(Exception):
+    """Error answered by chrome to a devtools command"""
+
+
+def debugger_address(driver) -> str:
+    """host:port of the devtools server of a chrome started by selenium"""
+    return driver.capabilities["goog:chromeOptions"]["debuggerAddress"]
+
+
+def browser_websocket_url(address: str) -> str:
+    """Websocket url of the browser target of the devtools server at address"""
+    response = requests.get(f"http://{address}/json/version", timeout=10)
+    response.raise_for_status()
+    return response.json()["webSocketDebuggerUrl"]
+
+
+def script_expression(script: str, *args) -> str:
+    """
+    Expression running a selenium style script (a function body reading arguments[i]) with
+    json serializable args, for Runtime.evaluate
+    """
+    return f"(function() {{\n{script}\n}}).apply(null, {json.dumps(list(args))})"
+
+
+class CDPConnection:
+    """
+    One devtools websocket to chrome.
+
+    Pages are driven through sessions attached to their targets (flat mode), so a single
+    connection multiplexes the commands and events of every space recorded in the browser.
+    """
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        # (session id, event method) -> queues of the subscribers
+        self._subscribers: Dict[Tuple[Optional[str], str], List[asyncio.Queue]] = {}
+        self._reader = asyncio.get_running_loop().create_task(self._read())
+
+    @classmethod
+    async def connect(cls, websocket_url: str) -> "CDPConnection":
+        # screenshots easily exceed the default message size limit
+        return cls(await websockets.connect(websocket_url, max_size=None))
+
+    @property
+    def closed(self) -> bool:
+        return self._reader.done()
+
+    async def send(
+        self,
+        method: str,
+        params: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+        timeout: float = COMMAND_TIMEOUT,
+    ) -> Dict[str, Any]:
+        if self.closed:
+            raise ConnectionError("devtools connection is closed")
+        message_id = next(self._ids)
+        message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        try:
+            await self._websocket.send(json.dumps(message))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(message_id, None)
+
+    def subscribe(self, method: str, session_id: Optional[str] = None) -> asyncio.Queue:
+        """Queue receiving the params of every method event, until unsubscribed"""
+        queue = asyncio.Queue()
+        self._subscribers.setdefault((session_id, method), []).append(queue)
+        return queue
+
+    def unsubscribe(self, method: str, queue: asyncio.Queue, session_id: Optional[str] = None):
+        queues = self._subscribers.get((session_id, method), [])
+        if queue in queues:
+            queues.remove(queue)
+
+    async def new_page(self, url: str = "about:blank") -> "CDPSession":
+        """Open url in a new window and attach a session to it"""
+        # a window rather than a tab, chrome throttles background tabs
+        target = await self.send("Target.createTarget", {"url": url, "newWindow": True})
+        attached = await self.send(
+            "Target.attachToTarget", {"targetId": target["targetId"], "flatten": True}
+        )
+        return CDPSession(self, target["targetId"], attached["sessionId"])
+
+    async def close(self) -> None:
+        self._reader.cancel()
+        await self._websocket.close()
+
+    async def _read(self) -> None:
+        try:
+            async for raw in self._websocket:
+                message = json.loads(raw)
+                if "id" in message:
+                    future = self._pending.get(message["id"])
+                    if future is None or future.done():
+                        continue
+                    if "error" in message:
+                        future.set_exception(CDPError(message["error"].get("message")))
+                    else:
+                        future.set_result(message.get("result", {}))
+                    continue
+
+                key = (message.get("sessionId"), message.get("method"))
+                for queue in self._subscribers.get(key, []):
+                    queue.put_nowait(message.get("params", {}))
+        except websockets.ConnectionClosed:
+            logger.info("devtools connection closed")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("devtools connection closed"))
+
+
+class CDPSession:
+    """Commands and events of one page, over a shared CDPConnection"""
+
+    def __init__(self, connection: CDPConnection, target_id: str, session_id: str):
+        self.connection = connection
+        self.target_id = target_id
+        self.session_id = session_id
+
+    async def send(self, method: str, params: Optional[Dict[str, Any]] = None, **kwargs):
+        return await self.connection.send(method, params, self.session_id, **kwargs)
+
+    def subscribe(self, method: str) -> asyncio.Queue:
+        return self.connection.subscribe(method, self.session_id)
+
+    def unsubscribe(self, method: str, queue: asyncio.Queue) -> None:
+        self.connection.unsubscribe(method, queue, self.session_id)
+
+    async def evaluate(self, expression: str, await_promise: bool = False, **kwargs) -> Any:
+        """Value of a javascript expression, raises CDPError if it threw"""
+        result = await self.send(
+            "Runtime.evaluate",
+            {"expression": expression, "returnByValue": True, "awaitPromise": await_promise},
+            **kwargs,
+        )
+        if "exceptionDetails" in result:
+            details = result["exceptionDetails"]
+            raise CDPError(details.get("exception", {}).get("description") or details["text"])
+        return result["result"].get("value")
+
+    async def close(self) -> None:
+        await self.connection.send("Target.closeTarget", {"targetId": self.target_id})
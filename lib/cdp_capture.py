@@ -0,0 +1,103 @@
+import base64
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import trio
+
+# screenshot capture backends
+# "webdriver" polls get_screenshot_as_png for the whole window
+# "clip" polls Page.captureScreenshot clipped to the participants
+# "screencast" has chrome push frames with Page.startScreencast whenever the page changes
+BACKEND_WEBDRIVER = "webdriver"
+BACKEND_CLIP = "clip"
+BACKEND_SCREENCAST = "screencast"
+
+# the only formats Page.startScreencast encodes, unlike Page.captureScreenshot it has no webp
+SCREENCAST_FORMATS = ("jpeg", "png")
+
+# returns the page coordinates of the participants, or null if they are not on the page
+PARTICIPANTS_RECT_JS = """
+const wrapper = document.getElementById("ParticipantsWrapper");
+if (!wrapper) {
+    return null;
+}
+const rect = wrapper.getBoundingClientRect();
+return {
+    x: rect.left + window.scrollX,
+    y: rect.top + window.scrollY,
+    width: rect.width,
+    height: rect.height,
+};
+"""
+
+
+def participants_clip(driver) -> Optional[Dict[str, float]]:
+    """Clip of the ParticipantsWrapper region, for Page.captureScreenshot"""
+    rect = driver.execute_script(PARTICIPANTS_RECT_JS)
+    if not rect or not rect["width"] or not rect["height"]:
+        return None
+    return {**rect, "scale": 1}
+
+
+def capture_clip(
+    driver, clip: Optional[Dict[str, float]], image_format: str = "png", quality: int = 80
+) -> bytes:
+    """Capture the clipped region, returned encoded as chrome sent it"""
+    params = {"format": image_format}
+    if image_format != "png":
+        params["quality"] = quality
+    if clip:
+        params["clip"] = clip
+    result = driver.execute_cdp_cmd("Page.captureScreenshot", params)
+    return base64.b64decode(result["data"])
+
+
+def screencast_format(image_format: str) -> str:
+    """Format to screencast in for image_format output, jpeg the sink re-encodes if need be"""
+    return image_format if image_format in SCREENCAST_FORMATS else "jpeg"
+
+
+def run_screencast(
+    driver,
+    on_frame: Callable[[bytes, float], None],
+    stop_event: threading.Event,
+    image_format: str = "png",
+    quality: int = 80,
+    fps: float = 1,
+) -> None:
+    """
+    Receive frames pushed by Page.startScreencast until stop_event is set.
+
+    Chrome only sends a frame when the page changes. Frames arriving faster than fps are
+    acknowledged and dropped. on_frame gets the encoded bytes and the capture time.
+    """
+    if image_format not in SCREENCAST_FORMATS:
+        raise ValueError(f"can't screencast in {image_format}, only in {SCREENCAST_FORMATS}")
+    trio.run(_screencast, driver, on_frame, stop_event, image_format, quality, fps)
+
+
+async def _screencast(driver, on_frame, stop_event, image_format, quality, fps):
+    interval = 1 / fps
+    last_frame_at = 0.0
+    async with driver.bidi_connection() as connection:
+        session, devtools = connection.session, connection.devtools
+        listener = session.listen(devtools.page.ScreencastFrame)
+        await session.execute(devtools.page.start_screencast(format_=image_format, quality=quality))
+        try:
+            while not stop_event.is_set():
+                # wake up every second to check stop_event, even when the page is still
+                with trio.move_on_after(1):
+                    event = await listener.receive()
+                    await session.execute(devtools.page.screencast_frame_ack(event.session_id))
+                    captured_at = event.metadata.timestamp or time.time()
+                    if captured_at - last_frame_at < interval:
+                        continue
+                    last_frame_at = captured_at
+                    on_frame(base64.b64decode(event.data), captured_at)
+        finally:
+            try:
+                await session.execute(devtools.page.stop_screencast())
+            except Exception as e:
+                logging.debug(f"failed to stop screencast: {e}")
@@ -0,0 +1,305 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from .bot import XSpaceBot
+from .driver_pool import DriverPool
+
+logger = logging.getLogger(__name__)
+
+# where the daemon listens, only on this machine: the api starts browsers with your cookies
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# recording states
+RECORDING_JOINING = "joining"
+RECORDING_RECORDING = "recording"
+RECORDING_STOPPED = "stopped"
+RECORDING_FAILED = "failed"
+
+# finished recordings kept for their final status, the oldest are forgotten past this many
+MAX_FINISHED_RECORDINGS = 100
+
+_RECORDING_PATH = re.compile(r"^/recordings/([A-Za-z0-9]+)$")
+
+
+class RecorderError(Exception):
+    """A request the recorder daemon refused, or couldn't be reached for"""
+
+
+class Recording:
+    """A space recorded by the daemon"""
+
+    def __init__(self, bot: XSpaceBot):
+        self.bot = bot
+        self.started_at = time.time()
+        self.error: Optional[str] = None
+        self.thread: Optional[threading.Thread] = None
+
+    # the run raised, or the bot gave up on its own before recording (metadata, cookies, join)
+    @property
+    def failure(self) -> Optional[str]:
+        return self.error or self.bot.failure
+
+    @property
+    def state(self) -> str:
+        if self.failure:
+            return RECORDING_FAILED
+        if self.bot.stop_event.is_set():
+            return RECORDING_STOPPED
+        if self.bot.joined_space_at is None:
+            return RECORDING_JOINING
+        return RECORDING_RECORDING
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "started_at": self.started_at,
+            "error": self.failure,
+            **self.bot.status(),
+        }
+
+
+class RecorderDaemon:
+    """
+    Long-running owner of the recordings.
+
+    The bots live here rather than in the streamlit session or a cli process, so any number of
+    clients can start, watch and stop the same recordings, and closing a client doesn't lose
+    them. A warm DriverPool is shared by the headless recordings. The cookie file and bearer
+    token stay with the daemon, clients only name the spaces (and may bring their own cookies).
+    """
+
+    def __init__(self, x_cookie_file: str, x_bearer: str, pool_size: int = 1):
+        self.x_cookie_file = x_cookie_file
+        self.x_bearer = x_bearer
+        self.pool = DriverPool(x_cookie_file, size=pool_size) if pool_size else None
+        self._recordings: Dict[str, Recording] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if self.pool:
+            self.pool.start()
+
+    def start_recording(
+        self,
+        space_id: str,
+        headless: bool = True,
+        fetch_audio: bool = True,
+        fetch_space_metadata: bool = True,
+        take_screenshots: bool = False,
+        opts: Optional[Dict[str, Any]] = None,
+        x_cookie_file: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Start recording a space, x_cookie_file overrides the daemon's cookie file"""
+        with self._lock:
+            active = self._is_active(space_id)
+        if active:
+            raise RecorderError(f"space {space_id} is already being recorded")
+
+        # the pooled browsers are headless and logged in with the daemon's cookies
+        pooled = headless and (
+            x_cookie_file is None or _same_file(x_cookie_file, self.x_cookie_file)
+        )
+        try:
+            bot = XSpaceBot(
+                x_cookie_file or self.x_cookie_file,
+                space_id,
+                self.x_bearer,
+                headless=headless,
+                pool=self.pool if pooled else None,
+            )
+        except Exception as e:
+            raise RecorderError(f"failed to set up the recording of space {space_id}: {e}")
+
+        with self._lock:
+            # started by another client meanwhile
+            if self._is_active(space_id):
+                raise RecorderError(f"space {space_id} is already being recorded")
+            self._prune()
+            recording = self._recordings[space_id] = Recording(bot)
+
+        def run():
+            try:
+                bot.run(
+                    fetch_space_metadata=fetch_space_metadata,
+                    fetch_audio=fetch_audio,
+                    take_screenshots=take_screenshots,
+                    opts=opts or {},
+                )
+            except Exception as e:
+                logger.error(f"recording of space {space_id} failed: {e}")
+                recording.error = str(e)
+                bot.stop()
+
+        # joining takes a while, the client gets the joining status right away
+        recording.thread = threading.Thread(target=run, name=f"Recording-{space_id}", daemon=True)
+        recording.thread.start()
+        return recording.status()
+
+    def stop_recording(self, space_id: str) -> Dict[str, Any]:
+        recording = self._get(space_id)
+        if recording.state in (RECORDING_JOINING, RECORDING_RECORDING):
+            recording.bot.stop()
+        return recording.status()
+
+    def status(self, space_id: str) -> Dict[str, Any]:
+        return self._get(space_id).status()
+
+    def list_recordings(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            recordings = list(self._recordings.values())
+        return [recording.status() for recording in recordings]
+
+    def shutdown(self) -> None:
+        """Stop every recording and close the pool"""
+        with self._lock:
+            recordings = list(self._recordings.values())
+        for recording in recordings:
+            if recording.state in (RECORDING_JOINING, RECORDING_RECORDING):
+                recording.bot.stop()
+        if self.pool:
+            self.pool.close()
+
+    # call with the lock held
+    def _is_active(self, space_id: str) -> bool:
+        recording = self._recordings.get(space_id)
+        return bool(recording) and recording.state in (RECORDING_JOINING, RECORDING_RECORDING)
+
+    # forget the oldest finished recordings past MAX_FINISHED_RECORDINGS, call with the lock held
+    def _prune(self) -> None:
+        finished = [
+            space_id
+            for space_id, recording in self._recordings.items()
+            if recording.state in (RECORDING_STOPPED, RECORDING_FAILED)
+        ]
+        finished.sort(key=lambda space_id: self._recordings[space_id].started_at)
+        for space_id in finished[: max(0, len(finished) - MAX_FINISHED_RECORDINGS)]:
+            del self._recordings[space_id]
+
+    def _get(self, space_id: str) -> Recording:
+        with self._lock:
+            recording = self._recordings.get(space_id)
+        if recording is None:
+            raise KeyError(space_id)
+        return recording
+
+
+def _same_file(path: str, other: str) -> bool:
+    return os.path.realpath(os.path.expanduser(path)) == os.path.realpath(os.path.expanduser(other))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    GET /recordings                list the recordings
+    POST /recordings               start one, from a json body with space_id and run options
+    GET /recordings/<space_id>     status of one
+    DELETE /recordings/<space_id>  stop one
+    """
+
+    daemon: RecorderDaemon
+
+    def do_GET(self):
+        if self.path == "/recordings":
+            self._respond(200, self.daemon.list_recordings())
+        else:
+            self._with_recording(self.daemon.status)
+
+    def do_POST(self):
+        if self.path != "/recordings":
+            return self._respond(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+            space_id = params.pop("space_id")
+            self._respond(202, self.daemon.start_recording(space_id, **params))
+        except (KeyError, TypeError, ValueError) as e:
+            self._respond(400, {"error": f"invalid request: {e}"})
+        except RecorderError as e:
+            self._respond(409, {"error": str(e)})
+
+    def do_DELETE(self):
+        self._with_recording(self.daemon.stop_recording)
+
+    def _with_recording(self, action):
+        match = _RECORDING_PATH.match(self.path)
+        if not match:
+            return self._respond(404, {"error": "not found"})
+        try:
+            self._respond(200, action(match.group(1)))
+        except KeyError:
+            self._respond(404, {"error": f"no recording of space {match.group(1)}"})
+
+    def _respond(self, code: int, body: Any) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def make_server(
+    daemon: RecorderDaemon, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT
+) -> ThreadingHTTPServer:
+    """Http server of the daemon's api, serve it with serve_forever"""
+    handler = type("Handler", (_Handler,), {"daemon": daemon})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve(daemon: RecorderDaemon, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+    """Run the daemon until interrupted, then stop its recordings"""
+    server = make_server(daemon, host, port)
+    daemon.start()
+    logger.info(f"recorder daemon listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("shutting down the recorder daemon...")
+    finally:
+        server.server_close()
+        daemon.shutdown()
+
+
+class RecorderClient:
+    """Client of the recorder daemon's api, raises RecorderError for refused requests"""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, timeout: float = 60):
+        self.base_url = f"http://{host}:{port}"
+        self.timeout = timeout
+
+    def start(self, space_id: str, **params) -> Dict[str, Any]:
+        return self._request("POST", "/recordings", json={"space_id": space_id, **params})
+
+    def stop(self, space_id: str) -> Dict[str, Any]:
+        return self._request("DELETE", f"/recordings/{space_id}")
+
+    def status(self, space_id: str) -> Dict[str, Any]:
+        return self._request("GET", f"/recordings/{space_id}")
+
+    def list(self) -> List[Dict[str, Any]]:
+        return self._request("GET", "/recordings")
+
+    def _request(self, method: str, path: str, **kwargs):
+        try:
+            response = requests.request(
+                method, self.base_url + path, timeout=self.timeout, **kwargs
+            )
+        except requests.ConnectionError as e:
+            raise RecorderError(
+                f"recorder daemon not running at {self.base_url}, start it with: main.py daemon"
+            ) from e
+        body = response.json()
+        if response.status_code >= 400:
+            raise RecorderError(body.get("error", response.reason))
+        return body
@@ -0,0 +1,263 @@
+import fcntl
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .bot import create_webdriver, load_cookies_into_driver
+
+logger = logging.getLogger(__name__)
+
+# persistent chrome profiles, one per pool slot since a profile can only be open in one chrome
+PROFILES_DIR = os.path.join(os.path.expanduser("~"), ".cache", "xspacecadet", "profiles")
+# held by the pool using a profile, another pool (or process) on the slot gets a temporary one
+PROFILE_LOCK_FILE = "xspacecadet.lock"
+# idle browsers wait on x.com, so dns, tls and the web app are warm when they join a space
+WARM_URL = "https://x.com"
+
+
+class PooledDriver:
+    """A pooled chrome and its bookkeeping"""
+
+    def __init__(self, slot: int, driver, launch_seconds: float):
+        self.slot = slot
+        self.driver = driver
+        self.launch_seconds = launch_seconds
+        self.created_at = time.time()
+        self.uses = 0
+
+
+class DriverPool:
+    """
+    Chrome instances launched, logged in and parked on x.com ahead of time.
+
+    Checking out a warm browser skips the chromedriver lookup, the chrome start and the cookie
+    loading, so a bot can navigate to the space right away. Each slot keeps a persistent
+    profile, so a relaunched browser keeps its http cache. The profile is locked until the pool
+    is closed and the slot's browser quit, a slot whose profile another pool holds gets a
+    temporary profile, removed then. Browsers are relaunched after max_uses recordings, max_age
+    seconds, or when checked in with recycle.
+    """
+
+    def __init__(
+        self,
+        x_cookie_file: str,
+        size: int = 1,
+        headless: bool = True,
+        profiles_dir: str = PROFILES_DIR,
+        max_uses: int = 20,
+        max_age: float = 6 * 3600,
+    ):
+        self.x_cookie_file = x_cookie_file
+        self.size = size
+        self.headless = headless
+        self.profiles_dir = profiles_dir
+        self.max_uses = max_uses
+        self.max_age = max_age
+
+        self._idle = queue.Queue()
+        self._checked_out: Dict[int, PooledDriver] = {}
+        # browsers launching or being reset, on their way to the idle queue
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        # the profile dir of each slot, the locks held on them and the temporary ones, by slot
+        self._profiles: Dict[int, str] = {}
+        self._profile_locks: Dict[int, Any] = {}
+        self._temp_profiles: Dict[int, str] = {}
+        self._counters = {
+            "warm_checkouts": 0,
+            "cold_checkouts": 0,
+            "launches": 0,
+            "launch_failures": 0,
+            "recycled": 0,
+            "launch_seconds": 0.0,
+        }
+
+    def start(self) -> None:
+        """Launch the browsers in the background"""
+        for slot in range(self.size):
+            self._replenish(slot, lambda slot=slot: self._launch(slot))
+
+    def checkout(self, timeout: Optional[float] = 30):
+        """
+        Take a warm browser, waiting up to timeout for one still launching or being reset.
+        Falls back to launching a browser on the spot when none is coming.
+        """
+        with self._lock:
+            pending = self._pending
+        try:
+            pooled = self._idle.get(timeout=timeout) if pending else self._idle.get_nowait()
+            counter = "warm_checkouts"
+        except queue.Empty:
+            logger.warning("no warm browser available, launching one")
+            pooled = self._launch(slot=None)
+            counter = "cold_checkouts"
+
+        with self._lock:
+            self._counters[counter] += 1
+            self._checked_out[id(pooled.driver)] = pooled
+        return pooled.driver
+
+    def checkin(self, driver, recycle: bool = False) -> None:
+        """Hand a browser back, it is reset (or relaunched) in the background"""
+        with self._lock:
+            pooled = self._checked_out.pop(id(driver), None)
+        if pooled is None or pooled.slot is None or self._closed:
+            # not from the pool, or launched on the spot for lack of a warm one
+            self._quit(driver)
+            if pooled is not None and self._closed:
+                self._release_profile(pooled.slot)
+            return
+
+        pooled.uses += 1
+        worn_out = pooled.uses >= self.max_uses or time.time() - pooled.created_at > self.max_age
+        if recycle or worn_out:
+            with self._lock:
+                self._counters["recycled"] += 1
+            self._replenish(pooled.slot, lambda: self._relaunch(pooled))
+        else:
+            self._replenish(pooled.slot, lambda: self._reset(pooled))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["checked_out"] = len(self._checked_out)
+            stats["pending"] = self._pending
+        stats["idle"] = self._idle.qsize()
+        launches = stats.pop("launch_seconds")
+        stats["avg_launch_seconds"] = (
+            round(launches / stats["launches"], 2) if stats["launches"] else None
+        )
+        return stats
+
+    def close(self) -> None:
+        """
+        Quit the idle browsers, the checked out ones are quit when checked in. The profile of a
+        slot is released once its browser is quit
+        """
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(pooled.driver)
+            self._release_profile(pooled.slot)
+
+    # the profile of a slot, locked on first use so two pools never open it at once
+    def _profile_dir(self, slot: int) -> str:
+        with self._lock:
+            if slot in self._profiles:
+                return self._profiles[slot]
+
+        user_data_dir = os.path.join(self.profiles_dir, str(slot))
+        os.makedirs(user_data_dir, exist_ok=True)
+        lock_file = open(os.path.join(user_data_dir, PROFILE_LOCK_FILE), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            temporary = False
+        except OSError:
+            lock_file.close()
+            user_data_dir = tempfile.mkdtemp(prefix=f"xspacecadet-profile-{slot}-")
+            temporary = True
+            logger.warning(f"profile of slot {slot} is in use, using {user_data_dir}")
+
+        with self._lock:
+            if temporary:
+                self._temp_profiles[slot] = user_data_dir
+            else:
+                self._profile_locks[slot] = lock_file
+            self._profiles[slot] = user_data_dir
+        return user_data_dir
+
+    # unlock the profile of a slot whose browser is gone for good, a temporary one is removed
+    def _release_profile(self, slot: Optional[int]) -> None:
+        with self._lock:
+            self._profiles.pop(slot, None)
+            lock_file = self._profile_locks.pop(slot, None)
+            temp_profile = self._temp_profiles.pop(slot, None)
+        if lock_file:
+            lock_file.close()
+        if temp_profile:
+            shutil.rmtree(temp_profile, ignore_errors=True)
+
+    def _launch(self, slot: Optional[int]) -> PooledDriver:
+        started_at = time.time()
+        user_data_dir = None
+        if slot is not None:
+            user_data_dir = self._profile_dir(slot)
+        driver = create_webdriver(self.headless, user_data_dir=user_data_dir)
+        try:
+            # the cookie file wins over whatever the profile remembered
+            load_cookies_into_driver(driver, self.x_cookie_file)
+            driver.get(WARM_URL)
+        except Exception:
+            self._quit(driver)
+            raise
+
+        launch_seconds = time.time() - started_at
+        with self._lock:
+            self._counters["launches"] += 1
+            self._counters["launch_seconds"] += launch_seconds
+        logger.info(f"browser launched in {launch_seconds:.2f}s (slot {slot})")
+        return PooledDriver(slot, driver, launch_seconds)
+
+    # get a browser ready in the background and put it in the idle queue
+    def _replenish(self, slot: Optional[int], get_ready: Callable[[], PooledDriver]) -> None:
+        def run():
+            try:
+                pooled = get_ready()
+            except Exception as e:
+                logger.error(f"failed to get a browser ready: {e}")
+                with self._lock:
+                    self._counters["launch_failures"] += 1
+                if self._closed:
+                    self._release_profile(slot)
+                return
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+            if self._closed:
+                self._quit(pooled.driver)
+                self._release_profile(slot)
+            else:
+                self._idle.put(pooled)
+
+        with self._lock:
+            self._pending += 1
+        threading.Thread(target=run, daemon=True).start()
+
+    def _relaunch(self, pooled: PooledDriver) -> PooledDriver:
+        # the profile is locked until the old chrome is gone
+        self._quit(pooled.driver)
+        return self._launch(pooled.slot)
+
+    # leave the space and close the extra windows, so the next checkout starts clean
+    def _reset(self, pooled: PooledDriver) -> PooledDriver:
+        driver = pooled.driver
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            driver.get(WARM_URL)
+            return pooled
+        except Exception as e:
+            logger.warning(f"failed to reset browser (slot {pooled.slot}), relaunching: {e}")
+            with self._lock:
+                self._counters["recycled"] += 1
+            return self._relaunch(pooled)
+
+    @staticmethod
+    def _quit(driver) -> None:
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.error(f"Error quitting pooled browser: {e}")
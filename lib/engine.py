@@ -0,0 +1,372 @@
+import asyncio
+import base64
+import json
+import logging
+import math
+import threading
+import time
+from typing import Callable, Dict, Optional, Union
+
+from .bot import (
+    CLIP_REFRESH_FRAMES,
+    JOIN_ENDED,
+    JOIN_ERROR,
+    JOIN_FAILURES,
+    JOIN_LOGIN_WALL,
+    JOIN_TIMEOUT,
+    PARTICIPANT_XPATH,
+    SAMPLER_MAX_EVENTS,
+    SPEAKER_CAPTURE_SAMPLER,
+    USERNAME_XPATH,
+)
+from .cdp import (
+    CDPConnection,
+    CDPSession,
+    browser_websocket_url,
+    debugger_address,
+    script_expression,
+)
+from .cdp_capture import (
+    BACKEND_CLIP,
+    BACKEND_SCREENCAST,
+    BACKEND_WEBDRIVER,
+    PARTICIPANTS_RECT_JS,
+    screencast_format,
+)
+from .lean_browser import NetworkTransfer, page_setup_commands, page_usage
+from .page_scripts import (
+    GOT_IT_DISMISSER_JS,
+    JOIN_STATE_WAIT_JS,
+    SPEAKER_SAMPLER_INSTALL_JS,
+    SPEAKER_SAMPLER_PUSH_JS,
+    SPEAKER_SNAPSHOT_JS,
+)
+
+logger = logging.getLogger(__name__)
+
+# binding the in-page sampler pushes its events through
+SAMPLER_BINDING = "__xscEmit"
+# seconds to wait for the space page to load
+PAGE_LOAD_TIMEOUT = 30
+# seconds between writes of the buffered frames
+FRAME_WRITE_INTERVAL = 1
+
+
+class EngineSpace:
+    """Handle on a space recorded by the CDPEngine"""
+
+    def __init__(self, engine: "CDPEngine", bot):
+        self.engine = engine
+        self.bot = bot
+        self.task: Optional[asyncio.Task] = None
+        self.page: Optional[CDPSession] = None
+        # bytes the page received, counted from its network events
+        self.transfer = NetworkTransfer()
+        self._stopped = False
+
+    def stop(self, timeout: float = 10) -> None:
+        """Cancel the space's coroutines and close its page"""
+        if self._stopped:
+            return
+        self._stopped = True
+        future = asyncio.run_coroutine_threadsafe(self._stop(), self.engine.loop)
+        # a coroutine stopping its own space can't wait for itself
+        if threading.current_thread() is not self.engine.thread:
+            try:
+                future.result(timeout)
+            except Exception as e:
+                logger.error(f"failed to stop the engine tasks of {self.bot.space_id}: {e}")
+
+    async def _stop(self) -> None:
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.page:
+            try:
+                metrics = await self.page.send("Performance.getMetrics")
+                self.bot.page_usage = page_usage(metrics["metrics"], self.transfer.totals())
+            except Exception as e:
+                logger.debug(f"failed to measure the page of {self.bot.space_id}: {e}")
+            try:
+                await self.page.close()
+            except Exception as e:
+                logger.debug(f"failed to close the page of {self.bot.space_id}: {e}")
+
+
+class CDPEngine:
+    """
+    Records spaces with coroutines on a single asyncio loop, talking to chrome over devtools.
+
+    Each space gets its own window (target) in the browser of the bot's driver; the driver is
+    only used to start chrome and hold its cookies. Events are subscribed to rather than polled:
+    the join button and acknowledgement dialogs are watched for in the page, the sampler pushes
+    speaking transitions through a binding and the screencast pushes frames. One loop drives
+    any number of spaces, in one or several browsers.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="CDPEngine", daemon=True)
+        self._connections: Dict[str, CDPConnection] = {}
+        self._connections_lock = asyncio.Lock()
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def record(self, bot, fetch_audio: bool, take_screenshots: bool, opts={}) -> EngineSpace:
+        """Join the bot's space and record it until the returned handle is stopped"""
+        space = EngineSpace(self, bot)
+
+        async def start():
+            space.task = asyncio.current_task()
+            await self._record(space, fetch_audio, take_screenshots, opts)
+
+        asyncio.run_coroutine_threadsafe(start(), self.loop)
+        return space
+
+    async def _connection(self, driver) -> CDPConnection:
+        address = debugger_address(driver)
+        async with self._connections_lock:
+            connection = self._connections.get(address)
+            if connection is None or connection.closed:
+                websocket_url = await asyncio.to_thread(browser_websocket_url, address)
+                connection = await CDPConnection.connect(websocket_url)
+                self._connections[address] = connection
+            return connection
+
+    async def _record(self, space: EngineSpace, fetch_audio, take_screenshots, opts) -> None:
+        bot = space.bot
+        counting = None
+        try:
+            connection = await self._connection(bot.driver)
+            space.page = page = await connection.new_page()
+            # counted from the start, the page load is most of the transfer
+            loaded = page.subscribe("Network.loadingFinished")
+            counting = asyncio.create_task(self._count_transfer(loaded, space.transfer))
+            if not await self._join(page, bot, keep_avatars=take_screenshots):
+                self._stop_bot(bot)
+                return
+
+            if fetch_audio:
+                bot.start_audio_download()
+            await page.evaluate(script_expression(GOT_IT_DISMISSER_JS))
+
+            tasks = [self._capture_speakers(page, bot), self._write_frames(bot)]
+            if take_screenshots:
+                bot.frame_pipeline = bot._build_frame_pipeline(opts)
+                bot.frame_pipeline.start()
+                tasks.append(self._capture_screenshots(page, bot, opts))
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"engine failed to record {bot.space_id}: {e}")
+            if bot.joined_space_at is None:
+                bot.failure = f"failed to join: {e}"
+            self._stop_bot(bot)
+        finally:
+            if counting:
+                counting.cancel()
+
+    # shut the bot down from a worker thread, its shutdown waits for this loop
+    def _stop_bot(self, bot) -> None:
+        bot.stop_event.set()
+        self.loop.run_in_executor(None, bot.stop)
+
+    async def _join(self, page: CDPSession, bot, keep_avatars: bool = True) -> bool:
+        # measure the page's usage and, with lean_browser, block what it doesn't need
+        for method, params in page_setup_commands(bot.lean_browser, keep_avatars):
+            await page.send(method, params)
+        bot._track_browser_usage()
+
+        load_events = page.subscribe("Page.loadEventFired")
+        try:
+            await page.send("Page.enable")
+            await page.send("Page.navigate", {"url": bot.space_url})
+            await asyncio.wait_for(load_events.get(), PAGE_LOAD_TIMEOUT)
+        finally:
+            page.unsubscribe("Page.loadEventFired", load_events)
+        bot.mark_join_latency("page_loaded")
+
+        found = await page.evaluate(
+            script_expression(JOIN_STATE_WAIT_JS, JOIN_TIMEOUT * 1000),
+            await_promise=True,
+            timeout=JOIN_TIMEOUT + 5,
+        )
+        if not found:
+            logger.error("Failed to join the X Space. The join button was not found.")
+            bot.failure = f"failed to join: {JOIN_FAILURES[None]}"
+            return False
+
+        state = found["state"]
+        bot.mark_join_latency(state)
+        if state == JOIN_ENDED:
+            logger.info("Space has ended. Quitting.")
+        elif state == JOIN_LOGIN_WALL:
+            logger.error("Failed to join the X Space. Not logged in, check the cookie file.")
+        elif state == JOIN_ERROR:
+            logger.error("Failed to join the X Space. The space page shows an error.")
+        if state in JOIN_FAILURES:
+            bot.failure = f"failed to join: {JOIN_FAILURES[state]}"
+            return False
+
+        # a real click, as the page would get it from the user
+        for event_type in ("mousePressed", "mouseReleased"):
+            await page.send(
+                "Input.dispatchMouseEvent",
+                {
+                    "type": event_type,
+                    "x": found["x"],
+                    "y": found["y"],
+                    "button": "left",
+                    "clickCount": 1,
+                },
+            )
+        bot._mark_joined()
+        return True
+
+    async def _capture_speakers(self, page: CDPSession, bot) -> None:
+        logger.info(f"recording speaker data ({bot.speaker_capture_mode}, cdp)...")
+        if bot.speaker_capture_mode == SPEAKER_CAPTURE_SAMPLER:
+            await self._receive_sampler_events(page, bot)
+        else:
+            # the elements mode is a webdriver fallback, devtools always snapshots in one call
+            await self._snapshot_speakers(page, bot)
+
+    async def _snapshot_speakers(self, page: CDPSession, bot) -> None:
+        expression = script_expression(
+            SPEAKER_SNAPSHOT_JS,
+            PARTICIPANT_XPATH,
+            USERNAME_XPATH,
+            bot.roster_cache.refresh_interval * 1000,
+        )
+        # an adaptive rate moves the interval from one tick to the next
+        async for _ in _ticks(bot.speaker_tick_interval):
+            try:
+                speakers = bot._speakers_from_snapshot(await page.evaluate(expression))
+            except Exception as e:
+                logger.error(f"speaker snapshot failed: {e}")
+                continue
+            frame = {
+                # relative timestamp, in seconds with millisecond precision
+                "timestamp": round(time.time() - bot.joined_space_at, 3),
+                "speakers": speakers,
+            }
+            if bot.adaptive_rate:
+                # one evaluate a snapshot
+                bot._adapt_speaker_rate(frame, 1)
+            bot.buffer_frames([frame])
+
+    async def _receive_sampler_events(self, page: CDPSession, bot) -> None:
+        install = script_expression(
+            SPEAKER_SAMPLER_INSTALL_JS,
+            PARTICIPANT_XPATH,
+            USERNAME_XPATH,
+            bot.sampler_hz,
+            bot.speaking_threshold,
+            SAMPLER_MAX_EVENTS,
+            bot.roster_cache.refresh_interval * 1000,
+        )
+        push = script_expression(
+            SPEAKER_SAMPLER_PUSH_JS, SAMPLER_BINDING, bot.sampler_drain_interval * 1000
+        )
+        pushed = page.subscribe("Runtime.bindingCalled")
+        await page.send("Runtime.enable")
+        await page.send("Runtime.addBinding", {"name": SAMPLER_BINDING})
+        await page.evaluate(install)
+        await page.evaluate(push)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(pushed.get(), bot.sampler_drain_interval * 3)
+            except asyncio.TimeoutError:
+                logger.warning("speaker sampler stopped pushing, reinstalling")
+                await page.evaluate(install)
+                await page.evaluate(push)
+                continue
+            if event["name"] != SAMPLER_BINDING:
+                continue
+            bot.buffer_frames(bot._frames_from_sampler_drain(json.loads(event["payload"])))
+
+    async def _count_transfer(self, loaded: asyncio.Queue, transfer: NetworkTransfer) -> None:
+        while True:
+            transfer.add("Network.loadingFinished", await loaded.get())
+
+    async def _write_frames(self, bot) -> None:
+        while True:
+            await asyncio.sleep(FRAME_WRITE_INTERVAL)
+            await asyncio.to_thread(bot.flush_frame_batch)
+
+    async def _capture_screenshots(self, page: CDPSession, bot, opts) -> None:
+        fps = float(opts.get("screenshot_fps", 1))
+        backend = opts.get("screenshot_backend", BACKEND_WEBDRIVER)
+        # chrome encodes the frames straight to the output format
+        image_format = opts.get("screenshot_format", "png").replace("jpg", "jpeg")
+        params = {"format": image_format}
+        if image_format != "png":
+            params["quality"] = 80
+        logger.info(f"recording frames ({backend}, cdp)...")
+
+        frame_number = 0
+        if backend == BACKEND_SCREENCAST:
+            image_format = params["format"] = screencast_format(image_format)
+            frames = page.subscribe("Page.screencastFrame")
+            await page.send("Page.startScreencast", params)
+            last_frame_at = 0.0
+            while True:
+                event = await frames.get()
+                await page.send("Page.screencastFrameAck", {"sessionId": event["sessionId"]})
+                captured_at = event["metadata"].get("timestamp") or time.time()
+                if captured_at - last_frame_at < 1 / fps:
+                    continue
+                last_frame_at = captured_at
+                timestamp = round(captured_at - bot.joined_space_at, 3)
+                data = base64.b64decode(event["data"])
+                bot.frame_pipeline.submit(data, frame_number, timestamp, image_format)
+                frame_number += 1
+
+        async for _ in _ticks(1 / fps):
+            try:
+                if backend == BACKEND_CLIP and frame_number % CLIP_REFRESH_FRAMES == 0:
+                    rect = await page.evaluate(script_expression(PARTICIPANTS_RECT_JS))
+                    if rect and rect["width"] and rect["height"]:
+                        params["clip"] = {**rect, "scale": 1}
+                result = await page.send("Page.captureScreenshot", params)
+            except Exception as e:
+                logger.error(f"failed to capture frame: {e}")
+                continue
+            timestamp = round(time.time() - bot.joined_space_at, 3)
+            data = base64.b64decode(result["data"])
+            bot.frame_pipeline.submit(data, frame_number, timestamp, image_format)
+            frame_number += 1
+
+
+async def _ticks(interval: Union[float, Callable[[], float]]):
+    """
+    Yield every interval seconds on the loop clock, skipping the ticks missed when late.
+    interval may be a function, called for the seconds to the next tick after each one
+    """
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    while True:
+        yield
+        seconds = interval() if callable(interval) else interval
+        next_tick += seconds
+        now = loop.time()
+        if next_tick < now:
+            next_tick += math.ceil((now - next_tick) / seconds) * seconds
+        await asyncio.sleep(next_tick - now)
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+
+def default_engine() -> CDPEngine:
+    """The engine shared by every bot of the process, started on first use"""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            _default_engine = CDPEngine()
+            _default_engine.start()
+        return _default_engine
@@ -0,0 +1,250 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+from typing import Dict, Optional
+
+from PIL import Image
+
+# what to do with a new screenshot when the queue is full
+DROP_OLDEST = "drop_oldest"  # make room by dropping the oldest queued screenshot
+SKIP_TICK = "skip_tick"  # drop the new screenshot
+DROP_POLICIES = (DROP_OLDEST, SKIP_TICK)
+
+# output formats. frames already in the output format are written as captured, the others are
+# re-encoded
+IMAGE_FORMATS = {"png": "PNG", "jpeg": "JPEG", "jpg": "JPEG", "webp": "WEBP"}
+
+
+class ImageFileSink:
+    """Writes every frame to its own image file, handy for debugging"""
+
+    # frames are independent files, several workers can write at once
+    ordered = False
+
+    def __init__(self, output_dir: str, image_format: str = "png", quality: int = 80):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"unknown image format: {image_format}")
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.quality = quality
+
+    def write(
+        self, data: bytes, frame_number: int, timestamp: Optional[float], data_format: str
+    ) -> bool:
+        extension = "jpg" if self.image_format == "jpeg" else self.image_format
+        path = os.path.join(self.output_dir, f"{frame_number:05d}.{extension}")
+        if IMAGE_FORMATS[data_format] == IMAGE_FORMATS[self.image_format]:
+            with open(path, "wb") as f:
+                f.write(data)
+            return True
+
+        image = Image.open(io.BytesIO(data))
+        if IMAGE_FORMATS[self.image_format] == "JPEG":
+            image = image.convert("RGB")
+        image.save(path, IMAGE_FORMATS[self.image_format], quality=self.quality)
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+class VideoSink:
+    """
+    Pipes frames into a single ffmpeg process that encodes one video file.
+
+    Identical consecutive frames are skipped, so the video's frames are not evenly spaced in
+    time. A jsonl sidecar maps every video frame to its capture frame number and timestamp.
+    """
+
+    # frames must reach ffmpeg in capture order
+    ordered = True
+
+    def __init__(self, video_path: str, fps: float = 1, crf: int = 28):
+        if not shutil.which("ffmpeg"):
+            raise FileNotFoundError("ffmpeg not installed")
+        self.video_path = video_path
+        self.sidecar_path = os.path.splitext(video_path)[0] + ".jsonl"
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-v",
+            "warning",
+            "-f",
+            "image2pipe",
+            "-framerate",
+            str(fps),
+            "-i",
+            "-",
+            # x264 needs even dimensions
+            "-vf",
+            "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-crf",
+            str(crf),
+            "-pix_fmt",
+            "yuv420p",
+            # fragmented mp4 stays playable if we never get to close it
+            "-movflags",
+            "+frag_keyframe+empty_moov",
+            video_path,
+        ]
+        logging.debug("Command for the screenshot video: %s", " ".join(cmd))
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        self._sidecar = open(self.sidecar_path, "w", encoding="utf-8")
+        self._last_digest = None
+        self._video_frame = 0
+
+    def write(
+        self, data: bytes, frame_number: int, timestamp: Optional[float], data_format: str
+    ) -> bool:
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if digest == self._last_digest:
+            return False
+        self._last_digest = digest
+
+        # image2pipe probes every image, so png and jpeg frames can both be piped as is
+        self._process.stdin.write(data)
+        record = {"video_frame": self._video_frame, "frame": frame_number, "timestamp": timestamp}
+        self._sidecar.write(json.dumps(record) + "\n")
+        self._sidecar.flush()
+        self._video_frame += 1
+        return True
+
+    def close(self) -> None:
+        self._sidecar.close()
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self._process.wait() != 0:
+            logging.error(f"ffmpeg failed to encode {self.video_path}")
+
+
+class FramePipeline:
+    """
+    Hands captured screenshots to a sink (image files or a video) on a pool of worker threads.
+
+    The queue between capture and the workers is bounded, so when saving falls behind frames
+    are dropped according to the drop policy instead of piling up in memory.
+    """
+
+    def __init__(
+        self,
+        sink,
+        workers: int = 2,
+        max_queue: int = 32,
+        drop_policy: str = DROP_OLDEST,
+    ):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"unknown drop policy: {drop_policy}")
+
+        self.sink = sink
+        # a single worker keeps the frames in order for sinks that need it
+        self.workers = 1 if sink.ordered else workers
+        self.drop_policy = drop_policy
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._counters = {
+            "captured": 0,
+            "dropped": 0,
+            "encoded": 0,
+            "duplicates": 0,
+            "failed": 0,
+        }
+        self._counters_lock = threading.Lock()
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"FramePipeline-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = 5) -> None:
+        """
+        Let the workers finish the queued frames, then stop them. A sink that stalls for
+        timeout can't hold this up, the oldest queued frames are dropped to make room
+        """
+        stops = len(self._threads)
+        while stops:
+            try:
+                self._queue.put(None, timeout=timeout)
+                stops -= 1
+                continue
+            except queue.Full:
+                pass
+            try:
+                item = self._queue.get_nowait()
+                self._queue.task_done()
+            except queue.Empty:
+                continue
+            if item is None:
+                # nothing but stop signals queued, the workers are stuck for good
+                break
+            logging.warning("frame sink is stalled, dropping a queued frame to stop")
+            self._count("dropped")
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self.sink.close()
+
+    def submit(
+        self,
+        data: bytes,
+        frame_number: int,
+        timestamp: Optional[float] = None,
+        data_format: str = "png",
+    ) -> bool:
+        """Queue an encoded screenshot, returns False if a frame had to be dropped"""
+        self._count("captured")
+        item = (data, frame_number, timestamp, data_format)
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        if self.drop_policy == SKIP_TICK:
+            self._count("dropped")
+            return False
+
+        try:
+            self._queue.get_nowait()
+            self._queue.task_done()
+            self._count("dropped")
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._count("dropped")
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        with self._counters_lock:
+            return {**self._counters, "queued": self._queue.qsize()}
+
+    def _count(self, counter: str) -> None:
+        with self._counters_lock:
+            self._counters[counter] += 1
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._count("encoded" if self.sink.write(*item) else "duplicates")
+            except Exception as e:
+                self._count("failed")
+                logging.error(f"failed to save frame: {e}")
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,534 @@
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Callable, Collection, Dict, List, NamedTuple, Optional
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+from .space_data import SpaceDataStore, read_stream
+
+logger = logging.getLogger(__name__)
+
+# chunks fetched at once
+DEFAULT_WORKERS = 8
+# retries of a chunk, on connection errors and 5xx responses
+CHUNK_RETRIES = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+CHUNK_TIMEOUT = 30
+MANIFEST_FILE = "manifest.json"
+PLAYLIST_FILE = "chunks.m3u8"
+
+# the segments appended by the live tail: sequence number, place in the output file and in the
+# audio, and the wall clock time the segment started at
+AUDIO_SEGMENTS_STREAM = "audio_segments"
+# space metadata key: seconds of audio ahead of the join, i.e. the replay of the space fetched
+# before the live tail started. speaker frames are timed from the join, the audio from before it
+AUDIO_OFFSET = "audio_offset"
+# seconds between polls of a live playlist
+LIVE_POLL_INTERVAL = 2
+
+# speech recognition input written beside the archival audio, in the same ffmpeg run: 16 kHz
+# mono, what whisper resamples everything to anyway, as flac or as 16-bit pcm wav
+ASR_SAMPLE_RATE = 16000
+ASR_FLAC = "flac"
+ASR_WAV = "wav"
+ASR_FORMATS = (ASR_FLAC, ASR_WAV)
+_ASR_CODECS = {ASR_FLAC: "flac", ASR_WAV: "pcm_s16le"}
+
+# seconds a master playlist is reused before revalidating it, it only points at the chunks
+MASTER_PLAYLIST_TTL = 600
+# seconds a chunk playlist is reused, long enough for the accesses of a download to share it
+CHUNK_PLAYLIST_TTL = 1
+
+
+class Chunk(NamedTuple):
+    url: str
+    duration: float
+    # wall clock time of the start of the chunk, if the playlist tags it
+    program_date_time: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        """File name of the chunk, unique within a space"""
+        return os.path.basename(urlparse(self.url).path)
+
+
+class Playlist(NamedTuple):
+    chunks: List[Chunk]
+    media_sequence: int
+    # the playlist has all of the chunks, no more will be appended
+    ended: bool
+    # longest a chunk may be, live playlists are reloaded about every half of it
+    target_duration: float = 0
+
+
+class DownloadCancelled(Exception):
+    """The download was cancelled, the fetched chunks are kept for resuming"""
+
+
+def parse_playlist(text: str, base_url: str = "") -> Playlist:
+    """Chunks of a media playlist, relative uris are resolved against base_url"""
+    chunks = []
+    media_sequence = 0
+    target_duration = 0
+    ended = False
+    duration = None
+    program_date_time = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:") :].split(",")[0])
+        elif line.startswith("#EXT-X-PROGRAM-DATE-TIME:"):
+            value = line.split(":", 1)[1]
+            program_date_time = datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            media_sequence = int(line.split(":")[1])
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            target_duration = float(line.split(":")[1])
+        elif line == "#EXT-X-ENDLIST":
+            ended = True
+        elif line and not line.startswith("#"):
+            chunks.append(Chunk(urljoin(base_url, line), duration or 0.0, program_date_time))
+            duration = program_date_time = None
+    return Playlist(chunks, media_sequence, ended, target_duration)
+
+
+def parse_master_playlist(text: str, base_url: str = "") -> List[str]:
+    """Urls of the variant playlists of a master playlist"""
+    return [
+        urljoin(base_url, line.strip())
+        for line in text.splitlines()
+        if line.strip() and not line.startswith("#")
+    ]
+
+
+def format_playlist(playlist: Playlist, uri: Callable[[Chunk], str] = lambda chunk: chunk.url):
+    """Text of a media playlist, with uri(chunk) as the uri of each chunk"""
+    target_duration = playlist.target_duration or max(
+        (chunk.duration for chunk in playlist.chunks), default=0
+    )
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{math.ceil(target_duration)}",
+        f"#EXT-X-MEDIA-SEQUENCE:{playlist.media_sequence}",
+    ]
+    for chunk in playlist.chunks:
+        if chunk.program_date_time is not None:
+            started_at = datetime.fromtimestamp(chunk.program_date_time, timezone.utc)
+            lines.append(
+                f"#EXT-X-PROGRAM-DATE-TIME:{started_at.isoformat(timespec='milliseconds')}"
+            )
+        lines += [f"#EXTINF:{chunk.duration},", uri(chunk)]
+    if playlist.ended:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+class PlaylistCache:
+    """
+    Parsed playlists by url, reused for a ttl and then revalidated with a conditional request.
+
+    A 304 answer keeps the parsed playlist, so a playlist is downloaded and parsed once per
+    change rather than once per access, and repeated accesses within the ttl cost no request.
+    """
+
+    def __init__(self, session: requests.Session, timeout: float = CHUNK_TIMEOUT):
+        self.session = session
+        self.timeout = timeout
+        # url -> (parsed playlist, etag, last modified, fetched at)
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+        self.hits = 0
+
+    def get(self, url: str, parse: Callable[[str], Any], ttl: float, now: Optional[float] = None):
+        """parse(text) of the playlist at url, fetched at most once per ttl seconds"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry and now - entry[3] < ttl:
+                self.hits += 1
+                return entry[0]
+
+        headers = {}
+        if entry and entry[1]:
+            headers["If-None-Match"] = entry[1]
+        if entry and entry[2]:
+            headers["If-Modified-Since"] = entry[2]
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+
+        with self._lock:
+            self.requests += 1
+            if entry and response.status_code == 304:
+                self.not_modified += 1
+                parsed = entry[0]
+            else:
+                response.raise_for_status()
+                parsed = parse(response.text)
+            etag = response.headers.get("ETag") or (entry[1] if entry else None)
+            last_modified = response.headers.get("Last-Modified") or (entry[2] if entry else None)
+            self._entries[url] = (parsed, etag, last_modified, now)
+        return parsed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": self.requests, "not_modified": self.not_modified, "hits": self.hits}
+
+
+def strip_id3(data: bytes) -> bytes:
+    """Segment without its leading ID3 tag, packed audio segments carry their timestamp in one"""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return data
+    # syncsafe size, 7 bits a byte, plus a footer if the flags have one
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | data[9] & 0x7F
+    footer = 10 if data[5] & 0x10 else 0
+    return data[10 + size + footer :]
+
+
+def new_session(workers: int = DEFAULT_WORKERS) -> requests.Session:
+    """Session pooling up to workers connections to the media host, retrying failed requests"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=CHUNK_RETRIES)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def asr_file(audio_file: str, asr_format: str) -> str:
+    """Path of the transcription input of audio_file, audio.m4a -> audio_16k.flac"""
+    return f"{os.path.splitext(audio_file)[0]}_16k.{asr_format}"
+
+
+def find_asr_file(audio_file: str) -> Optional[str]:
+    """Transcription input written beside audio_file, if there is one"""
+    for asr_format in ASR_FORMATS:
+        path = asr_file(audio_file, asr_format)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def asr_output_args(audio_file: str, asr_format: str) -> List[str]:
+    """ffmpeg options of a second output, the transcription input of audio_file"""
+    return [
+        "-map",
+        "0:a",
+        "-ac",
+        "1",
+        "-ar",
+        str(ASR_SAMPLE_RATE),
+        "-c:a",
+        _ASR_CODECS[asr_format],
+        asr_file(audio_file, asr_format),
+    ]
+
+
+def ffmpeg_copy(
+    input_file: str,
+    output_file: str,
+    ffmpeg_args: List[str] = (),
+    asr_format: Optional[str] = None,
+) -> None:
+    """Remux input_file into output_file without reencoding, plus its transcription input"""
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-v",
+        "warning",
+        "-protocol_whitelist",
+        "file",
+        "-i",
+        input_file,
+        "-c",
+        "copy",
+        *ffmpeg_args,
+        output_file,
+    ]
+    if asr_format:
+        cmd += asr_output_args(output_file, asr_format)
+    logger.debug("Command for the mux: %s", " ".join(cmd))
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+class ChunkDownloader:
+    """
+    Fetches the chunks of an hls playlist concurrently, then muxes them with a single ffmpeg.
+
+    The chunks go to chunk_dir, over a pooled session retrying failed requests. A manifest of
+    the fetched chunks and their sizes is rewritten after each one, so a download interrupted
+    (cancelled, crashed or failed) resumes with the missing chunks only. chunk_dir is removed
+    once the chunks are muxed.
+    """
+
+    def __init__(
+        self,
+        chunk_dir: str,
+        workers: int = DEFAULT_WORKERS,
+        session: Optional[requests.Session] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ):
+        self.chunk_dir = chunk_dir
+        self.workers = workers
+        self.cancel_event = cancel_event or threading.Event()
+        self.session = session or new_session(workers)
+        self._manifest_path = os.path.join(chunk_dir, MANIFEST_FILE)
+        self._lock = threading.Lock()
+        # set when a chunk failed, the other fetches stop
+        self._abort = threading.Event()
+        self.fetched = 0
+        self.resumed = 0
+
+    def load_manifest(self) -> Dict[str, int]:
+        """{chunk name: size} of the chunks fetched so far"""
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                return json.load(f)["chunks"]
+        except FileNotFoundError:
+            return {}
+
+    def _save_manifest(self, manifest: Dict[str, int]) -> None:
+        # replaced in one go, an interrupted write can't lose the chunks recorded before
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"chunks": manifest}, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _is_fetched(self, manifest: Dict[str, int], chunk: Chunk) -> bool:
+        path = os.path.join(self.chunk_dir, chunk.name)
+        if chunk.name not in manifest or not os.path.exists(path):
+            return False
+        return os.path.getsize(path) == manifest[chunk.name]
+
+    def _cancelled(self) -> bool:
+        return self.cancel_event.is_set() or self._abort.is_set()
+
+    def fetch(self, playlist: Playlist) -> List[str]:
+        """Fetch the chunks missing from chunk_dir, returns the paths of all of them in order"""
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        self._abort.clear()
+        manifest = self.load_manifest()
+        missing = [chunk for chunk in playlist.chunks if not self._is_fetched(manifest, chunk)]
+        self.resumed = len(playlist.chunks) - len(missing)
+        if self.resumed:
+            logger.info(f"resuming download, {self.resumed}/{len(playlist.chunks)} chunks fetched")
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="ChunkDownloader") as executor:
+            futures = [executor.submit(self._fetch_chunk, chunk, manifest) for chunk in missing]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                # let the running fetches end early, the queued ones don't start
+                self._abort.set()
+                for future in futures:
+                    future.cancel()
+                raise
+
+        return [os.path.join(self.chunk_dir, chunk.name) for chunk in playlist.chunks]
+
+    def _fetch_chunk(self, chunk: Chunk, manifest: Dict[str, int]) -> None:
+        if self._cancelled():
+            raise DownloadCancelled()
+        path = os.path.join(self.chunk_dir, chunk.name)
+        size = 0
+        with self.session.get(chunk.url, stream=True, timeout=CHUNK_TIMEOUT) as response:
+            response.raise_for_status()
+            with open(path, "wb") as f:
+                for block in response.iter_content(64 * 1024):
+                    if self._cancelled():
+                        raise DownloadCancelled()
+                    f.write(block)
+                    size += len(block)
+
+        with self._lock:
+            manifest[chunk.name] = size
+            self._save_manifest(manifest)
+            self.fetched += 1
+
+    def mux(
+        self,
+        playlist: Playlist,
+        output_file: str,
+        ffmpeg_args: List[str] = (),
+        asr_format: Optional[str] = None,
+        tail: Optional[Chunk] = None,
+    ) -> None:
+        """
+        Mux the fetched chunks into output_file with one ffmpeg run, then remove chunk_dir.
+        tail is a local file played after the chunks, such as the output of a LiveTail
+        """
+        chunks = [chunk._replace(url=chunk.name) for chunk in playlist.chunks]
+        if tail:
+            chunks.append(tail._replace(url=os.path.abspath(tail.url)))
+        local_playlist = os.path.join(self.chunk_dir, PLAYLIST_FILE)
+        with open(local_playlist, "w", encoding="utf-8") as f:
+            f.write(format_playlist(playlist._replace(chunks=chunks, ended=True)))
+
+        ffmpeg_copy(local_playlist, output_file, ffmpeg_args, asr_format)
+        shutil.rmtree(self.chunk_dir)
+
+    def download(
+        self,
+        playlist: Playlist,
+        output_file: str,
+        ffmpeg_args: List[str] = (),
+        asr_format: Optional[str] = None,
+    ) -> None:
+        self.fetch(playlist)
+        self.mux(playlist, output_file, ffmpeg_args, asr_format)
+        logger.info(f"fetched {self.fetched} chunks, {self.resumed} were already fetched")
+
+
+class LiveTail:
+    """
+    Follows a live playlist, appending the segments it hasn't seen to a growing output file.
+
+    Each poll fetches the playlist and only the segments past the last sequence number
+    appended, stripped of their ID3 tags, so the output is one continuous ADTS stream. A
+    segment is appended whole once fetched and only then logged to AUDIO_SEGMENTS_STREAM, so
+    the file is readable up to the last segment logged, and a restarted tail cuts off anything
+    after it and carries on from there. The log maps each segment to its place in the audio and
+    its wall clock start, from the playlist's program date times or else estimated from the
+    live edge, to line the audio up with the speaker frames. The segments named in skip are
+    already had from elsewhere (the replay of the space before the tail started), the audio
+    times in the log then start at audio_start, their length.
+    """
+
+    def __init__(
+        self,
+        fetch_playlist: Callable[[], Playlist],
+        output_file: str,
+        store: SpaceDataStore,
+        session: Optional[requests.Session] = None,
+        cancel_event: Optional[threading.Event] = None,
+        poll_interval: float = LIVE_POLL_INTERVAL,
+        skip: Collection[str] = (),
+        audio_start: float = 0.0,
+    ):
+        self.fetch_playlist = fetch_playlist
+        self.output_file = output_file
+        self.store = store
+        self.session = session or new_session(1)
+        self.cancel_event = cancel_event or threading.Event()
+        self.poll_interval = poll_interval
+        self.skip = frozenset(skip)
+        self.last_sequence: Optional[int] = None
+        # bytes of audio in the output file, and where in the audio it ends
+        self.offset = 0
+        self.audio_end = audio_start
+        self.ended = False
+        self.target_duration = 0.0
+        self.appended = 0
+        self.missed = 0
+
+    def resume(self) -> None:
+        """
+        Carry on from the last segment logged, dropping a segment a crash cut short. An output
+        file the log doesn't account for is moved aside rather than overwritten
+        """
+        last = None
+        for last in read_stream(self.store.space_dir, AUDIO_SEGMENTS_STREAM):
+            pass
+        size = os.path.getsize(self.output_file) if os.path.exists(self.output_file) else 0
+        if last is None or size < last["offset"] + last["bytes"]:
+            if size:
+                kept = f"{self.output_file}.{int(time.time())}"
+                logger.warning(f"{self.output_file} doesn't match its segment log, kept as {kept}")
+                os.replace(self.output_file, kept)
+            elif last is not None:
+                logger.warning(f"{self.output_file} is gone, starting the live tail over")
+            open(self.output_file, "wb").close()
+            return
+
+        self.last_sequence = last["sequence"]
+        self.offset = last["offset"] + last["bytes"]
+        self.audio_end = last["audio_start"] + last["duration"]
+        with open(self.output_file, "r+b") as f:
+            f.truncate(self.offset)
+        logger.info(f"resuming the live tail after segment {self.last_sequence}")
+
+    def poll(self, now: Optional[float] = None) -> int:
+        """Append the new segments of the playlist, returns how many"""
+        now = time.time() if now is None else now
+        playlist = self.fetch_playlist()
+        self.ended = playlist.ended
+        self.target_duration = playlist.target_duration
+        # the last segment ends at about now, the ones before it started that much earlier
+        remaining = sum(chunk.duration for chunk in playlist.chunks)
+        appended = 0
+        for i, chunk in enumerate(playlist.chunks):
+            sequence = playlist.media_sequence + i
+            started_at = chunk.program_date_time or now - remaining
+            remaining -= chunk.duration
+            if self.last_sequence is not None and sequence <= self.last_sequence:
+                continue
+            if chunk.name in self.skip:
+                continue
+            if self.cancel_event.is_set():
+                break
+
+            missed = 0 if self.last_sequence is None else sequence - self.last_sequence - 1
+            if missed:
+                logger.warning(f"missed {missed} segments before segment {sequence}")
+                self.missed += missed
+            with self.session.get(chunk.url, timeout=CHUNK_TIMEOUT) as response:
+                response.raise_for_status()
+                self._append(sequence, chunk, strip_id3(response.content), started_at, missed)
+            appended += 1
+        return appended
+
+    def _append(self, sequence: int, chunk: Chunk, data: bytes, started_at: float, missed: int):
+        with open(self.output_file, "ab") as f:
+            f.write(data)
+        record = {
+            "sequence": sequence,
+            "chunk": chunk.name,
+            "offset": self.offset,
+            "bytes": len(data),
+            "audio_start": round(self.audio_end, 3),
+            "duration": chunk.duration,
+            "started_at": round(started_at, 3),
+            "estimated": chunk.program_date_time is None,
+            "missed": missed,
+        }
+        self.store.append(AUDIO_SEGMENTS_STREAM, [record])
+        self.last_sequence = sequence
+        self.offset += len(data)
+        self.audio_end += chunk.duration
+        self.appended += 1
+
+    def run(self) -> None:
+        """Tail the playlist until it ends or the tail is cancelled"""
+        self.resume()
+        while not self.cancel_event.is_set():
+            try:
+                self.poll()
+            except requests.RequestException as e:
+                logger.warning(f"failed to poll the live playlist, retrying: {e}")
+            if self.ended:
+                break
+            # no sooner than half the target duration, as the hls spec asks of clients
+            self.cancel_event.wait(max(self.poll_interval, self.target_duration / 2))
+        logger.info(
+            f"live tail done: {self.appended} segments, {self.audio_end:.0f}s of audio, "
+            f"{self.missed} segments missed"
+        )
+
+
+def audio_time_at(segments: List[Dict], timestamp: float) -> Optional[float]:
+    """Seconds into the live tail's output of a wall clock time, None if it isn't in the audio"""
+    for segment in segments:
+        into = timestamp - segment["started_at"]
+        if 0 <= into < segment["duration"]:
+            return segment["audio_start"] + into
+    return None
@@ -0,0 +1,189 @@
+import os
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from lib.hls import AUDIO_OFFSET
+from lib.space_data import load_space_data, read_stream, stream_path
+from lib.timeline import SpeakerTimeline
+
+# append-only log of merged speaking intervals, one json object per line
+INTERVALS_STREAM = "speaker_intervals"
+# space metadata key set once the interval log is complete: the relative time the intervals
+# still open at the end of the recording were closed at. a crashed run never sets it
+INTERVALS_CLOSED_AT = "intervals_closed_at"
+
+
+class SpeakingInterval(NamedTuple):
+    username: str
+    start: float
+    end: float
+    mean_confidence: Optional[float]
+
+
+class IntervalBuilder:
+    """
+    Merges consecutive captured frames into speaking intervals.
+
+    A frame holds until the next one, so a user's interval runs from the first frame they are
+    speaking in to the first frame they are not. Feed frames in timestamp order; closed
+    intervals are returned as soon as they are known.
+    """
+
+    def __init__(self):
+        # username -> [start, confidence sum, confidence count]
+        self._open: Dict[str, List] = {}
+        self._last_timestamp: Optional[float] = None
+
+    def add_frame(self, timestamp: float, speakers: List[Dict[str, Any]]) -> List[SpeakingInterval]:
+        speaking = {speaker["username"]: speaker.get("confidence") for speaker in speakers}
+
+        closed = [
+            self._close(username, timestamp)
+            for username in list(self._open)
+            if username not in speaking
+        ]
+        for username, confidence in speaking.items():
+            current = self._open.setdefault(username, [timestamp, 0.0, 0])
+            if confidence is not None:
+                current[1] += confidence
+                current[2] += 1
+
+        self._last_timestamp = timestamp
+        return closed
+
+    def close(self, end: Optional[float] = None) -> List[SpeakingInterval]:
+        """
+        Close the intervals still open at end, the time the recording stopped. Without it, or
+        with one before the last frame, they close at the last frame
+        """
+        if end is None or (self._last_timestamp is not None and end < self._last_timestamp):
+            end = self._last_timestamp
+        return [self._close(username, end) for username in list(self._open)]
+
+    def _close(self, username: str, end: float) -> SpeakingInterval:
+        start, confidence_sum, confidence_count = self._open.pop(username)
+        mean_confidence = round(confidence_sum / confidence_count, 3) if confidence_count else None
+        return SpeakingInterval(username, start, end, mean_confidence)
+
+
+def frames_to_intervals(
+    frames: Dict[str, Dict[str, Any]], end: Optional[float] = None
+) -> List[SpeakingInterval]:
+    """Derive the speaking intervals of already captured frames, the recording stopped at end"""
+    builder = IntervalBuilder()
+    intervals = []
+    for frame in sorted(frames.values(), key=lambda frame: frame["timestamp"]):
+        intervals.extend(builder.add_frame(frame["timestamp"], frame["speakers"]))
+    intervals.extend(builder.close(end))
+    return intervals
+
+
+def timeline_to_intervals(
+    timeline: SpeakerTimeline, end: Optional[float] = None
+) -> List[SpeakingInterval]:
+    """Derive the speaking intervals of a columnar timeline, the recording stopped at end"""
+    builder = IntervalBuilder()
+    intervals = []
+    usernames = timeline.usernames
+    offsets = timeline.offsets
+    for i, timestamp in enumerate(timeline.timestamps.tolist()):
+        lo, hi = offsets[i], offsets[i + 1]
+        speakers = [
+            # missing confidences are stored as nan
+            {
+                "username": usernames[speaker_id],
+                "confidence": None if confidence != confidence else confidence,
+            }
+            for speaker_id, confidence in zip(
+                timeline.speaker_ids[lo:hi].tolist(), timeline.confidence[lo:hi].tolist()
+            )
+        ]
+        intervals.extend(builder.add_frame(timestamp, speakers))
+    intervals.extend(builder.close(end))
+    return intervals
+
+
+class IntervalIndex:
+    """Overlap queries over speaking intervals"""
+
+    def __init__(self, intervals: Iterable[SpeakingInterval]):
+        self.intervals = sorted(intervals, key=lambda interval: interval.start)
+        self._starts = [interval.start for interval in self.intervals]
+        # running max of the ends, non decreasing so it can be bisected
+        self._max_ends = list(accumulate((interval.end for interval in self.intervals), max))
+
+    def __len__(self) -> int:
+        return len(self.intervals)
+
+    @classmethod
+    def load(cls, space_dir: str) -> Optional["IntervalIndex"]:
+        """Load the intervals logged during capture, if any"""
+        if not os.path.exists(stream_path(space_dir, INTERVALS_STREAM)):
+            return None
+        return cls(
+            SpeakingInterval(**record) for record in read_stream(space_dir, INTERVALS_STREAM)
+        )
+
+    def shifted(self, seconds: float) -> "IntervalIndex":
+        """The same intervals, seconds later"""
+        return IntervalIndex(
+            interval._replace(start=interval.start + seconds, end=interval.end + seconds)
+            for interval in self.intervals
+        )
+
+    def overlapping(self, t0: float, t1: float) -> List[SpeakingInterval]:
+        """Intervals overlapping [t0, t1], ordered by start"""
+        lo = bisect_right(self._max_ends, t0)
+        hi = bisect_right(self._starts, t1)
+        return [interval for interval in self.intervals[lo:hi] if interval.end > t0]
+
+    def speakers_between(self, t0: float, t1: float) -> Dict[str, float]:
+        """Who spoke between t0 and t1, with how many seconds of it each one spoke"""
+        spoken: Dict[str, float] = {}
+        for interval in self.overlapping(t0, t1):
+            seconds = min(interval.end, t1) - max(interval.start, t0)
+            spoken[interval.username] = spoken.get(interval.username, 0.0) + max(seconds, 0.0)
+        return spoken
+
+    def sole_speakers_between(self, t0: float, t1: float) -> List[str]:
+        """Speakers of the stretches between t0 and t1 where only they were speaking, in order"""
+        events = []
+        for interval in self.overlapping(t0, t1):
+            events.append((max(interval.start, t0), 1, interval.username))
+            events.append((min(interval.end, t1), -1, interval.username))
+        events.sort(key=lambda event: (event[0], event[1]))
+
+        sole = []
+        active: Dict[str, int] = {}
+        for idx, (time, delta, username) in enumerate(events):
+            active[username] = active.get(username, 0) + delta
+            if not active[username]:
+                del active[username]
+            next_time = events[idx + 1][0] if idx + 1 < len(events) else time
+            if len(active) == 1 and next_time > time:
+                (speaker,) = active
+                if not sole or sole[-1] != speaker:
+                    sole.append(speaker)
+        return sole
+
+
+def load_intervals(space_data_json: str, audio_time: bool = False) -> IntervalIndex:
+    """
+    Load a space's speaking intervals.
+
+    Uses the intervals logged during capture when the log was completed at shutdown, and
+    otherwise derives them from the captured frames (e.g. recordings made before intervals
+    were logged, or a crashed run whose log misses the intervals still open when it died).
+    Intervals are timed from the join, or with audio_time from the start of the recorded audio,
+    which holds the replay of the space before the join too.
+    """
+    metadata = load_space_data(space_data_json, frames=False) or {}
+    index = None
+    if INTERVALS_CLOSED_AT in metadata:
+        index = IntervalIndex.load(os.path.dirname(space_data_json))
+    if index is None:
+        timeline = SpeakerTimeline.load_or_build(space_data_json)
+        index = IntervalIndex(timeline_to_intervals(timeline, metadata.get(INTERVALS_CLOSED_AT)))
+    offset = metadata.get(AUDIO_OFFSET) if audio_time else None
+    return index.shifted(offset) if offset else index
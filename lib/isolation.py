@@ -0,0 +1,263 @@
+import logging
+import math
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from .intervals import INTERVALS_STREAM, IntervalBuilder
+from .ring_buffer import RingBuffer
+from .space_data import SpaceDataStore
+
+logger = logging.getLogger(__name__)
+
+# speakers and username bytes a frame record holds, longer ones are cut
+MAX_RECORD_SPEAKERS = 16
+USERNAME_BYTES = 64
+# frame number, timestamp, speaker count
+_FRAME = struct.Struct("<QdH")
+# username (utf-8, zero padded), confidence (nan for none)
+_SPEAKER = struct.Struct(f"<{USERNAME_BYTES}sf")
+FRAME_RECORD_SIZE = _FRAME.size + MAX_RECORD_SPEAKERS * _SPEAKER.size
+
+# frames the ring holds while the persistence process is busy, about an hour at 1 fps
+RING_SLOTS = 4096
+# seconds between drains of the ring by the persistence process
+PERSIST_INTERVAL = 0.5
+# seconds between the heartbeats measuring the jitter of the audio process
+HEARTBEAT_INTERVAL = 1
+# seconds the processes get to finish once stopped
+STOP_TIMEOUT = 30
+
+
+def pack_frame(number: int, frame: Dict[str, Any]) -> bytes:
+    """Fixed size record of a numbered speaker frame"""
+    speakers = frame["speakers"]
+    if len(speakers) > MAX_RECORD_SPEAKERS:
+        logger.warning(f"frame {number} has {len(speakers)} speakers, keeping the first ones")
+        speakers = speakers[:MAX_RECORD_SPEAKERS]
+
+    record = bytearray(FRAME_RECORD_SIZE)
+    _FRAME.pack_into(record, 0, number, frame["timestamp"], len(speakers))
+    for i, speaker in enumerate(speakers):
+        # cut on a character boundary
+        username = speaker["username"].encode("utf-8")[:USERNAME_BYTES]
+        username = username.decode("utf-8", "ignore").encode("utf-8")
+        confidence = speaker.get("confidence")
+        _SPEAKER.pack_into(
+            record,
+            _FRAME.size + i * _SPEAKER.size,
+            username,
+            math.nan if confidence is None else confidence,
+        )
+    return bytes(record)
+
+
+def unpack_frame(record: bytes) -> Tuple[int, Dict[str, Any]]:
+    number, timestamp, count = _FRAME.unpack_from(record, 0)
+    speakers = []
+    for i in range(count):
+        username, confidence = _SPEAKER.unpack_from(record, _FRAME.size + i * _SPEAKER.size)
+        speakers.append(
+            {
+                "username": username.rstrip(b"\0").decode("utf-8"),
+                "confidence": None if math.isnan(confidence) else round(confidence, 3),
+            }
+        )
+    return number, {"timestamp": timestamp, "speakers": speakers}
+
+
+def write_frames(store: SpaceDataStore, interval_builder: IntervalBuilder, frames: Dict) -> None:
+    """Log a batch of {frame number: frame} and the speaking intervals they close"""
+    intervals = []
+    for number in sorted(frames, key=int):
+        frame = frames[number]
+        intervals.extend(interval_builder.add_frame(frame["timestamp"], frame["speakers"]))
+    store.append_frames(frames)
+    store.append(INTERVALS_STREAM, (interval._asdict() for interval in intervals))
+
+
+class JitterMeter:
+    """How far apart a loop's ticks are from the interval they were meant to be apart"""
+
+    def __init__(self, window: int = 1000):
+        self.ticks = 0
+        self._last_at: Optional[float] = None
+        self._last_interval = 0.0
+        self._deviations = deque(maxlen=window)
+        self._total = 0.0
+        self._max = 0.0
+
+    def tick(self, interval: float, now: Optional[float] = None) -> None:
+        """A tick, meant to be followed by the next one interval seconds later"""
+        now = time.time() if now is None else now
+        if self._last_at is not None:
+            deviation = abs(now - self._last_at - self._last_interval)
+            self._deviations.append(deviation)
+            self._total += deviation
+            self._max = max(self._max, deviation)
+        self.ticks += 1
+        self._last_at = now
+        self._last_interval = interval
+
+    def stats(self) -> Dict[str, Any]:
+        measured = self.ticks - 1
+        if measured < 1:
+            return {"ticks": self.ticks}
+        recent = sorted(self._deviations)
+        return {
+            "ticks": self.ticks,
+            "mean_ms": round(self._total / measured * 1000, 1),
+            "p95_ms": round(recent[int(len(recent) * 0.95)] * 1000, 1),
+            "max_ms": round(self._max * 1000, 1),
+        }
+
+
+def _persist_frames(output_dir, ring_name, fsync_interval, stopped_at, stop_event, reports) -> None:
+    logging.basicConfig(level=logging.INFO)
+    ring = RingBuffer.attach(ring_name)
+    store = SpaceDataStore(output_dir, fsync_interval)
+    interval_builder = IntervalBuilder()
+    jitter = JitterMeter()
+    written = 0
+    closed_at = None
+    try:
+        while True:
+            stopping = stop_event.wait(PERSIST_INTERVAL)
+            jitter.tick(PERSIST_INTERVAL)
+            frames = dict(unpack_frame(record) for record in ring.drain())
+            if frames:
+                write_frames(store, interval_builder, {str(n): f for n, f in frames.items()})
+                written += len(frames)
+            if stopping and not len(ring):
+                break
+
+        # the intervals still open end when the recording stopped, nan if it was never joined
+        closed_at = None if math.isnan(stopped_at.value) else stopped_at.value
+        intervals = interval_builder.close(closed_at)
+        store.append(INTERVALS_STREAM, (interval._asdict() for interval in intervals))
+    finally:
+        store.close()
+        ring.close()
+        report = {**jitter.stats(), "frames": written}
+        if closed_at is not None:
+            report["intervals_closed_at"] = closed_at
+        reports.put(("persistence", report))
+
+
+def _download_audio(x_cookie_file, space_url, asr_format, output_dir, stop_event, reports) -> None:
+    from twspace_dl import Twspace
+    from twspace_dl.api import API
+    from twspace_dl.cookies import load_cookies
+
+    from .twspace_dl import TwspaceDL
+
+    logging.basicConfig(level=logging.INFO)
+    API.init_apis(load_cookies(x_cookie_file))
+    downloader = TwspaceDL(Twspace.from_space_url(space_url), "audio", asr_format)
+    jitter = JitterMeter()
+
+    # the heartbeat measures how late this process gets scheduled, and cancels the download
+    def heartbeat():
+        while not stop_event.wait(HEARTBEAT_INTERVAL):
+            jitter.tick(HEARTBEAT_INTERVAL)
+        downloader.cancel_download()
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    # the segment log is a stream of its own, no other process writes it
+    store = SpaceDataStore(output_dir)
+    try:
+        downloader.live_tail(output_dir, store)
+    except Exception as e:
+        if not stop_event.is_set():
+            logger.error(f"failed to download audio: {e}")
+    finally:
+        store.close()
+        reports.put(
+            ("audio", {**jitter.stats(), "playlist_requests": downloader.playlist_cache.stats()})
+        )
+
+
+class ProcessIsolation:
+    """
+    Audio download and frame persistence in processes of their own.
+
+    The capture process only numbers the speaker frames and copies them into a shared memory
+    RingBuffer as fixed size records; the persistence process drains it and does the json
+    serialization and writing. The audio process runs twspace_dl and supervises ffmpeg. None
+    of them compete for the capture process's GIL, so its ticks stay on time. Each process
+    reports the jitter of its ticks when stopped.
+    """
+
+    def __init__(self, output_dir: str, fsync_interval: Optional[float], slots: int = RING_SLOTS):
+        self.output_dir = output_dir
+        self.fsync_interval = fsync_interval
+        # forking a process with running threads (selenium, the scheduler) isn't safe
+        self._context = multiprocessing.get_context("spawn")
+        self.ring = RingBuffer.create(slots, FRAME_RECORD_SIZE)
+        self._stop_event = self._context.Event()
+        self._stopped_at = self._context.Value("d", math.nan, lock=False)
+        self._reports = self._context.Queue()
+        self._processes: Dict[str, multiprocessing.process.BaseProcess] = {}
+
+    def start_persistence(self) -> None:
+        self._start(
+            "persistence",
+            _persist_frames,
+            (self.output_dir, self.ring.name, self.fsync_interval, self._stopped_at),
+        )
+
+    def start_audio_download(
+        self, x_cookie_file: str, space_url: str, asr_format: Optional[str] = None
+    ) -> None:
+        self._start(
+            "audio", _download_audio, (x_cookie_file, space_url, asr_format, self.output_dir)
+        )
+
+    def _start(self, name: str, target, args: Tuple) -> None:
+        process = self._context.Process(
+            target=target,
+            args=(*args, self._stop_event, self._reports),
+            name=f"xspacecadet-{name}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[name] = process
+        logger.info(f"started the {name} process ({process.pid})")
+
+    def push_frame(self, number: int, frame: Dict[str, Any]) -> bool:
+        """Hand a frame to the persistence process, returns False if the ring was full"""
+        return self.ring.put(pack_frame(number, frame))
+
+    def stop(
+        self, stopped_at: Optional[float] = None, timeout: float = STOP_TIMEOUT
+    ) -> Dict[str, Any]:
+        """
+        Let the processes finish their work and return their reports. stopped_at is when the
+        recording stopped, relative to the frame timestamps, the persistence process closes the
+        speaking intervals still open there
+        """
+        if stopped_at is not None:
+            self._stopped_at.value = stopped_at
+        self._stop_event.set()
+        deadline = time.time() + timeout
+        for name, process in self._processes.items():
+            process.join(max(0, deadline - time.time()))
+            if process.is_alive():
+                logger.warning(f"the {name} process did not finish in time, terminating it")
+                process.terminate()
+
+        reports = {}
+        while len(reports) < len(self._processes):
+            try:
+                name, report = self._reports.get(timeout=1)
+            except queue.Empty:
+                break
+            reports[name] = report
+        if "persistence" in reports:
+            reports["persistence"]["ring_dropped"] = self.ring.dropped
+        self.ring.close()
+        return reports
@@ -0,0 +1,201 @@
+import json
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# chrome flags of the lean profile, for browsers the bot launches itself. the page still has
+# to run the web app and draw the speaker canvases, so javascript and canvas stay on
+LEAN_CHROME_ARGS = (
+    # the page's audio element must not start playing, the audio is downloaded separately
+    "--autoplay-policy=user-gesture-required",
+    "--disable-remote-fonts",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-extensions",
+    "--disable-sync",
+    "--disable-features=MediaRouter,Translate,OptimizationHints,AutofillServerCommunication",
+    "--no-first-run",
+)
+
+# requests blocked in the space page with Network.setBlockedURLs (* matches anything).
+# the space audio (hls playlists and segments) and video, twspace_dl fetches the audio. only
+# the periscope media hosts (*.video.pscp.tv), the space's api calls go to other pscp.tv hosts
+BLOCKED_MEDIA_URLS = (
+    "*.m3u8*",
+    "*.aac*",
+    "*.mp4*",
+    "*.webm*",
+    "*video.twimg.com/*",
+    "*.video.pscp.tv/*",
+)
+# images of tweets, cards and emoji, and web fonts
+BLOCKED_ASSET_URLS = (
+    "*pbs.twimg.com/media/*",
+    "*pbs.twimg.com/card_img/*",
+    "*pbs.twimg.com/amplify_video_thumb/*",
+    "*pbs.twimg.com/ext_tw_video_thumb/*",
+    "*abs-0.twimg.com/emoji/*",
+    "*.woff*",
+    "*.ttf*",
+)
+# the speakers' avatars, only needed when the page is screenshotted
+AVATAR_URLS = ("*pbs.twimg.com/profile_images/*",)
+
+# chrome's performance log with the network events only, read by NetworkTransfer.read_log
+PERFORMANCE_LOGGING_PREFS = {"performance": "ALL"}
+PERF_LOGGING_PREFS = {"enableNetwork": True, "enablePage": False}
+
+# Performance.getMetrics metrics kept in the page usage
+PAGE_METRICS = ("TaskDuration", "ScriptDuration", "LayoutDuration", "JSHeapUsedSize", "Nodes")
+
+
+def blocked_url_patterns(keep_avatars: bool = True) -> List[str]:
+    """Url patterns the lean profile blocks, avatars are kept for screenshots"""
+    patterns = list(BLOCKED_MEDIA_URLS + BLOCKED_ASSET_URLS)
+    if not keep_avatars:
+        patterns += AVATAR_URLS
+    return patterns
+
+
+def page_setup_commands(lean: bool, keep_avatars: bool = True) -> List[Tuple[str, Dict]]:
+    """
+    Devtools commands preparing a page before it navigates to the space: usage measurement,
+    and with lean the blocked requests
+    """
+    commands = [("Performance.enable", {}), ("Network.enable", {})]
+    if lean:
+        commands.append(("Network.setBlockedURLs", {"urls": blocked_url_patterns(keep_avatars)}))
+    return commands
+
+
+def enable_network_log(options) -> None:
+    """Have a chrome started with these options log the network events NetworkTransfer reads"""
+    options.set_capability("goog:loggingPrefs", PERFORMANCE_LOGGING_PREFS)
+    options.add_experimental_option("perfLoggingPrefs", PERF_LOGGING_PREFS)
+
+
+def prepare_page(driver, lean: bool, keep_avatars: bool = True) -> None:
+    """Run the page_setup_commands in the driver's current window"""
+    for method, params in page_setup_commands(lean, keep_avatars):
+        driver.execute_cdp_cmd(method, params)
+
+
+def page_usage(metrics: List[Dict[str, Any]], transfer: Optional[Dict[str, int]]) -> Dict:
+    """Page usage from Performance.getMetrics metrics and the NetworkTransfer totals"""
+    values = {metric["name"]: metric["value"] for metric in metrics}
+    usage = {name: values[name] for name in PAGE_METRICS if name in values}
+    usage.update(transfer or {})
+    return usage
+
+
+class NetworkTransfer:
+    """
+    Bytes received by the pages of a browser, summed by target from the devtools
+    Network.loadingFinished events. Their encodedDataLength is what came over the network,
+    cross origin responses included, which the Resource Timing sizes a page script can read
+    leave at 0 without a Timing-Allow-Origin header.
+    """
+
+    def __init__(self):
+        self._totals: Dict[Optional[str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, method: str, params: Dict[str, Any], target: Optional[str] = None) -> None:
+        if method != "Network.loadingFinished":
+            return
+        with self._lock:
+            totals = self._totals.setdefault(target, {"transfer_bytes": 0, "requests": 0})
+            totals["transfer_bytes"] += int(params.get("encodedDataLength", 0))
+            totals["requests"] += 1
+
+    def read_log(self, driver) -> None:
+        """
+        Add the events of the driver's performance log (see enable_network_log). Reading the
+        log empties it, so it is read now and then rather than left to grow
+        """
+        try:
+            entries = driver.get_log("performance")
+        except Exception as e:
+            logger.debug(f"failed to read the performance log: {e}")
+            return
+        for entry in entries:
+            message = json.loads(entry["message"])
+            event = message["message"]
+            self.add(event["method"], event.get("params", {}), message.get("webview"))
+
+    def totals(self, target: Optional[str] = None) -> Optional[Dict[str, int]]:
+        with self._lock:
+            totals = self._totals.get(target)
+            return dict(totals) if totals else None
+
+
+# the NetworkTransfer of each driver, shared by the spaces whose windows it has
+_transfers = weakref.WeakKeyDictionary()
+_transfers_lock = threading.Lock()
+
+
+def network_transfer(driver) -> NetworkTransfer:
+    with _transfers_lock:
+        transfer = _transfers.get(driver)
+        if transfer is None:
+            transfer = _transfers[driver] = NetworkTransfer()
+        return transfer
+
+
+def read_network_log(driver) -> None:
+    """Move the driver's logged network events into its NetworkTransfer"""
+    network_transfer(driver).read_log(driver)
+
+
+def measure_page(driver) -> Dict:
+    """Usage of the page in the driver's current window, see page_usage"""
+    metrics = driver.execute_cdp_cmd("Performance.getMetrics", {})["metrics"]
+    transfer = network_transfer(driver)
+    transfer.read_log(driver)
+    # chromedriver's window handles are the targets the log names
+    return page_usage(metrics, transfer.totals(driver.current_window_handle))
+
+
+class BrowserProcessUsage:
+    """
+    CPU time and memory of a chrome started by selenium, over a recording.
+
+    Sums the processes under the driver's chromedriver, so a browser shared by several spaces
+    is measured as a whole. Processes that exited between two samples take their cpu time
+    with them, so the cpu time is a lower bound.
+    """
+
+    def __init__(self, driver):
+        self.process = psutil.Process(driver.service.process.pid)
+        self.started_at = time.time()
+        self.started_cpu_seconds = self.sample()[0]
+
+    def sample(self) -> Tuple[float, int]:
+        """CPU seconds and rss bytes of the browser processes right now"""
+        cpu_seconds, rss = 0.0, 0
+        for process in [self.process] + self.process.children(recursive=True):
+            try:
+                cpu = process.cpu_times()
+                cpu_seconds += cpu.user + cpu.system
+                rss += process.memory_info().rss
+            except psutil.Error:
+                continue
+        return cpu_seconds, rss
+
+    def usage(self) -> Dict[str, float]:
+        cpu_seconds, rss = self.sample()
+        cpu_seconds -= self.started_cpu_seconds
+        seconds = time.time() - self.started_at
+        return {
+            "seconds": round(seconds, 1),
+            "cpu_seconds": round(cpu_seconds, 2),
+            "cpu_percent": round(cpu_seconds / seconds * 100, 1) if seconds else None,
+            "rss_mb": round(rss / 2**20, 1),
+        }
@@ -0,0 +1,218 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import psutil
+
+from .cdp_capture import PARTICIPANTS_RECT_JS
+from .lean_browser import BrowserProcessUsage, prepare_page
+from .page_scripts import SPEAKER_SAMPLER_DRAIN_JS
+from .scheduler import PRIORITY_HOUSEKEEPING, PRIORITY_SPEAKERS
+
+logger = logging.getLogger(__name__)
+
+MB = 2**20
+
+# memory samples of the recording, one per check
+MEMORY_STREAM = "memory"
+# seconds between memory checks
+MEMORY_CHECK_INTERVAL = 60
+# rss of the browser processes past which the space's window is recycled, 0 never recycles
+BROWSER_RSS_LIMIT_MB = 2048
+# rss of this process past which the buffered frames are written out right away
+PYTHON_RSS_LIMIT_MB = 1024
+# seconds to wait before recycling the window again, a fresh page needs time to settle
+RECYCLE_COOLDOWN = 600
+# seconds the fresh window gets to join the space and show the participants
+RECYCLE_JOIN_TIMEOUT = 60
+# seconds for chrome to release the closed window's memory before it is measured again
+RECYCLE_SETTLE_SECONDS = 5
+
+
+class RecycleAborted(Exception):
+    """The fresh window can't take over the recording"""
+
+
+class MemoryWatchdog:
+    """
+    Keeps the memory of a long recording in check.
+
+    Chrome's memory grows steadily over a multi-hour space. Every check_interval seconds the
+    rss of the browser and of this process are sampled to the memory stream. Past
+    python_rss_limit_mb the buffered frames are written out right away. Past
+    browser_rss_limit_mb the space is joined again in a fresh window, which takes over the
+    capture once it shows the participants; only then is the old window closed, so the speaker
+    timeline has no gap. The window commands go through the bot's DriverScheduler, interleaved
+    with the capture ticks of the old window.
+    """
+
+    def __init__(
+        self,
+        bot,
+        check_interval: float = MEMORY_CHECK_INTERVAL,
+        browser_rss_limit_mb: float = BROWSER_RSS_LIMIT_MB,
+        python_rss_limit_mb: float = PYTHON_RSS_LIMIT_MB,
+        recycle: bool = True,
+    ):
+        self.bot = bot
+        self.check_interval = check_interval
+        self.browser_rss_limit_mb = browser_rss_limit_mb
+        self.python_rss_limit_mb = python_rss_limit_mb
+        self.recycle = recycle
+        self.recycles: List[Dict[str, Any]] = []
+        self.last_recycle_at = time.time()
+        self._browser = BrowserProcessUsage(bot.driver)
+        self._python = psutil.Process()
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name="MemoryWatchdog", daemon=True).start()
+
+    def _run(self) -> None:
+        while not self.bot.stop_event.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"memory check failed: {e}")
+
+    def sample(self) -> Dict[str, Any]:
+        return {
+            "timestamp": round(time.time() - self.bot.joined_space_at, 3),
+            "browser_rss_mb": round(self._browser.sample()[1] / MB, 1),
+            "python_rss_mb": round(self._python.memory_info().rss / MB, 1),
+            "buffered_frames": len(self.bot.frame_batch_buffer),
+        }
+
+    def check(self) -> None:
+        sample = self.sample()
+        self.bot.store.append(MEMORY_STREAM, [sample])
+
+        if sample["python_rss_mb"] > self.python_rss_limit_mb:
+            logger.warning(f"python rss at {sample['python_rss_mb']}mb, writing out the frames")
+            self.bot.flush_frame_batch()
+
+        over_limit = self.browser_rss_limit_mb and (
+            sample["browser_rss_mb"] > self.browser_rss_limit_mb
+        )
+        if self.recycle and over_limit:
+            if time.time() - self.last_recycle_at < RECYCLE_COOLDOWN:
+                logger.warning(f"browser rss at {sample['browser_rss_mb']}mb, recycled recently")
+                return
+            logger.info(f"browser rss at {sample['browser_rss_mb']}mb, recycling the window")
+            self.recycle_window(sample)
+
+    def recycle_window(self, before: Optional[Dict[str, Any]] = None) -> bool:
+        """Move the recording to a fresh window of the space, returns False if it stayed"""
+        before = before or self.sample()
+        started_at = self.last_recycle_at = time.time()
+        driver = self.bot.driver
+        old_window = self._call(lambda: driver.current_window_handle)
+        new_window = self._call(lambda: self._open_window(old_window))
+
+        def in_new_window(fn):
+            def command():
+                driver.switch_to.window(new_window)
+                try:
+                    return fn()
+                finally:
+                    driver.switch_to.window(old_window)
+
+            return command
+
+        state = {"joined": False, "sampler_installed_at": None}
+        try:
+            while not self._call(in_new_window(lambda: self._new_window_ready(state))):
+                if time.time() - started_at > RECYCLE_JOIN_TIMEOUT:
+                    raise RecycleAborted("the fresh window didn't join in time")
+                if self.bot.stop_event.wait(1):
+                    raise RecycleAborted("the bot stopped")
+            # ahead of the queued ticks, so they run in the fresh window
+            self.bot.scheduler.call(
+                lambda: self._take_over(old_window, new_window), PRIORITY_SPEAKERS, "recycle"
+            )
+            took_seconds = round(time.time() - started_at, 2)
+        except Exception as e:
+            logger.error(f"window recycle failed, recording on in the old window: {e}")
+            try:
+                self._call(in_new_window(driver.close))
+            except Exception as e:
+                logger.error(f"failed to close the fresh window: {e}")
+            return False
+
+        self.bot.stop_event.wait(RECYCLE_SETTLE_SECONDS)
+        after = self.sample()
+        recycle = {
+            "timestamp": before["timestamp"],
+            "seconds": took_seconds,
+            "browser_rss_mb_before": before["browser_rss_mb"],
+            "browser_rss_mb_after": after["browser_rss_mb"],
+            "browser_rss_mb_delta": round(after["browser_rss_mb"] - before["browser_rss_mb"], 1),
+        }
+        logger.info(f"recycled the window of space {self.bot.space_id}: {recycle}")
+        self.recycles.append(recycle)
+        self.bot.store.update("window_recycles", self.recycles)
+        return True
+
+    def _call(self, fn):
+        return self.bot.scheduler.call(fn, PRIORITY_HOUSEKEEPING, "recycle")
+
+    # open a window on the space, without waiting for it to load, and go back to the old one
+    def _open_window(self, old_window: str) -> str:
+        bot, driver = self.bot, self.bot.driver
+        size = driver.get_window_size()
+        driver.switch_to.new_window("window")
+        new_window = driver.current_window_handle
+        try:
+            driver.set_window_size(size["width"], size["height"])
+            prepare_page(driver, bot.lean_browser, keep_avatars=bot.frame_pipeline is not None)
+            driver.execute_cdp_cmd("Page.navigate", {"url": bot.space_url})
+        finally:
+            driver.switch_to.window(old_window)
+        return new_window
+
+    # one look at the fresh window: join, then wait for the participants. the sampler is
+    # installed a couple of samples ahead of the take over, so it knows the current speakers
+    def _new_window_ready(self, state: Dict[str, Any]) -> bool:
+        bot = self.bot
+        if not state["joined"]:
+            joined = bot.poll_join(rejoin=True)
+            if joined not in ("joined", None):
+                raise RecycleAborted(f"the space page shows {joined}")
+            state["joined"] = joined == "joined"
+            return False
+
+        if not bot.driver.execute_script(PARTICIPANTS_RECT_JS):
+            return False
+        if not bot.sampler_installed:
+            return True
+        if state["sampler_installed_at"] is None:
+            bot._install_speaker_sampler(bot.sampler_hz)
+            state["sampler_installed_at"] = time.time()
+            return False
+        return time.time() - state["sampler_installed_at"] >= 1 / bot.sampler_hz * 2
+
+    # last tick in the old window, first in the fresh one, then close the old one
+    def _take_over(self, old_window: str, new_window: str) -> None:
+        bot, driver = self.bot, self.bot.driver
+        if bot.sampler_installed:
+            bot.buffer_frames(bot._drain_speaker_sampler())
+        driver.switch_to.window(new_window)
+
+        if bot.sampler_installed:
+            # the fresh sampler only knows who is speaking now, one frame carries that over
+            drained = driver.execute_script(SPEAKER_SAMPLER_DRAIN_JS)
+            if drained is None:
+                driver.switch_to.window(old_window)
+                raise RecycleAborted("the fresh window's sampler is gone")
+            bot.sampler_speaking = {}
+            bot._frames_from_sampler_drain(drained)
+            speakers = [
+                {"username": username, "confidence": confidence}
+                for username, confidence in bot.sampler_speaking.items()
+            ]
+            timestamp = round(time.time() - bot.joined_space_at, 3)
+            bot.buffer_frames([{"timestamp": timestamp, "speakers": speakers}])
+
+        driver.switch_to.window(old_window)
+        driver.close()
+        driver.switch_to.window(new_window)
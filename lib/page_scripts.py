@@ -0,0 +1,362 @@
+# javascript injected into the space page via driver.execute_script. keeping the page-side logic
+# here lets a single round trip do the work of many find_element / execute_script calls.
+
+# speaking score of a speaker canvas: the mean pixel alpha in [0, 1]. the speaking animation is
+# drawn on a transparent canvas, so the more of it is covered the louder the ring. reading raw
+# pixels avoids png encoding the canvas and shipping the base64 text back over webdriver.
+# a webgl canvas has no 2d context, its pixels are copied onto a 2d scratch canvas first. null
+# if the pixels can't be read at all, so the caller can tell it from silence.
+_CANVAS_SCORE_FN = """
+function canvasScore(canvas) {
+    if (!canvas || !canvas.width || !canvas.height) {
+        return 0;
+    }
+    try {
+        let ctx = canvas.getContext("2d");
+        if (!ctx) {
+            const scratch = document.createElement("canvas");
+            scratch.width = canvas.width;
+            scratch.height = canvas.height;
+            ctx = scratch.getContext("2d");
+            ctx.drawImage(canvas, 0, 0);
+        }
+        const pixels = ctx.getImageData(0, 0, canvas.width, canvas.height).data;
+        let alpha = 0;
+        for (let i = 3; i < pixels.length; i += 4) {
+            alpha += pixels[i];
+        }
+        return alpha / 255 / (pixels.length / 4);
+    } catch (e) {
+        return null;
+    }
+}
+"""
+
+# username of a participant row, cached per row node in window.__xscRoster so the costly
+# ancestor xpath only runs for rows we have not seen. the cache is dropped when the rows in
+# ParticipantsWrapper change (mutation observer) and every refreshMs as a safety net.
+# hit, miss and invalidation counts are kept in window.__xscRoster.stats.
+_ROSTER_FN = """
+function rosterInvalidate(roster) {
+    roster.usernames = new WeakMap();
+    roster.builtAt = Date.now();
+    roster.stats.invalidations += 1;
+}
+
+function rosterUsername(node, usernameXPath, refreshMs) {
+    const wrapper = document.getElementById("ParticipantsWrapper");
+    let roster = window.__xscRoster;
+    if (!roster || roster.wrapper !== wrapper) {
+        if (roster && roster.observer) {
+            roster.observer.disconnect();
+        }
+        roster = {
+            wrapper: wrapper,
+            observer: null,
+            usernames: new WeakMap(),
+            builtAt: Date.now(),
+            stats: roster ? roster.stats : { hits: 0, misses: 0, invalidations: 0 },
+        };
+        if (wrapper) {
+            roster.observer = new MutationObserver(() => rosterInvalidate(roster));
+            roster.observer.observe(wrapper, {
+                childList: true,
+                subtree: true,
+                characterData: true,
+            });
+        }
+        window.__xscRoster = roster;
+    }
+    if (Date.now() - roster.builtAt > refreshMs) {
+        rosterInvalidate(roster);
+    }
+
+    let username = roster.usernames.get(node);
+    if (username !== undefined) {
+        roster.stats.hits += 1;
+        return username;
+    }
+    roster.stats.misses += 1;
+
+    const usernameNode = document.evaluate(
+        usernameXPath, node, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+    username = (usernameNode && usernameNode.textContent.trim()) || "Unknown";
+    roster.usernames.set(node, username);
+    return username;
+}
+
+function rosterStats() {
+    return window.__xscRoster ? window.__xscRoster.stats : null;
+}
+"""
+
+# returns the speaking score of the canvas passed as arguments[0]
+CANVAS_SCORE_JS = _CANVAS_SCORE_FN + "return canvasScore(arguments[0]);"
+
+# returns the version of the rows in ParticipantsWrapper, [page load, changes], for the
+# elements mode to drop its username cache whenever the rows change. the changes are counted by
+# a mutation observer installed on the first call, and again when the wrapper is replaced.
+ROSTER_VERSION_JS = """
+const wrapper = document.getElementById("ParticipantsWrapper");
+let watch = window.__xscRosterWatch;
+if (!watch || watch.wrapper !== wrapper) {
+    if (watch && watch.observer) {
+        watch.observer.disconnect();
+    }
+    watch = {wrapper: wrapper, observer: null, changes: watch ? watch.changes + 1 : 0};
+    if (wrapper) {
+        watch.observer = new MutationObserver(() => {
+            watch.changes += 1;
+        });
+        watch.observer.observe(wrapper, {childList: true, subtree: true, characterData: true});
+    }
+    window.__xscRosterWatch = watch;
+}
+return [performance.timeOrigin, watch.changes];
+"""
+
+# returns one entry per participant in ParticipantsWrapper plus the roster cache counters:
+#   {"participants": [{"username": str, "score": float}, ...], "roster": {...}}
+# arguments[0] is the participant xpath, arguments[1] the username xpath relative to a
+# participant and arguments[2] the roster cache refresh interval in ms.
+# a participant without a canvas is reported with score 0, one whose canvas can't be read with
+# score null.
+SPEAKER_SNAPSHOT_JS = _CANVAS_SCORE_FN + _ROSTER_FN + """
+const participantXPath = arguments[0];
+const usernameXPath = arguments[1];
+const rosterRefreshMs = arguments[2];
+
+const participants = document.evaluate(
+    participantXPath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+);
+
+const result = [];
+for (let i = 0; i < participants.snapshotLength; i++) {
+    const node = participants.snapshotItem(i);
+    result.push({
+        username: rosterUsername(node, usernameXPath, rosterRefreshMs),
+        score: canvasScore(node.querySelector("canvas")),
+    });
+}
+return { participants: result, roster: rosterStats() };
+"""
+
+# installs window.__xscSampler, which samples every participant's speaking score on animation
+# frames (throttled to arguments[2] hz) and buffers speaking on/off transitions with millisecond
+# timestamps, so python only has to drain the buffer every few seconds. arguments[0] and
+# arguments[1] are the participant and username xpaths, arguments[3] the speaking threshold,
+# arguments[4] the max number of buffered events (the oldest are dropped past it) and
+# arguments[5] the roster cache refresh interval in ms. participants whose canvas can't be read
+# count as not speaking, drains report them in "unreadable".
+SPEAKER_SAMPLER_INSTALL_JS = _CANVAS_SCORE_FN + _ROSTER_FN + """
+const participantXPath = arguments[0];
+const usernameXPath = arguments[1];
+const intervalMs = 1000 / arguments[2];
+const threshold = arguments[3];
+const maxEvents = arguments[4];
+const rosterRefreshMs = arguments[5];
+
+if (window.__xscSampler) {
+    window.__xscSampler.stop();
+}
+
+const sampler = {
+    events: [],
+    dropped: 0,
+    unreadable: {},
+    speaking: {},
+    lastSampleAt: 0,
+    running: true,
+    stop() {
+        this.running = false;
+    },
+    sample(now) {
+        const participants = document.evaluate(
+            participantXPath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+        );
+        const seen = {};
+        for (let i = 0; i < participants.snapshotLength; i++) {
+            const node = participants.snapshotItem(i);
+            const username = rosterUsername(node, usernameXPath, rosterRefreshMs);
+            const score = canvasScore(node.querySelector("canvas"));
+            if (score === null) {
+                this.unreadable[username] = true;
+            }
+            const speaking = score !== null && score >= threshold;
+            seen[username] = true;
+            if (speaking !== !!this.speaking[username]) {
+                this.push({ t: now, username: username, speaking: speaking, score: score });
+            }
+            this.speaking[username] = speaking;
+        }
+        // participants that left the stage stop speaking
+        for (const username of Object.keys(this.speaking)) {
+            if (!seen[username]) {
+                if (this.speaking[username]) {
+                    this.push({ t: now, username: username, speaking: false, score: 0 });
+                }
+                delete this.speaking[username];
+            }
+        }
+    },
+    push(event) {
+        this.events.push(event);
+        if (this.events.length > maxEvents) {
+            this.events.shift();
+            this.dropped += 1;
+        }
+    },
+    drain() {
+        const drained = {
+            events: this.events,
+            dropped: this.dropped,
+            unreadable: Object.keys(this.unreadable),
+            roster: rosterStats(),
+        };
+        this.events = [];
+        this.dropped = 0;
+        this.unreadable = {};
+        return drained;
+    },
+};
+
+function tick() {
+    if (!sampler.running) {
+        return;
+    }
+    const now = Date.now();
+    if (now - sampler.lastSampleAt >= intervalMs) {
+        sampler.lastSampleAt = now;
+        try {
+            sampler.sample(now);
+        } catch (e) {}
+    }
+    window.requestAnimationFrame(tick);
+}
+
+window.__xscSampler = sampler;
+window.requestAnimationFrame(tick);
+return true;
+"""
+
+# drains the events buffered by window.__xscSampler. returns null if the sampler is not installed
+# (e.g. the page was reloaded), otherwise {"events": [...], "dropped": int, "roster": {...}}.
+SPEAKER_SAMPLER_DRAIN_JS = """
+return window.__xscSampler ? window.__xscSampler.drain() : null;
+"""
+
+# looks for every known state of the space page at once and returns the first one shown, by
+# priority, as {"state": str, "element": element or null}, or null while the page is loading.
+# "ended" (play recording button), "start_listening" (join button, returned to be clicked),
+# "login_wall" (the cookies did not log us in) and "error" (missing space, x error page).
+JOIN_STATE_JS = """
+function shown(el) {
+    const rect = el.getBoundingClientRect();
+    return rect.width > 0 && rect.height > 0;
+}
+
+const found = {};
+for (const span of document.getElementsByTagName("span")) {
+    const text = span.textContent;
+    if (!found.ended && text.includes("Play recording") && shown(span)) {
+        found.ended = span;
+    } else if (!found.start_listening && text.includes("Start listening") && shown(span)) {
+        found.start_listening = span;
+    } else if (
+        !found.error &&
+        (text.includes("Something went wrong") ||
+            text.includes("doesn’t exist") ||
+            text.includes("doesn't exist")) &&
+        shown(span)
+    ) {
+        found.error = span;
+    }
+}
+const login = document.querySelector(
+    '[data-testid="loginButton"], a[href="/login"], a[href^="/i/flow/login"]'
+);
+if (login && shown(login)) {
+    found.login_wall = login;
+}
+
+// a page can keep a stale error beside the join button, so the join states win over it
+for (const state of ["ended", "start_listening", "login_wall", "error"]) {
+    if (found[state]) {
+        return {state: state, element: found[state]};
+    }
+}
+return null;
+"""
+
+# resolves as soon as the space page shows any of the JOIN_STATE_JS states, watching the page
+# for changes instead of polling, or with null after arguments[0] ms. the state comes with the
+# viewport coordinates of the center of its element: {"state": str, "x": float, "y": float}.
+# for the devtools engine, which awaits the promise.
+JOIN_STATE_WAIT_JS = "function joinState() {\n" + JOIN_STATE_JS + """}
+
+return new Promise((resolve) => {
+    let observer = null;
+    let timer = null;
+    const detect = () => {
+        const found = joinState();
+        if (!found) {
+            return false;
+        }
+        found.element.scrollIntoView({block: "center"});
+        const rect = found.element.getBoundingClientRect();
+        resolve({
+            state: found.state,
+            x: rect.left + rect.width / 2,
+            y: rect.top + rect.height / 2,
+        });
+        if (observer) {
+            observer.disconnect();
+        }
+        clearTimeout(timer);
+        return true;
+    };
+    if (detect()) {
+        return;
+    }
+    observer = new MutationObserver(detect);
+    observer.observe(document, {childList: true, subtree: true, characterData: true});
+    timer = setTimeout(() => {
+        observer.disconnect();
+        resolve(null);
+    }, arguments[0]);
+});
+"""
+
+# installs a mutation observer clicking away the "Got it" acknowledgement button whenever it
+# shows up, so nothing has to poll for it
+GOT_IT_DISMISSER_JS = """
+if (window.__xscGotIt) {
+    return;
+}
+const dismiss = () => {
+    for (const span of document.getElementsByTagName("span")) {
+        if (span.textContent.trim() === "Got it") {
+            span.click();
+        }
+    }
+};
+window.__xscGotIt = new MutationObserver(dismiss);
+window.__xscGotIt.observe(document.body, {childList: true, subtree: true});
+dismiss();
+"""
+
+# pushes the window.__xscSampler events to python every arguments[1] ms through the
+# arguments[0] binding (Runtime.addBinding), as the json of a SPEAKER_SAMPLER_DRAIN_JS result.
+# pushes even when there are no events, so python can tell the page was reloaded
+SPEAKER_SAMPLER_PUSH_JS = """
+const binding = arguments[0];
+if (window.__xscPush) {
+    clearInterval(window.__xscPush);
+}
+window.__xscPush = setInterval(() => {
+    if (window.__xscSampler && window[binding]) {
+        window[binding](JSON.stringify(window.__xscSampler.drain()));
+    }
+}, arguments[1]);
+"""
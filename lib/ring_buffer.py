@@ -0,0 +1,100 @@
+import struct
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional
+
+# slots, record size, records written, records read, records dropped for lack of room
+_HEADER = struct.Struct("<IIQQQ")
+_WRITTEN_OFFSET, _READ_OFFSET, _DROPPED_OFFSET = 8, 16, 24
+_COUNTER = struct.Struct("<Q")
+_LENGTH = struct.Struct("<I")
+
+
+class RingBuffer:
+    """
+    Fixed size records in a ring of shared memory, for one producer and one consumer process.
+
+    The producer only moves the write counter and the consumer only the read counter, each
+    after copying the record, so no lock is needed. A record put while the ring is full is
+    dropped and counted rather than blocking the producer. The creator unlinks the memory;
+    the other side attaches to it by name.
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, owner: bool):
+        self._memory = memory
+        self._owner = owner
+        self.slots, self.record_size = _HEADER.unpack_from(memory.buf, 0)[:2]
+        self._slot_size = _LENGTH.size + self.record_size
+
+    @classmethod
+    def create(cls, slots: int = 4096, record_size: int = 1024) -> "RingBuffer":
+        size = _HEADER.size + slots * (_LENGTH.size + record_size)
+        memory = shared_memory.SharedMemory(create=True, size=size)
+        _HEADER.pack_into(memory.buf, 0, slots, record_size, 0, 0, 0)
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "RingBuffer":
+        memory = shared_memory.SharedMemory(name=name)
+        # only the creator may unlink it, python would otherwise unlink it when this side exits
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return cls(memory, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def _counters(self):
+        return _HEADER.unpack_from(self._memory.buf, 0)[2:]
+
+    def __len__(self) -> int:
+        written, read, _ = self._counters()
+        return written - read
+
+    @property
+    def dropped(self) -> int:
+        return self._counters()[2]
+
+    def put(self, record: bytes) -> bool:
+        """Append a record, returns False if the ring was full and it was dropped"""
+        if len(record) > self.record_size:
+            raise ValueError(f"record of {len(record)} bytes, the ring holds {self.record_size}")
+        written, read, dropped = self._counters()
+        if written - read >= self.slots:
+            _COUNTER.pack_into(self._memory.buf, _DROPPED_OFFSET, dropped + 1)
+            return False
+
+        offset = _HEADER.size + (written % self.slots) * self._slot_size
+        _LENGTH.pack_into(self._memory.buf, offset, len(record))
+        start = offset + _LENGTH.size
+        self._memory.buf[start : start + len(record)] = record
+        # publish the record only once it is copied
+        _COUNTER.pack_into(self._memory.buf, _WRITTEN_OFFSET, written + 1)
+        return True
+
+    def get(self) -> Optional[bytes]:
+        """Oldest record, or None if the ring is empty"""
+        written, read, _ = self._counters()
+        if read == written:
+            return None
+
+        offset = _HEADER.size + (read % self.slots) * self._slot_size
+        (length,) = _LENGTH.unpack_from(self._memory.buf, offset)
+        start = offset + _LENGTH.size
+        record = bytes(self._memory.buf[start : start + length])
+        _COUNTER.pack_into(self._memory.buf, _READ_OFFSET, read + 1)
+        return record
+
+    def drain(self, limit: Optional[int] = None) -> List[bytes]:
+        """Up to limit of the oldest records"""
+        records = []
+        while limit is None or len(records) < limit:
+            record = self.get()
+            if record is None:
+                break
+            records.append(record)
+        return records
+
+    def close(self) -> None:
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
@@ -0,0 +1,46 @@
+import threading
+import time
+from typing import Dict, Optional
+
+
+class RosterCache:
+    """
+    Caches participant usernames across capture ticks.
+
+    Keyed by something stable per participant element (e.g. the webdriver element id, which
+    lives as long as the DOM node), so a tick only has to work out who is speaking. Entries
+    are dropped on invalidate(), when the participant rows change, and every refresh_interval
+    seconds as a safety net.
+    """
+
+    def __init__(self, refresh_interval: float = 60):
+        self.refresh_interval = refresh_interval
+        self._usernames: Dict[str, str] = {}
+        self._built_at = time.time()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if time.time() - self._built_at > self.refresh_interval:
+                self._invalidate()
+            username = self._usernames.get(key)
+            self._stats["hits" if username is not None else "misses"] += 1
+            return username
+
+    def put(self, key: str, username: str) -> None:
+        with self._lock:
+            self._usernames[key] = username
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._invalidate()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _invalidate(self) -> None:
+        self._usernames = {}
+        self._built_at = time.time()
+        self._stats["invalidations"] += 1
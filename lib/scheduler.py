@@ -0,0 +1,190 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# command priorities, lower runs first
+PRIORITY_SPEAKERS = 0
+PRIORITY_SCREENSHOTS = 1
+PRIORITY_HOUSEKEEPING = 2
+
+
+class CommandExpired(Exception):
+    """The command waited in the queue past its deadline and was not run"""
+
+
+class _Command:
+    def __init__(self, fn, priority, kind, deadline, coalesce_key):
+        self.fn = fn
+        self.priority = priority
+        self.kind = kind
+        self.deadline = deadline
+        self.coalesce_key = coalesce_key
+        self.future = Future()
+        self.submitted_at = time.time()
+
+
+class _KindStats:
+    def __init__(self):
+        self.submitted = 0
+        self.run = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.queue_delay = 0.0
+        self.max_queue_delay = 0.0
+        self.exec_time = 0.0
+        self.max_exec_time = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "submitted": self.submitted,
+            "run": self.run,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "expired": self.expired,
+            "avg_queue_ms": round(self.queue_delay / self.run * 1000, 1) if self.run else None,
+            "max_queue_ms": round(self.max_queue_delay * 1000, 1),
+            "avg_exec_ms": round(self.exec_time / self.run * 1000, 1) if self.run else None,
+            "max_exec_ms": round(self.max_exec_time * 1000, 1),
+        }
+
+
+class DriverScheduler:
+    """
+    Runs every command against a webdriver on one thread, in priority order.
+
+    Selenium drivers are not thread safe, so the capture loops submit their commands here
+    instead of calling the driver themselves. A command still queued past its deadline is
+    dropped, and a command submitted with the coalesce key of one still queued is merged into
+    it, so a stalled driver doesn't pile up stale ticks. Queueing delay and execution time are
+    measured per command kind.
+    """
+
+    def __init__(self, name: str = "DriverScheduler"):
+        self.name = name
+        self._queue: List = []
+        self._sequence = itertools.count()
+        self._queued_by_key: Dict[Hashable, _Command] = {}
+        self._condition = threading.Condition()
+        self._stats: Dict[str, _KindStats] = {}
+        self._stopped = False
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 5) -> None:
+        """Drop the queued commands and stop once the running one is done"""
+        with self._condition:
+            self._stopped = True
+            dropped, self._queue = self._queue, []
+            self._queued_by_key.clear()
+            self._condition.notify_all()
+        for *_, command in dropped:
+            command.future.cancel()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def submit(
+        self,
+        fn: Callable[[], Any],
+        priority: int,
+        kind: str,
+        deadline: Optional[float] = None,
+        coalesce_key: Optional[Hashable] = None,
+    ) -> Future:
+        """
+        Queue fn, returns a future of its result. deadline is in seconds from now. A command
+        with the coalesce key of one still queued returns the queued command's future.
+        """
+        with self._condition:
+            stats = self._stats.setdefault(kind, _KindStats())
+            stats.submitted += 1
+            if self._stopped:
+                future = Future()
+                future.cancel()
+                return future
+
+            if coalesce_key is not None and coalesce_key in self._queued_by_key:
+                stats.coalesced += 1
+                return self._queued_by_key[coalesce_key].future
+
+            if deadline is not None:
+                deadline = time.time() + deadline
+            command = _Command(fn, priority, kind, deadline, coalesce_key)
+            heapq.heappush(self._queue, (priority, next(self._sequence), command))
+            if coalesce_key is not None:
+                self._queued_by_key[coalesce_key] = command
+            self._condition.notify()
+            return command.future
+
+    def call(
+        self, fn: Callable[[], Any], priority: int, kind: str, timeout: Optional[float] = None
+    ):
+        """Run fn on the scheduler thread and wait for its result"""
+        if threading.current_thread() is self._thread:
+            return fn()
+        return self.submit(fn, priority, kind).result(timeout)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._condition:
+            stats = {kind: kind_stats.as_dict() for kind, kind_stats in self._stats.items()}
+        return stats
+
+    def _next(self) -> Optional[_Command]:
+        with self._condition:
+            while True:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return None
+
+                _, _, command = heapq.heappop(self._queue)
+                if command.coalesce_key is not None:
+                    self._queued_by_key.pop(command.coalesce_key, None)
+                if command.deadline is not None and time.time() > command.deadline:
+                    self._stats[command.kind].expired += 1
+                    command.future.set_exception(CommandExpired(command.kind))
+                    continue
+                if not command.future.set_running_or_notify_cancel():
+                    continue
+                return command
+
+    def _run(self) -> None:
+        while True:
+            command = self._next()
+            if command is None:
+                return
+
+            started_at = time.time()
+            try:
+                result = command.fn()
+            except BaseException as e:
+                error = e
+            else:
+                error = None
+            finished_at = time.time()
+
+            with self._condition:
+                stats = self._stats[command.kind]
+                stats.run += 1
+                queue_delay = started_at - command.submitted_at
+                exec_time = finished_at - started_at
+                stats.queue_delay += queue_delay
+                stats.max_queue_delay = max(stats.max_queue_delay, queue_delay)
+                stats.exec_time += exec_time
+                stats.max_exec_time = max(stats.max_exec_time, exec_time)
+                if error is not None:
+                    stats.failed += 1
+
+            if error is not None:
+                command.future.set_exception(error)
+            else:
+                command.future.set_result(result)
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# space metadata (title, started_at, joined_at, ...). legacy recordings also keep their frames here
+SPACE_JSON = "space_data.json"
+# append-only log of captured speaker frames, one json object per line
+FRAMES_STREAM = "speaker_frames"
+
+# seconds between fsyncs of the append-only logs. 0 fsyncs every append, None never fsyncs
+DEFAULT_FSYNC_INTERVAL = 5
+
+
+def stream_path(space_dir: str, stream: str) -> str:
+    return os.path.join(space_dir, f"{stream}.jsonl")
+
+
+class SpaceDataStore:
+    """
+    Persists a space's data: a small metadata json file plus append-only jsonl logs.
+
+    Appending never rewrites what is already on disk, so the cost of a write does not grow with
+    the length of the space, and a crash can at worst lose the line being written.
+    """
+
+    def __init__(self, space_dir: str, fsync_interval: Optional[float] = DEFAULT_FSYNC_INTERVAL):
+        self.space_dir = space_dir
+        self.metadata_path = os.path.join(space_dir, SPACE_JSON)
+        self.fsync_interval = fsync_interval
+        self._metadata: Dict[str, Any] = {}
+        self._streams: Dict[str, Any] = {}
+        self._last_fsync_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def reset(self, streams: Iterable[str] = (FRAMES_STREAM,)) -> None:
+        """
+        Start a new recording: empty metadata and the given logs truncated. Any other log in
+        the space directory is left alone
+        """
+        with self._lock:
+            for stream in list(self._streams):
+                self._close_stream(stream)
+            for stream in streams:
+                path = stream_path(self.space_dir, stream)
+                if os.path.exists(path):
+                    os.remove(path)
+            self._metadata = {}
+            self._write_metadata()
+
+    def write_metadata(self, metadata: Dict[str, Any]) -> None:
+        with self._lock:
+            self._metadata = dict(metadata)
+            self._write_metadata()
+
+    def update(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._metadata[key] = value
+            self._write_metadata()
+
+    def append(self, stream: str, records: Iterable[Dict[str, Any]]) -> None:
+        """Append records to a stream's log"""
+        lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        if not lines:
+            return
+        with self._lock:
+            f = self._streams.get(stream)
+            if f is None:
+                f = open(stream_path(self.space_dir, stream), "a", encoding="utf-8")
+                self._streams[stream] = f
+                self._last_fsync_at[stream] = time.time()
+            f.write(lines)
+            f.flush()
+            if self.fsync_interval is not None:
+                now = time.time()
+                if now - self._last_fsync_at[stream] >= self.fsync_interval:
+                    os.fsync(f.fileno())
+                    self._last_fsync_at[stream] = now
+
+    def append_frames(self, frames: Dict[str, Dict[str, Any]]) -> None:
+        """Append a batch of {frame_number: frame} to the frame log"""
+        self.append(
+            FRAMES_STREAM, ({"frame": int(number), **frame} for number, frame in frames.items())
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            for stream in list(self._streams):
+                self._close_stream(stream)
+
+    def _close_stream(self, stream: str) -> None:
+        f = self._streams.pop(stream)
+        f.flush()
+        if self.fsync_interval is not None:
+            os.fsync(f.fileno())
+        f.close()
+
+    # the metadata file is small, write it to a temp file and swap it in so it is never torn
+    def _write_metadata(self) -> None:
+        tmp_path = self.metadata_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._metadata, f, indent=2)
+        os.replace(tmp_path, self.metadata_path)
+
+
+def read_stream(space_dir: str, stream: str) -> Iterator[Dict[str, Any]]:
+    """Yield the records of a stream's log, skipping a torn trailing line"""
+    path = stream_path(space_dir, stream)
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"skipping unreadable line in {path}")
+
+
+def count_stream(space_dir: str, stream: str) -> int:
+    path = stream_path(space_dir, stream)
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def load_space_data(space_data_json: str, frames: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Load a space's data from either layout.
+
+    Legacy recordings keep everything, frames included, in space_data.json. Newer ones keep
+    metadata there and the frames in the append-only log beside it. Either way the result
+    looks like the legacy layout: metadata keys plus "frames" as {frame_number: frame}.
+    """
+    if not os.path.exists(space_data_json):
+        return None
+
+    with open(space_data_json, "r") as f:
+        space_data = json.load(f)
+
+    if frames and "frames" not in space_data:
+        space_dir = os.path.dirname(space_data_json)
+        space_data["frames"] = {}
+        for record in read_stream(space_dir, FRAMES_STREAM):
+            space_data["frames"][str(record.pop("frame"))] = record
+    return space_data
+
+
+def count_space_frames(space_data_json: str, space_data: Dict[str, Any]) -> int:
+    """Number of frames captured for a space, without loading them from the log"""
+    if "frames" in space_data:
+        return len(space_data["frames"])
+    return count_stream(os.path.dirname(space_data_json), FRAMES_STREAM)
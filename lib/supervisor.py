@@ -0,0 +1,412 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .bot import JOIN_ENDED, XSpaceBot, create_webdriver, load_cookies_into_driver
+from .lean_browser import read_network_log
+
+logger = logging.getLogger(__name__)
+
+# chrome throttles the timers and animation frames of windows it thinks nobody is looking at,
+# which would freeze the speaking animations of every space but the focused one
+SHARED_BROWSER_ARGS = (
+    "--disable-background-timer-throttling",
+    "--disable-backgrounding-occluded-windows",
+    "--disable-renderer-backgrounding",
+)
+WINDOW_SIZE = (375, 2000)
+
+# supervised space states
+SPACE_JOINING = "joining"
+SPACE_RECORDING = "recording"
+SPACE_STOPPED = "stopped"
+SPACE_FAILED = "failed"
+
+# per-space resource limits, override any of them with the supervisor's limits
+DEFAULT_LIMITS = {
+    # cap on the speaker capture rate of each space
+    "max_fps": 2,
+    # a space whose ticks take longer than this on average gets its rate halved, down to min_fps
+    "max_tick_seconds": 0.5,
+    "min_fps": 0.2,
+    # failing ticks in a row before the space is given up
+    "max_consecutive_errors": 10,
+    # frames waiting to be written before the space's ticks are skipped
+    "max_buffered_frames": 600,
+    # seconds to wait for the join button
+    "join_timeout": 30,
+}
+
+# seconds between looks at a space page that is still loading
+JOIN_POLL_INTERVAL = 1
+# seconds between attempts to dismiss the acknowledgement button
+DISMISS_INTERVAL = 10
+# seconds between health log lines
+HEALTH_LOG_INTERVAL = 60
+
+
+class SupervisedSpace:
+    """A space recorded in one window of a shared browser, with its health counters"""
+
+    def __init__(self, bot: XSpaceBot, fetch_audio: bool, interval: float):
+        self.bot = bot
+        self.space_id = bot.space_id
+        self.fetch_audio = fetch_audio
+        self.window: Optional[str] = None
+        self.state = SPACE_JOINING
+        self.browser: Optional[int] = None
+
+        # seconds between ticks asked for, and the current one after throttling
+        self.target_interval = interval
+        self.interval = interval
+        self.next_tick_at = 0.0
+        self.added_at = time.time()
+        self.last_dismiss_at = 0.0
+
+        self.ticks = 0
+        self.frames = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.skipped = 0
+        self.throttled = 0
+        self.last_tick_at: Optional[float] = None
+        self.avg_tick_seconds = 0.0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "browser": self.browser,
+            "fps": round(1 / self.interval, 3),
+            "ticks": self.ticks,
+            "frames": self.frames,
+            "buffered_frames": len(self.bot.frame_batch_buffer),
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "skipped": self.skipped,
+            "throttled": self.throttled,
+            "last_tick_at": self.last_tick_at,
+            "avg_tick_ms": round(self.avg_tick_seconds * 1000, 1),
+            # how late the last tick started, and the worst so far
+            "lag": round(self.lag, 3),
+            "max_lag": round(self.max_lag, 3),
+        }
+
+
+class SharedBrowser:
+    """
+    One chrome recording several spaces, one window each.
+
+    Webdriver commands go to the current window, so a single thread owns the driver and takes
+    turns between the windows: the space whose tick is the most overdue goes next.
+    """
+
+    def __init__(self, index: int, driver, limits: Dict[str, Any]):
+        self.index = index
+        self.driver = driver
+        self.limits = limits
+        self.spaces: Dict[str, SupervisedSpace] = {}
+        self._spaces_lock = threading.Lock()
+        self._commands = queue.Queue()
+        # the first window is never closed, a driver without windows ends its session
+        self._home_window = driver.current_window_handle
+        self._current_window = self._home_window
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name=f"SharedBrowser-{self.index}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 30) -> None:
+        """Stop every space, then quit the browser"""
+        self._commands.put(("stop", None))
+        if self._thread:
+            self._thread.join(timeout)
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.error(f"Error quitting shared browser {self.index}: {e}")
+
+    def add(self, space: SupervisedSpace) -> None:
+        space.browser = self.index
+        with self._spaces_lock:
+            self.spaces[space.space_id] = space
+        self._commands.put(("add", space))
+
+    def remove(self, space_id: str) -> None:
+        self._commands.put(("remove", space_id))
+
+    def active_spaces(self) -> int:
+        with self._spaces_lock:
+            return sum(
+                space.state in (SPACE_JOINING, SPACE_RECORDING) for space in self.spaces.values()
+            )
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        with self._spaces_lock:
+            return {space_id: space.health() for space_id, space in self.spaces.items()}
+
+    def _run(self) -> None:
+        while True:
+            space = self._next_space()
+            timeout = None if space is None else max(0, space.next_tick_at - time.time())
+            try:
+                command, arg = self._commands.get(timeout=timeout)
+            except queue.Empty:
+                self._tick(space)
+                continue
+
+            try:
+                if command == "stop":
+                    with self._spaces_lock:
+                        spaces = list(self.spaces.values())
+                    for space in spaces:
+                        if space.state in (SPACE_JOINING, SPACE_RECORDING):
+                            self._stop_space(space, SPACE_STOPPED)
+                    return
+                if command == "add":
+                    self._open_space(arg)
+                elif command == "remove" and arg in self.spaces:
+                    space = self.spaces[arg]
+                    if space.state in (SPACE_JOINING, SPACE_RECORDING):
+                        self._stop_space(space, SPACE_STOPPED)
+                    with self._spaces_lock:
+                        del self.spaces[arg]
+            except Exception as e:
+                logger.error(f"shared browser {self.index} failed to {command} a space: {e}")
+                if command == "add":
+                    self._stop_space(arg, SPACE_FAILED)
+
+    # spaces with an open window that still need ticks
+    def _scheduled(self) -> List[SupervisedSpace]:
+        with self._spaces_lock:
+            return [
+                space
+                for space in self.spaces.values()
+                if space.window and space.state in (SPACE_JOINING, SPACE_RECORDING)
+            ]
+
+    def _next_space(self) -> Optional[SupervisedSpace]:
+        return min(self._scheduled(), key=lambda space: space.next_tick_at, default=None)
+
+    def _switch_to(self, window: str) -> None:
+        if window != self._current_window:
+            self.driver.switch_to.window(window)
+            self._current_window = window
+
+    def _open_space(self, space: SupervisedSpace) -> None:
+        self.driver.switch_to.new_window("window")
+        self.driver.set_window_size(*WINDOW_SIZE)
+        space.window = self._current_window = self.driver.current_window_handle
+        # shared browsers don't take screenshots, the avatars can go too
+        space.bot.prepare_window(keep_avatars=False)
+
+        logger.info(f"joining space {space.space_id} in shared browser {self.index}...")
+        self.driver.get(space.bot.space_url)
+        space.bot.mark_join_latency("page_loaded")
+        space.added_at = space.next_tick_at = time.time()
+
+    def _stop_space(self, space: SupervisedSpace, state: str) -> None:
+        space.state = state
+        logger.info(f"space {space.space_id} {state}: {space.health()}")
+        try:
+            space.bot.store.update("supervisor_health", space.health())
+        except Exception as e:
+            logger.error(f"failed to save the health of space {space.space_id}: {e}")
+        if space.window:
+            try:
+                self._switch_to(space.window)
+                space.bot.measure_page_usage()
+            except Exception as e:
+                logger.error(f"failed to switch to the window of space {space.space_id}: {e}")
+        space.bot.stop()
+
+        if space.window:
+            try:
+                self._switch_to(space.window)
+                self.driver.close()
+                self.driver.switch_to.window(self._home_window)
+                self._current_window = self._home_window
+            except Exception as e:
+                logger.error(f"failed to close the window of space {space.space_id}: {e}")
+
+    def _tick(self, space: SupervisedSpace) -> None:
+        started_at = time.time()
+        space.lag = max(0.0, started_at - space.next_tick_at)
+        space.max_lag = max(space.max_lag, space.lag)
+
+        try:
+            self._switch_to(space.window)
+            if space.state == SPACE_JOINING:
+                self._poll_join(space)
+            else:
+                self._capture(space)
+            space.consecutive_errors = 0
+        except Exception as e:
+            space.errors += 1
+            space.consecutive_errors += 1
+            logger.error(f"tick of space {space.space_id} failed: {e}")
+            if space.consecutive_errors >= self.limits["max_consecutive_errors"]:
+                logger.error(f"space {space.space_id} keeps failing, giving up")
+                self._stop_space(space, SPACE_FAILED)
+                return
+
+        finished_at = time.time()
+        space.ticks += 1
+        space.last_tick_at = finished_at
+        space.avg_tick_seconds = 0.8 * space.avg_tick_seconds + 0.2 * (finished_at - started_at)
+        if space.state == SPACE_RECORDING:
+            self._follow_adaptive_rate(space)
+            self._enforce_time_budget(space)
+            interval = space.interval
+        else:
+            interval = JOIN_POLL_INTERVAL
+        # a late space is not owed the ticks it missed, so it can't crowd out the others
+        space.next_tick_at = max(space.next_tick_at + interval, finished_at)
+
+    def _poll_join(self, space: SupervisedSpace) -> None:
+        joined = space.bot.poll_join()
+        if joined == "joined":
+            logger.info(f"joined space {space.space_id}")
+            space.state = SPACE_RECORDING
+            space.bot.start_supervised_threads(space.fetch_audio)
+        elif joined == JOIN_ENDED:
+            logger.info(f"space {space.space_id} has ended")
+            self._stop_space(space, SPACE_STOPPED)
+        elif joined is not None:
+            logger.error(f"failed to join space {space.space_id}: {joined}")
+            self._stop_space(space, SPACE_FAILED)
+        elif time.time() - space.added_at > self.limits["join_timeout"]:
+            logger.error(f"failed to join space {space.space_id}, the join button was not found")
+            self._stop_space(space, SPACE_FAILED)
+
+    def _capture(self, space: SupervisedSpace) -> None:
+        # the frame writer is falling behind, don't pile up more frames
+        if len(space.bot.frame_batch_buffer) >= self.limits["max_buffered_frames"]:
+            space.skipped += 1
+            return
+
+        space.frames += space.bot.capture_speaker_tick()
+
+        if time.time() - space.last_dismiss_at >= DISMISS_INTERVAL:
+            space.bot.dismiss_got_it()
+            # the shared browser's network events, for the page usage of all of its spaces
+            read_network_log(self.driver)
+            space.last_dismiss_at = time.time()
+
+    # an adaptive speaker rate moves the interval asked for, a throttled space stays throttled
+    def _follow_adaptive_rate(self, space: SupervisedSpace) -> None:
+        if not space.bot.adaptive_rate:
+            return
+        target = max(space.bot.speaker_tick_interval(), 1 / self.limits["max_fps"])
+        throttled = space.interval > space.target_interval
+        space.interval = max(space.interval, target) if throttled else target
+        space.target_interval = target
+
+    # slow spaces get fewer ticks, so they can't starve the others of the browser
+    def _enforce_time_budget(self, space: SupervisedSpace) -> None:
+        max_interval = 1 / self.limits["min_fps"]
+        if space.avg_tick_seconds > self.limits["max_tick_seconds"]:
+            if space.interval < max_interval:
+                space.interval = min(space.interval * 2, max_interval)
+                space.throttled += 1
+                logger.warning(
+                    f"space {space.space_id} ticks take {space.avg_tick_seconds:.2f}s, "
+                    f"slowing it down to {1 / space.interval:.2f} fps"
+                )
+        elif space.avg_tick_seconds < self.limits["max_tick_seconds"] / 2:
+            space.interval = max(space.interval / 2, space.target_interval)
+
+
+class SpaceSupervisor:
+    """
+    Records several spaces at once in a small pool of shared browsers, one window per space.
+
+    Spaces go to the browser recording the fewest, and each space still writes to its own
+    data/<space_id> folder. Screenshots are not taken for supervised spaces.
+    """
+
+    def __init__(
+        self,
+        x_cookie_file: str,
+        x_bearer: str,
+        headless: bool = True,
+        browsers: int = 1,
+        limits: Optional[Dict[str, Any]] = None,
+    ):
+        self.x_cookie_file = x_cookie_file
+        self.x_bearer = x_bearer
+        self.headless = headless
+        self.browser_count = browsers
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.browsers: List[SharedBrowser] = []
+        self._assignments: Dict[str, SharedBrowser] = {}
+
+    def start(self) -> None:
+        for index in range(self.browser_count):
+            driver = create_webdriver(self.headless, SHARED_BROWSER_ARGS)
+            # the cookies are shared by every window of the browser
+            driver.get("https://x.com")
+            load_cookies_into_driver(driver, self.x_cookie_file)
+            browser = SharedBrowser(index, driver, self.limits)
+            browser.start()
+            self.browsers.append(browser)
+
+    def add_space(
+        self, space_id: str, fetch_space_metadata: bool = True, fetch_audio: bool = True, opts={}
+    ) -> bool:
+        """Start recording a space, returns False if it could not be set up"""
+        if space_id in self._assignments:
+            logger.warning(f"space {space_id} is already supervised")
+            return False
+        if not self.browsers:
+            logger.error(f"no browser to record space {space_id} in, start the supervisor first")
+            return False
+
+        browser = min(self.browsers, key=lambda browser: browser.active_spaces())
+        bot = XSpaceBot(
+            self.x_cookie_file, space_id, self.x_bearer, self.headless, driver=browser.driver
+        )
+        if not bot.start_supervised(fetch_space_metadata, opts):
+            return False
+
+        interval = max(bot.speaker_tick_interval(), 1 / self.limits["max_fps"])
+        browser.add(SupervisedSpace(bot, fetch_audio, interval))
+        self._assignments[space_id] = browser
+        return True
+
+    def remove_space(self, space_id: str) -> None:
+        """Stop recording a space"""
+        if browser := self._assignments.pop(space_id, None):
+            browser.remove(space_id)
+
+    def active_spaces(self) -> int:
+        return sum(browser.active_spaces() for browser in self.browsers)
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        """Health of every space, by space id"""
+        health = {}
+        for browser in self.browsers:
+            health.update(browser.health())
+        return health
+
+    def run_until_done(self, health_log_interval: float = HEALTH_LOG_INTERVAL) -> None:
+        """Log the health periodically until every space stopped"""
+        last_log_at = time.time()
+        while self.active_spaces():
+            time.sleep(1)
+            if time.time() - last_log_at >= health_log_interval:
+                last_log_at = time.time()
+                for space_id, health in self.health().items():
+                    logger.info(f"space {space_id}: {health}")
+
+    def stop(self) -> None:
+        for browser in self.browsers:
+            browser.stop()
+        self.browsers = []
+        self._assignments = {}
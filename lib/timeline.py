@@ -0,0 +1,122 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from lib.space_data import FRAMES_STREAM, load_space_data, stream_path
+
+# columnar speaker timeline, kept in its own folder inside the space folder
+TIMELINE_DIR = "timeline"
+TIMELINE_JSON = "timeline.json"
+COLUMNS = ("timestamps", "offsets", "speaker_ids", "confidence")
+
+
+class SpeakerTimeline:
+    """
+    Captured speaker frames as array-backed columns.
+
+    Usernames are interned once in a table and frames are stored CSR style: frame i holds for
+    [timestamps[i], timestamps[i + 1]) and its speakers are
+    speaker_ids[offsets[i]:offsets[i + 1]] with the matching confidence. Saved as .npy files
+    that are memory-mapped on load, so queries never build per-frame python objects.
+    """
+
+    def __init__(
+        self,
+        usernames: List[str],
+        timestamps: np.ndarray,
+        offsets: np.ndarray,
+        speaker_ids: np.ndarray,
+        confidence: np.ndarray,
+    ):
+        self.usernames = usernames
+        self.timestamps = timestamps
+        self.offsets = offsets
+        self.speaker_ids = speaker_ids
+        self.confidence = confidence
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def from_frames(cls, frames: Dict[str, Dict[str, Any]]) -> "SpeakerTimeline":
+        ordered = sorted(frames.values(), key=lambda frame: frame["timestamp"])
+        username_ids: Dict[str, int] = {}
+        timestamps = np.empty(len(ordered), dtype=np.float64)
+        offsets = np.zeros(len(ordered) + 1, dtype=np.int64)
+        speaker_ids = []
+        confidence = []
+        for i, frame in enumerate(ordered):
+            timestamps[i] = frame["timestamp"]
+            for speaker in frame["speakers"]:
+                speaker_ids.append(username_ids.setdefault(speaker["username"], len(username_ids)))
+                confidence.append(speaker.get("confidence", np.nan))
+            offsets[i + 1] = len(speaker_ids)
+        return cls(
+            list(username_ids),
+            timestamps,
+            offsets,
+            np.asarray(speaker_ids, dtype=np.uint32),
+            np.asarray(confidence, dtype=np.float32),
+        )
+
+    def save(self, space_dir: str) -> None:
+        timeline_dir = os.path.join(space_dir, TIMELINE_DIR)
+        os.makedirs(timeline_dir, exist_ok=True)
+        for column in COLUMNS:
+            np.save(os.path.join(timeline_dir, f"{column}.npy"), getattr(self, column))
+        # written last, a timeline without it is incomplete
+        with open(os.path.join(timeline_dir, TIMELINE_JSON), "w") as f:
+            json.dump({"usernames": self.usernames, "frames": len(self)}, f)
+
+    @classmethod
+    def load(cls, space_dir: str) -> Optional["SpeakerTimeline"]:
+        timeline_dir = os.path.join(space_dir, TIMELINE_DIR)
+        timeline_json = os.path.join(timeline_dir, TIMELINE_JSON)
+        if not os.path.exists(timeline_json):
+            return None
+        with open(timeline_json, "r") as f:
+            usernames = json.load(f)["usernames"]
+        columns = {
+            column: np.load(os.path.join(timeline_dir, f"{column}.npy"), mmap_mode="r")
+            for column in COLUMNS
+        }
+        return cls(usernames, **columns)
+
+    @classmethod
+    def load_or_build(cls, space_data_json: str) -> "SpeakerTimeline":
+        """Load a space's timeline, (re)building it from the captured frames when stale"""
+        space_dir = os.path.dirname(space_data_json)
+        timeline_json = os.path.join(space_dir, TIMELINE_DIR, TIMELINE_JSON)
+        sources = [space_data_json, stream_path(space_dir, FRAMES_STREAM)]
+        if os.path.exists(timeline_json):
+            built_at = os.path.getmtime(timeline_json)
+            if all(not os.path.exists(p) or os.path.getmtime(p) <= built_at for p in sources):
+                return cls.load(space_dir)
+
+        space_data = load_space_data(space_data_json)
+        timeline = cls.from_frames(space_data.get("frames", {}))
+        timeline.save(space_dir)
+        return timeline
+
+    def frame_range(self, t0: float, t1: float) -> Tuple[int, int]:
+        """Indices [lo, hi) of the frames whose span overlaps [t0, t1]"""
+        lo = max(int(np.searchsorted(self.timestamps, t0, side="right")) - 1, 0)
+        hi = int(np.searchsorted(self.timestamps, t1, side="right"))
+        return lo, max(hi, lo)
+
+    def speakers_between(self, t0: float, t1: float) -> Dict[str, int]:
+        """Who spoke between t0 and t1, with the number of frames each one spoke in"""
+        lo, hi = self.frame_range(t0, t1)
+        ids, counts = np.unique(
+            self.speaker_ids[self.offsets[lo] : self.offsets[hi]], return_counts=True
+        )
+        return {self.usernames[i]: int(count) for i, count in zip(ids, counts)}
+
+    def sole_speakers_between(self, t0: float, t1: float) -> List[str]:
+        """Speaker of every frame between t0 and t1 that has exactly one, in frame order"""
+        lo, hi = self.frame_range(t0, t1)
+        starts = self.offsets[lo:hi]
+        sole = (self.offsets[lo + 1 : hi + 1] - starts) == 1
+        return [self.usernames[i] for i in self.speaker_ids[starts[sole]]]
@@ -6,7 +6,8 @@ import subprocess
 from typing import Any, Dict, List
 
 from lib.chatbot import Chatbot
-from utils import convert_m4a_to_wav
+from lib.hls import find_asr_file
+from lib.intervals import load_intervals
 
 
 def transcribe_wav(wav_path: str, transcript_path: str, hf_token: str):
@@ -31,18 +32,15 @@ def transcribe_audio_and_write(audio_path: str, output_path: str, hf_token: str)
     Transcribe audio and write to output path.
     """
 
-    # ensure wav_path exists
+    # the 16 kHz mono input written with the recording needs no conversion
+    audio_path = find_asr_file(audio_path) or audio_path
+
+    # ensure audio_path exists
     if not os.path.isfile(audio_path):
         raise FileNotFoundError(
             f"audio file '{audio_path}' not found. Please record the space first."
         )
 
-    # ensure wav_path is a wav file
-    if audio_path.endswith(".m4a"):
-        wav_path = audio_path.replace(".m4a", ".wav")
-        convert_m4a_to_wav(audio_path, wav_path)
-        audio_path = wav_path
-
     command = transcribe_wav(audio_path, output_path, hf_token)
     try:
         subprocess.run(command, check=True)
@@ -63,13 +61,9 @@ def identify_speakers_in_transcript(transcript_json, space_data_json):
     with open(transcript_json, "r") as f:
         transcript_data = json.load(f)
 
-    with open(space_data_json, "r") as f:
-        space_data = json.load(f)
-
-    # space_start = space_data["started_at"]
-    # space_joined = space_data["joined_at"]
-    # space_join_buffer = space_joined - space_start
-    space_frames = space_data["frames"].items()
+    # segments are timed from the start of the audio, which starts before the join when the
+    # replay of the space was fetched with it
+    intervals = load_intervals(space_data_json, audio_time=True)
 
     identified_speakers = {}
 
@@ -84,42 +78,19 @@ def identify_speakers_in_transcript(transcript_json, space_data_json):
             )
             continue
 
-        # segments are timestamped in seconds relative to space start (I think)
-        # UPDATE: turns out this assumption was wrong, it's relative to space joined
-        # seg_start = int(space_joined + seg["timestamp"][0])
-        # seg_end = int(space_joined + seg["timestamp"][1])
-        seg_start = int(seg["timestamp"][0])
-        seg_end = int(seg["timestamp"][1])
-
-        # look for frames between seg_start and seg_end
-        for i, frame in space_frames:
-            frame_timestamp = frame["timestamp"]
-            frame_speakers = frame["speakers"]
-
-            # if frame_timestamp is not in the segment, skip
-            if frame_timestamp < seg_start or frame_timestamp > seg_end:
-                logging.debug(
-                    f"Frame timestamp {frame_timestamp} not in segment {seg_start} to {seg_end}"
-                )
-                continue
+        seg_start = seg["timestamp"][0]
+        seg_end = seg["timestamp"][1]
 
-            # if no speakers, skip
-            if len(frame_speakers) == 0:
-                logging.debug(f"No speakers in frame {i}, skipping")
-                continue
-            # if multiple speakers we cannot be certain, skip
-            if len(frame_speakers) > 1:
-                logging.debug(f"Multiple speakers in frame {i}, skipping")
-                continue
+        # look for stretches between seg_start and seg_end with a single speaker. stretches
+        # without speakers or with multiple speakers (we cannot be certain) are left out
+        for username in intervals.sole_speakers_between(seg_start, seg_end):
             # if speaker already identified, skip
-            if frame_speakers[0]["username"] in identified_speakers.values():
-                logging.debug(
-                    f"Speaker {frame_speakers[0]['username']} already identified, continuing"
-                )
+            if username in identified_speakers.values():
+                logging.debug(f"Speaker {username} already identified, continuing")
                 continue
 
             # identify speaker in transcript
-            identified_speakers[seg_speaker] = frame_speakers[0]["username"]
+            identified_speakers[seg_speaker] = username
             logging.info(
                 f"Identified speaker {seg_speaker} as {identified_speakers[seg_speaker]}\n"
             )
@@ -4,23 +4,46 @@ import re
 import shutil
 import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from functools import cached_property
 import threading
-from urllib.parse import urlparse
 
+import requests
 from mutagen.mp4 import MP4, MP4Cover
 from twspace_dl import API, Twspace
+from twspace_dl.api import TIMEOUT
+
+from .hls import (
+    AUDIO_OFFSET,
+    CHUNK_PLAYLIST_TTL,
+    MASTER_PLAYLIST_TTL,
+    Chunk,
+    ChunkDownloader,
+    DownloadCancelled,
+    LiveTail,
+    Playlist,
+    PlaylistCache,
+    asr_output_args,
+    format_playlist,
+    parse_master_playlist,
+    parse_playlist,
+)
+from .space_data import SpaceDataStore
 
 DEFAULT_FNAME_FORMAT = "(%(creator_name)s)%(title)s-%(id)s"
+# the replay playlist a live tail started with, kept with its chunks to resume with the same one
+ARCHIVE_PLAYLIST_FILE = "archive.m3u8"
 MP4_COVER_FORMAT_MAP = {"jpg": MP4Cover.FORMAT_JPEG, "png": MP4Cover.FORMAT_PNG}
 
 
 class TwspaceDL:
     """Downloader class for twitter spaces"""
 
-    def __init__(self, space: Twspace, format_str: str) -> None:
+    def __init__(self, space: Twspace, format_str: str, asr_format: str = None) -> None:
         self.space = space
         self.format_str = format_str or DEFAULT_FNAME_FORMAT
+        # also write the audio as transcription input in this format (see ASR_FORMATS)
+        self.asr_format = asr_format
         self._tempdir = ""
         self._cancel_event = threading.Event()
         self._download_thread = None
@@ -57,49 +80,68 @@ class TwspaceDL:
         master_url = re.sub(r"(?<=/audio-space/).*", "master_playlist.m3u8", self.dyn_url)
         return master_url
 
+    @cached_property
+    def playlist_cache(self) -> PlaylistCache:
+        """Playlists shared by the properties, revalidated rather than refetched"""
+        return PlaylistCache(API.client.session, timeout=TIMEOUT)
+
     @property
     def playlist_url(self) -> str:
         """Get the URL containing the chunks filenames"""
-        response = API.client.get(self.master_url)
-        playlist_suffix = response.text.splitlines()[3]
-        domain = urlparse(self.master_url).netloc
-        playlist_url = f"https://{domain}{playlist_suffix}"
-        return playlist_url
+        variants = self.playlist_cache.get(
+            self.master_url,
+            lambda text: parse_master_playlist(text, self.master_url),
+            MASTER_PLAYLIST_TTL,
+        )
+        return variants[0]
+
+    @property
+    def playlist(self) -> Playlist:
+        """The chunks, their URLs resolved against the master one to be able to download"""
+        return self.playlist_cache.get(
+            self.playlist_url,
+            lambda text: parse_playlist(text, self.master_url),
+            CHUNK_PLAYLIST_TTL,
+        )
 
     @property
     def playlist_text(self) -> str:
         """Modify the chunks URL using the master one to be able to download"""
-        playlist_text = API.client.get(self.playlist_url).text
-        master_url_wo_file = re.sub(r"master_playlist\.m3u8.*", "", self.master_url)
-        playlist_text = re.sub(r"(?=chunk)", master_url_wo_file, playlist_text)
-        return playlist_text
+        return format_playlist(self.playlist)
 
-    def write_playlist(self, save_dir: str = "./") -> None:
+    def write_playlist(self, save_dir: str = "./", playlist: Playlist = None) -> None:
         """Write the modified playlist for external use"""
         filename = os.path.basename(self.filename) + ".m3u8"
         path = os.path.join(save_dir, filename)
         with open(path, "w", encoding="utf-8") as stream_io:
-            stream_io.write(self.playlist_text)
+            stream_io.write(format_playlist(playlist or self.playlist))
         logging.debug("%(path)s written to disk", dict(path=path))
 
+    def _download_chunks(
+        self, playlist: Playlist, output_file: str, ffmpeg_args: list, asr_format: str = None
+    ) -> None:
+        """Fetch the chunks of the playlist concurrently and mux them into output_file"""
+        # kept next to the output, an interrupted download resumes from there
+        chunk_dir = os.path.splitext(output_file)[0] + ".chunks"
+        downloader = ChunkDownloader(chunk_dir, cancel_event=self._cancel_event)
+        try:
+            downloader.download(playlist, output_file, ffmpeg_args, asr_format)
+        except DownloadCancelled as err:
+            raise RuntimeError("Download cancelled") from err
+        except requests.RequestException as err:
+            raise RuntimeError(f"Failed to fetch the chunks: {err}") from err
+
     def download(self, output_dir: str = "./") -> None:
         """Download a twitter space"""
         if not shutil.which("ffmpeg"):
             raise FileNotFoundError("ffmpeg not installed")
         space = self.space
         os.makedirs(output_dir, exist_ok=True)
-        self.write_playlist(save_dir=output_dir)
+        playlist = self.playlist
+        self.write_playlist(save_dir=output_dir, playlist=playlist)
         state = space["state"]
 
-        cmd_base = [
-            "ffmpeg",
-            "-y",
-            "-stats",
-            "-v",
-            "warning",
-            "-i",
-            "-c",
-            "copy",
+        metadata = [
             "-metadata",
             f"title={space['title']}",
             "-metadata",
@@ -107,16 +149,11 @@ class TwspaceDL:
             "-metadata",
             f"episode_id={space['id']}",
         ]
+        cmd_base = ["ffmpeg", "-y", "-stats", "-v", "warning", "-i", "-c", "copy", *metadata]
 
+        # the old part, the chunks in the playlist, is fetched concurrently rather than by ffmpeg
         filename = os.path.basename(self.filename)
-        filename_m3u8 = os.path.join(output_dir, filename + ".m3u8")
         filename_old = os.path.join(output_dir, filename + ".m4a")
-        cmd_old = cmd_base.copy()
-        cmd_old.insert(1, "-protocol_whitelist")
-        cmd_old.insert(2, "file,https,httpproxy,tls,tcp")
-        cmd_old.insert(8, filename_m3u8)
-        cmd_old.append(filename_old)
-        logging.debug("Command for the old part: %s", " ".join(cmd_old))
 
         if state == "Running":
             filename_new = os.path.join(output_dir, filename + ".m4a")
@@ -141,18 +178,20 @@ class TwspaceDL:
             cmd_final.insert(4, "0")
             cmd_final.insert(10, concat_fn)
             cmd_final.append(os.path.join(output_dir, self.filename + ".m4a"))
+            if self.asr_format:
+                cmd_final += asr_output_args(cmd_final[-1], self.asr_format)
 
             logging.debug("Command for the new part: %s", " ".join(cmd_new))
             logging.debug("Command for the merge: %s", " ".join(cmd_final))
             try:
                 self._run_subprocess(cmd_new)
-                self._run_subprocess(cmd_old)
+                self._download_chunks(playlist, filename_old, metadata)
                 self._run_subprocess(cmd_final)
             except subprocess.CalledProcessError as err:
                 raise RuntimeError(" ".join(err.cmd)) from err
         else:
             try:
-                self._run_subprocess(cmd_old)
+                self._download_chunks(playlist, filename_old, metadata, self.asr_format)
             except subprocess.CalledProcessError as err:
                 raise RuntimeError(
                     " ".join(err.cmd) + "\nThis might be a temporary error, retry in a few minutes"
@@ -162,6 +201,87 @@ class TwspaceDL:
 
         logging.info("Finished downloading")
 
+    def _archived_playlist(self, chunk_dir: str) -> Playlist:
+        """The replay of the space so far, the one saved in chunk_dir if a tail started already"""
+        path = os.path.join(chunk_dir, ARCHIVE_PLAYLIST_FILE)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return parse_playlist(f.read())
+        playlist = self.playlist
+        os.makedirs(chunk_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(format_playlist(playlist))
+        return playlist
+
+    def live_tail(self, output_dir: str, store: SpaceDataStore) -> None:
+        """
+        Record a running space by appending its new segments to an .aac as they come, while
+        the replay of what came before the tail started is fetched beside it. Both are muxed
+        into the .m4a once the space ends or the tail is cancelled. Replays are downloaded.
+        """
+        if self.space["state"] != "Running":
+            self.download(output_dir)
+            return
+
+        os.makedirs(output_dir, exist_ok=True)
+        base = os.path.join(output_dir, os.path.basename(self.filename))
+        output_file = base + ".aac"
+        chunk_dir = base + ".chunks"
+        archive = self._archived_playlist(chunk_dir)
+        archive_duration = sum(chunk.duration for chunk in archive.chunks)
+        store.update(AUDIO_OFFSET, round(archive_duration, 3))
+        # not cancelled with the tail: the audio before the join is fetched to the end
+        archiver = ChunkDownloader(chunk_dir)
+        # revalidated on every poll, the tail paces the polls itself
+        tail = LiveTail(
+            lambda: self.playlist_cache.get(
+                self.dyn_url, lambda text: parse_playlist(text, self.dyn_url), 0
+            ),
+            output_file,
+            store,
+            cancel_event=self._cancel_event,
+            skip={chunk.name for chunk in archive.chunks},
+            audio_start=archive_duration,
+        )
+        with ThreadPoolExecutor(1, thread_name_prefix="ArchiveFetch") as executor:
+            archived = executor.submit(archiver.fetch, archive)
+            tail.run()
+            try:
+                archived.result()
+            except requests.RequestException as err:
+                raise RuntimeError(f"Failed to fetch the chunks: {err}") from err
+
+        tail_duration = tail.audio_end - archive_duration
+        if not archive.chunks and not tail.offset:
+            shutil.rmtree(chunk_dir)
+            os.remove(output_file)
+            return
+        if not shutil.which("ffmpeg"):
+            logging.warning("ffmpeg not installed, the audio is left in %s", output_file)
+            return
+        space = self.space
+        metadata = [
+            "-metadata",
+            f"title={space['title']}",
+            "-metadata",
+            f"artist={space['creator_name']}",
+            "-metadata",
+            f"episode_id={space['id']}",
+        ]
+        try:
+            archiver.mux(
+                archive,
+                base + ".m4a",
+                metadata,
+                self.asr_format,
+                tail=Chunk(output_file, tail_duration) if tail.offset else None,
+            )
+        except subprocess.CalledProcessError as err:
+            raise RuntimeError(" ".join(err.cmd)) from err
+        # muxed, the segment log keeps the timing of the tail
+        os.remove(output_file)
+        logging.info("Finished recording the live audio")
+
     def _run_subprocess(self, cmd):
         """Run a subprocess command with cancellation support"""
         process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -3,17 +3,25 @@ import os
 import time
 
 from dotenv import load_dotenv
-from utils import PATH_SPACE_DATA, PATH_TRANSCRIPT_UNIDENTIFIED, init_env, parse_space_id
+from utils import (
+    PATH_SPACE_DATA,
+    PATH_TRANSCRIPT_UNIDENTIFIED,
+    find_space_audio,
+    init_env,
+    parse_space_id,
+)
 
 load_dotenv()
 
 import argparse
 import os
-import glob
 import subprocess
 
+from lib.audio import benchmark_decode
 from lib.transcript import identify_speakers_in_transcript
-from lib.bot import XSpaceBot
+from lib.hls import find_asr_file
+from lib.daemon import DEFAULT_PORT, RecorderClient, RecorderDaemon, RecorderError, serve
+from lib.supervisor import SpaceSupervisor
 from lib.xapi import XAPI
 
 
@@ -21,37 +29,110 @@ from lib.xapi import XAPI
 # exit()
 
 
+# key1=value1,key2=value2 options for the bots
+def parse_opts(opts):
+    parsed_opts = {}
+    if opts:
+        try:
+            parsed_opts = dict(item.split("=") for item in opts.split(","))
+        except ValueError:
+            print("Warning: Invalid format for opts. Expected format: key1=value1,key2=value2")
+    return parsed_opts
+
+
+# run the recorder daemon, which owns the recordings started by the cli and the app
+def run_daemon(x_cookie_file, x_bearer, host, port, pool_size):
+    serve(RecorderDaemon(x_cookie_file, x_bearer, pool_size=pool_size), host, port)
+
+
+# have the recorder daemon record a space, returns as soon as it is joining
 def record_space(
     space_id,
     x_cookie_file,
-    x_bearer,
     headless,
     fetch_audio,
     fetch_space_metadata,
     take_screenshots,
     opts,
+    port=DEFAULT_PORT,
 ):
-    parsed_opts = {}
-    if opts:
-        try:
-            parsed_opts = dict(item.split("=") for item in opts.split(","))
-        except ValueError:
-            print("Warning: Invalid format for opts. Expected format: key1=value1,key2=value2")
-
-    bot = XSpaceBot(x_cookie_file, space_id, x_bearer, headless=headless)
     try:
-        bot.run(
+        status = RecorderClient(port=port).start(
+            space_id,
+            x_cookie_file=x_cookie_file,
+            headless=headless,
             fetch_audio=fetch_audio,
             fetch_space_metadata=fetch_space_metadata,
             take_screenshots=take_screenshots,
-            opts=parsed_opts,
+            opts=parse_opts(opts),
         )
-        # TODO: this is a hack to keep the main thread alive while the bot is running
-        while not bot.stop_event.is_set():
-            time.sleep(1)
+    except RecorderError as e:
+        print(f"Failed to start recording: {e}")
+        return
+    print(f"{space_id}: {status['state']}. stop it with: main.py stop {space_id}")
+
+
+def stop_recording(space_id, port=DEFAULT_PORT):
+    try:
+        print_status(RecorderClient(port=port).stop(space_id))
+    except RecorderError as e:
+        print(f"Failed to stop recording: {e}")
+
+
+# status of one recording of the daemon, or of all of them
+def recording_status(space_id=None, port=DEFAULT_PORT):
+    client = RecorderClient(port=port)
+    try:
+        statuses = [client.status(space_id)] if space_id else client.list()
+    except RecorderError as e:
+        print(f"Failed to get the recording status: {e}")
+        return
+    if not statuses:
+        print("No recordings.")
+    for status in statuses:
+        print_status(status)
+
+
+def print_status(status):
+    print(
+        f"{status['space_id']}: {status['state']}, {status['frames']} frames "
+        f"({status['fps'] or 0} fps), {status['audio_bytes'] / 2**20:.1f}mb of audio, "
+        f"{len(status['speakers_seen'])} speakers seen"
+    )
+    if status["error"]:
+        print(f"  error: {status['error']}")
+
+
+# record several spaces at once, sharing a small pool of browsers
+def record_spaces(
+    space_ids,
+    x_cookie_file,
+    x_bearer,
+    headless,
+    fetch_audio,
+    fetch_space_metadata,
+    browsers,
+    opts,
+):
+    parsed_opts = parse_opts(opts)
+
+    supervisor = SpaceSupervisor(x_cookie_file, x_bearer, headless=headless, browsers=browsers)
+    try:
+        supervisor.start()
+        for space_id in space_ids:
+            supervisor.add_space(
+                space_id,
+                fetch_space_metadata=fetch_space_metadata,
+                fetch_audio=fetch_audio,
+                opts=parsed_opts,
+            )
+        supervisor.run_until_done()
     except KeyboardInterrupt:
-        print("\nKeyboard interrupt received. Stopping bot...")
-        bot.stop()
+        print("\nKeyboard interrupt received. Stopping spaces...")
+    finally:
+        for space_id, health in supervisor.health().items():
+            print(f"{space_id}: {health}")
+        supervisor.stop()
 
 
 #  diarizate and speech-to-text the audio file
@@ -67,14 +148,13 @@ def gen_recording_transcript(space_id, hf_token):
     # join_time = dateutil_parser.isoparse(joined_at.replace("Z", "+00:00"))
     # cut_time = (join_time - start_time).total_seconds()
 
-    m4a = glob.glob(f"data/{space_id}/audio/*/audio_new.m4a")[0]
-    wav = m4a.replace(".m4a", ".wav")
-
-    if not os.path.isfile(wav) and os.path.isfile(m4a):
-        os.system(f"ffmpeg -i {m4a} {wav}")
-    elif not os.path.isfile(m4a):
-        print(f"Audio file '{m4a}' not found. Exiting.")
+    m4a = find_space_audio(space_id)
+    if m4a is None:
+        print(f"No recorded audio found for space {space_id}. Exiting.")
         return
+    # the 16 kHz mono input written with the recording, else the m4a itself: the cli decodes it
+    # in memory, no wav needs to be written
+    wav = find_asr_file(m4a) or m4a
 
     command = [
         "insanely-fast-whisper",
@@ -104,6 +184,18 @@ def transcribe_and_identify_speakers(space_id, hf_token):
     return identify_transcript_speakers(space_id)
 
 
+# time, peak memory and disk of decoding a recording's audio through a full rate wav, as
+# transcription used to, against decoding it in a pipe or in chunks
+def benchmark_audio(space_id):
+    m4a = find_space_audio(space_id)
+    if m4a is None:
+        print(f"No recorded audio found for space {space_id}. Exiting.")
+        return
+    print(f"benchmarking {m4a}")
+    for path, stats in benchmark_decode(m4a).items():
+        print(f"{path}: {stats}")
+
+
 def fetch_space_metadata(space_id, x_bearer):
     xapi = XAPI(x_bearer)
     try:
@@ -117,6 +209,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="XSpaceCadet CLI")
     subparsers = parser.add_subparsers(dest="command")
 
+    # daemon command
+    daemon_parser = subparsers.add_parser(
+        "daemon", help="run the recorder daemon, the record, stop and status commands talk to it"
+    )
+    daemon_parser.add_argument("--host", type=str, default="127.0.0.1", help="address to serve on")
+    daemon_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to serve on")
+    daemon_parser.add_argument(
+        "--pool-size", type=int, default=1, help="warm browsers kept for headless recordings"
+    )
+
     # record command
     record_parser = subparsers.add_parser("record", help="capture a space")
     record_parser.add_argument("space", type=str, help="space id")
@@ -158,6 +260,55 @@ if __name__ == "__main__":
         help="take screenshots from the space (useful for debugging)",
     )
     record_parser.add_argument("--opts", type=str, help="options for the bot", default=None)
+    record_parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="port of the recorder daemon"
+    )
+
+    # stop command
+    stop_parser = subparsers.add_parser("stop", help="stop recording a space")
+    stop_parser.add_argument("space", type=str, help="space id")
+    stop_parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="port of the recorder daemon"
+    )
+
+    # status command
+    status_parser = subparsers.add_parser("status", help="status of the recordings")
+    status_parser.add_argument("space", type=str, nargs="?", help="space id, all if omitted")
+    status_parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="port of the recorder daemon"
+    )
+
+    # record-many command
+    record_many_parser = subparsers.add_parser(
+        "record-many", help="capture several spaces at once in shared browsers"
+    )
+    record_many_parser.add_argument("spaces", type=str, nargs="+", help="space ids")
+    record_many_parser.add_argument("--cookie-file", type=str, help="path to x cookie file")
+    record_many_parser.add_argument(
+        "--no-headless",
+        action="store_true",
+        dest="no_headless",
+        default=False,
+        help="run the browsers in non-headless mode",
+    )
+    record_many_parser.add_argument(
+        "--no-audio",
+        dest="no_audio",
+        action="store_true",
+        default=False,
+        help="do not fetch audio from the spaces",
+    )
+    record_many_parser.add_argument(
+        "--no-metadata",
+        dest="no_metadata",
+        action="store_true",
+        default=False,
+        help="do not fetch space metadata",
+    )
+    record_many_parser.add_argument(
+        "--browsers", type=int, default=1, help="number of browsers shared by the spaces"
+    )
+    record_many_parser.add_argument("--opts", type=str, help="options for the bots", default=None)
 
     # process command
     gen_transcript_parser = subparsers.add_parser(
@@ -182,6 +333,12 @@ if __name__ == "__main__":
     fetch_metadata_parser.add_argument("space", type=str, help="space id")
     fetch_metadata_parser.add_argument("x_bearer", type=str, nargs="?", help="X API bearer token")
 
+    # benchmark audio command
+    benchmark_audio_parser = subparsers.add_parser(
+        "benchmark-audio", help="compare decoding a space's audio through a wav and a pipe"
+    )
+    benchmark_audio_parser.add_argument("space", type=str, help="space id")
+
     # initialize environment variables
     hf_token, x_bearer, x_cookie, missing = init_env()
     if missing:
@@ -199,27 +356,48 @@ if __name__ == "__main__":
 
     # parse arguments and override environment variables
     args = parser.parse_args()
-    space_id = parse_space_id(args.space)
-
-    if args.command == "record":
+    if args.command == "record-many":
+        space_ids = [parse_space_id(space) for space in args.spaces]
+    elif getattr(args, "space", None):
+        space_id = parse_space_id(args.space)
+    else:
+        space_id = None
+
+    # the daemon brings its own cookies, a record command only sends one it was given
+    record_cookie = None
+    if args.command in ("record", "record-many"):
         if args.cookie_file:
-            x_cookie = args.cookie_file
+            x_cookie = record_cookie = os.path.abspath(args.cookie_file)
 
     command_functions = {
+        "daemon": lambda: run_daemon(x_cookie, x_bearer, args.host, args.port, args.pool_size),
         "record": lambda: record_space(
             space_id,
+            record_cookie,
+            not args.no_headless,
+            not args.no_audio,
+            not args.no_metadata,
+            args.take_screenshots,
+            args.opts,
+            args.port,
+        ),
+        "stop": lambda: stop_recording(space_id, args.port),
+        "status": lambda: recording_status(space_id, args.port),
+        "record-many": lambda: record_spaces(
+            space_ids,
             x_cookie,
             x_bearer,
             not args.no_headless,
             not args.no_audio,
             not args.no_metadata,
-            args.take_screenshots,
+            args.browsers,
             args.opts,
         ),
         "gen-transcript": lambda: gen_recording_transcript(space_id, hf_token),
         "id-speakers": lambda: identify_transcript_speakers(space_id),
         "transcribe": lambda: transcribe_and_identify_speakers(space_id, hf_token),
         "fetch-metadata": lambda: fetch_space_metadata(space_id, x_bearer),
+        "benchmark-audio": lambda: benchmark_audio(space_id),
     }
 
     command_functions[args.command]()
@@ -0,0 +1,43 @@
+import unittest
+
+from lib.adaptive_rate import (
+    RATE_BUDGET,
+    RATE_OVERLAP,
+    RATE_SPEAKER_CHANGE,
+    AdaptiveRate,
+)
+
+
+class TestAdaptiveRate(unittest.TestCase):
+    def test_speaker_change_jumps_to_max(self):
+        rate = AdaptiveRate(min_fps=0.5, max_fps=4, calls_per_minute=1000)
+        self.assertEqual(rate.observe(["alice"], 1, now=0), RATE_SPEAKER_CHANGE)
+        self.assertEqual(rate.fps, 4)
+        self.assertEqual(rate.interval(), 0.25)
+
+    def test_overlap_holds_max(self):
+        rate = AdaptiveRate(min_fps=0.5, max_fps=4, calls_per_minute=1000, hold_ticks=1)
+        rate.observe(["alice", "bob"], 1, now=0)
+        rate.fps = 1
+        self.assertEqual(rate.observe(["bob", "alice"], 1, now=1), RATE_OVERLAP)
+        self.assertEqual(rate.fps, 4)
+
+    def test_same_speaker_backs_off_to_min(self):
+        rate = AdaptiveRate(min_fps=0.5, max_fps=4, calls_per_minute=1000, hold_ticks=3)
+        rate.observe(["alice"], 1, now=0)
+        # held for fewer than hold_ticks ticks, the rate stays
+        self.assertIsNone(rate.observe(["alice"], 1, now=1))
+        self.assertIsNone(rate.observe(["alice"], 1, now=2))
+        for now in range(3, 30):
+            rate.observe(["alice"], 1, now=now)
+        self.assertEqual(rate.fps, 0.5)
+
+    def test_budget_caps_the_rate(self):
+        # 60 calls per minute at 2 calls per tick is half a tick per second
+        rate = AdaptiveRate(min_fps=1, max_fps=4, calls_per_minute=60)
+        self.assertEqual(rate.observe(["alice"], 2, now=0), RATE_BUDGET)
+        self.assertEqual(rate.fps, 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
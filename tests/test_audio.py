@@ -0,0 +1,85 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import wave
+
+import numpy as np
+
+from lib.audio import PeakMemory, decode, iter_chunks, load_audio, map_pcm
+
+HAS_FFMPEG = shutil.which("ffmpeg") is not None
+
+
+class TestAudio(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        # 2.5 seconds of a 440 Hz tone
+        t = np.arange(int(2.5 * 16000)) / 16000
+        self.samples = (np.sin(2 * np.pi * 440 * t) * 0.5).astype(np.float32)
+
+    def write_wav(self, name, samples, rate=16000, channels=1):
+        path = os.path.join(self.tmp_dir, name)
+        with wave.open(path, "wb") as f:
+            f.setnchannels(channels)
+            f.setsampwidth(2)
+            f.setframerate(rate)
+            f.writeframes((samples * 32767).astype("<i2").tobytes())
+        return path
+
+    def test_maps_a_matching_wav(self):
+        path = self.write_wav("audio_16k.wav", self.samples)
+        mapped = map_pcm(path)
+        self.assertIsInstance(mapped, np.memmap)
+        self.assertEqual(len(mapped), len(self.samples))
+
+        samples = load_audio(path)
+        self.assertEqual(samples.dtype, np.float32)
+        np.testing.assert_allclose(samples, self.samples, atol=1e-4)
+
+    def test_other_files_are_not_mapped(self):
+        self.assertIsNone(map_pcm(self.write_wav("44k.wav", self.samples, rate=44100)))
+        self.assertIsNone(map_pcm(self.write_wav("stereo.wav", self.samples, channels=2)))
+        path = os.path.join(self.tmp_dir, "audio.m4a")
+        with open(path, "wb") as f:
+            f.write(b"\0" * 100)
+        self.assertIsNone(map_pcm(path))
+
+    def test_chunks_of_a_mapped_wav(self):
+        path = self.write_wav("audio_16k.wav", self.samples)
+        chunks = list(iter_chunks(path, chunk_seconds=1))
+        self.assertEqual([len(chunk) for chunk in chunks], [16000, 16000, 8000])
+        np.testing.assert_allclose(np.concatenate(chunks), self.samples, atol=1e-4)
+
+    def test_peak_memory(self):
+        with PeakMemory() as memory:
+            buffer = np.ones(64 * 2**20 // 4, np.float32)
+        self.assertGreater(memory.peak_mb, 32)
+        del buffer
+
+    @unittest.skipUnless(HAS_FFMPEG, "ffmpeg not installed")
+    def test_decodes_through_a_pipe(self):
+        wav_path = self.write_wav("44k.wav", self.samples, rate=44100)
+        flac_path = os.path.join(self.tmp_dir, "audio.flac")
+        subprocess.run(["ffmpeg", "-v", "error", "-i", wav_path, flac_path], check=True)
+
+        samples = decode(flac_path)
+        self.assertEqual(samples.dtype, np.float32)
+        # resampled from 44.1 to 16 kHz
+        self.assertAlmostEqual(len(samples), len(self.samples) * 16000 / 44100, delta=2)
+        chunks = list(iter_chunks(flac_path, chunk_seconds=0.5))
+        np.testing.assert_array_equal(np.concatenate(chunks), samples)
+
+    @unittest.skipUnless(HAS_FFMPEG, "ffmpeg not installed")
+    def test_decode_failure(self):
+        path = os.path.join(self.tmp_dir, "broken.m4a")
+        with open(path, "wb") as f:
+            f.write(b"not audio")
+        with self.assertRaises(RuntimeError):
+            decode(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
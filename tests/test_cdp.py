@@ -0,0 +1,92 @@
+import asyncio
+import json
+import unittest
+
+import websockets
+
+from lib.cdp import CDPConnection, CDPError, script_expression
+
+
+async def fake_chrome(websocket):
+    """Answers the commands in reverse order, after an event for the session that sent them"""
+    received = []
+    async for raw in websocket:
+        message = json.loads(raw)
+        received.append(message)
+        if len(received) < 2:
+            continue
+        for message in reversed(received):
+            session_id = message.get("sessionId")
+            await websocket.send(
+                json.dumps(
+                    {
+                        "method": "Page.loadEventFired",
+                        "params": {"for": message["id"]},
+                        **({"sessionId": session_id} if session_id else {}),
+                    }
+                )
+            )
+            if message["method"] == "Broken.command":
+                await websocket.send(
+                    json.dumps({"id": message["id"], "error": {"message": "not found"}})
+                )
+            else:
+                await websocket.send(
+                    json.dumps({"id": message["id"], "result": {"echo": message["params"]}})
+                )
+        received = []
+
+
+class TestCDPConnection(unittest.TestCase):
+    def run_with_chrome(self, test):
+        async def run():
+            async with websockets.serve(fake_chrome, "127.0.0.1", 0) as server:
+                port = server.sockets[0].getsockname()[1]
+                connection = await CDPConnection.connect(f"ws://127.0.0.1:{port}")
+                try:
+                    await test(connection)
+                finally:
+                    await connection.close()
+
+        asyncio.run(run())
+
+    def test_answers_and_events_are_routed(self):
+        async def test(connection):
+            page_events = connection.subscribe("Page.loadEventFired", "page")
+            browser_events = connection.subscribe("Page.loadEventFired")
+            first, second = await asyncio.gather(
+                connection.send("Runtime.evaluate", {"expression": "1"}, "page"),
+                connection.send("Target.getTargets"),
+            )
+            self.assertEqual(first, {"echo": {"expression": "1"}})
+            self.assertEqual(second, {"echo": {}})
+            # each subscriber only got the event of its own session
+            self.assertEqual(page_events.qsize(), 1)
+            self.assertEqual(browser_events.qsize(), 1)
+
+        self.run_with_chrome(test)
+
+    def test_errors_are_raised(self):
+        async def test(connection):
+            results = await asyncio.gather(
+                connection.send("Broken.command"),
+                connection.send("Target.getTargets"),
+                return_exceptions=True,
+            )
+            self.assertIsInstance(results[0], CDPError)
+            self.assertEqual(results[1], {"echo": {}})
+
+        self.run_with_chrome(test)
+
+
+class TestScriptExpression(unittest.TestCase):
+    def test_arguments_are_passed(self):
+        expression = script_expression("return arguments[0] + arguments[1];", "a", 2)
+        self.assertEqual(
+            expression,
+            '(function() {\nreturn arguments[0] + arguments[1];\n}).apply(null, ["a", 2])',
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import base64
+import threading
+import unittest
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from lib.cdp_capture import (
+    PARTICIPANTS_RECT_JS,
+    capture_clip,
+    participants_clip,
+    run_screencast,
+    screencast_format,
+)
+
+
+class FakeDriver:
+    """A chrome answering execute_script and execute_cdp_cmd, and pushing screencast frames"""
+
+    def __init__(self, rect=None, frames=()):
+        self.rect = rect
+        self.frames = list(frames)
+        self.scripts = []
+        self.cdp_commands = []
+        self.executed = []
+
+    def execute_script(self, script):
+        self.scripts.append(script)
+        return self.rect
+
+    def execute_cdp_cmd(self, cmd, params):
+        self.cdp_commands.append((cmd, params))
+        return {"data": base64.b64encode(b"image").decode()}
+
+    @asynccontextmanager
+    async def bidi_connection(self):
+        page = SimpleNamespace(
+            ScreencastFrame="Page.screencastFrame",
+            start_screencast=lambda **params: ("Page.startScreencast", params),
+            screencast_frame_ack=lambda session_id: ("Page.screencastFrameAck", session_id),
+            stop_screencast=lambda: ("Page.stopScreencast",),
+        )
+        session = SimpleNamespace(listen=self._listen, execute=self._execute)
+        yield SimpleNamespace(session=session, devtools=SimpleNamespace(page=page))
+
+    def _listen(self, event_type):
+        frames = self.frames
+
+        class Listener:
+            async def receive(self):
+                return frames.pop(0)
+
+        return Listener()
+
+    async def _execute(self, command):
+        self.executed.append(command)
+
+
+def frame(session_id, data, timestamp):
+    return SimpleNamespace(
+        session_id=session_id,
+        data=base64.b64encode(data).decode(),
+        metadata=SimpleNamespace(timestamp=timestamp),
+    )
+
+
+class TestClip(unittest.TestCase):
+    def test_participants_clip(self):
+        rect = {"x": 10, "y": 20.5, "width": 300, "height": 200}
+        driver = FakeDriver(rect=rect)
+        self.assertEqual(participants_clip(driver), {**rect, "scale": 1})
+        self.assertEqual(driver.scripts, [PARTICIPANTS_RECT_JS])
+
+    def test_no_participants_on_the_page(self):
+        self.assertIsNone(participants_clip(FakeDriver(rect=None)))
+        # laid out but not visible yet
+        rect = {"x": 0, "y": 0, "width": 0, "height": 200}
+        self.assertIsNone(participants_clip(FakeDriver(rect=rect)))
+
+    def test_capture_clip(self):
+        driver = FakeDriver()
+        clip = {"x": 10, "y": 20, "width": 300, "height": 200, "scale": 1}
+        self.assertEqual(capture_clip(driver, clip), b"image")
+        capture_clip(driver, None, image_format="jpeg", quality=60)
+
+        self.assertEqual(
+            driver.cdp_commands,
+            [
+                ("Page.captureScreenshot", {"format": "png", "clip": clip}),
+                ("Page.captureScreenshot", {"format": "jpeg", "quality": 60}),
+            ],
+        )
+
+
+class TestScreencast(unittest.TestCase):
+    def test_frames_are_acked_and_throttled(self):
+        driver = FakeDriver(
+            frames=[
+                frame(1, b"first", 100.0),
+                # faster than 1 fps, acked and dropped
+                frame(2, b"too soon", 100.4),
+                frame(3, b"second", 101.0),
+                # no timestamp, taken as received
+                frame(4, b"third", None),
+            ]
+        )
+        stop_event = threading.Event()
+        received = []
+
+        def on_frame(data, captured_at):
+            received.append((data, captured_at))
+            if len(received) == 3:
+                stop_event.set()
+
+        run_screencast(driver, on_frame, stop_event, image_format="jpeg", quality=60, fps=1)
+
+        self.assertEqual([data for data, _ in received], [b"first", b"second", b"third"])
+        self.assertEqual([at for _, at in received[:2]], [100.0, 101.0])
+        self.assertGreater(received[2][1], 101.0)
+        self.assertEqual(
+            driver.executed,
+            [
+                ("Page.startScreencast", {"format_": "jpeg", "quality": 60}),
+                ("Page.screencastFrameAck", 1),
+                ("Page.screencastFrameAck", 2),
+                ("Page.screencastFrameAck", 3),
+                ("Page.screencastFrameAck", 4),
+                ("Page.stopScreencast",),
+            ],
+        )
+
+    def test_screencast_is_stopped_when_a_frame_fails(self):
+        driver = FakeDriver(frames=[frame(1, b"first", 100.0)])
+
+        def on_frame(data, captured_at):
+            raise OSError("disk full")
+
+        with self.assertRaises(OSError):
+            run_screencast(driver, on_frame, threading.Event())
+        self.assertEqual(driver.executed[-1], ("Page.stopScreencast",))
+
+    def test_webp_is_screencast_as_jpeg(self):
+        self.assertEqual(screencast_format("png"), "png")
+        self.assertEqual(screencast_format("jpeg"), "jpeg")
+        self.assertEqual(screencast_format("webp"), "jpeg")
+
+        driver = FakeDriver(frames=[frame(1, b"first", 100.0)])
+        with self.assertRaises(ValueError):
+            run_screencast(driver, lambda data, captured_at: None, threading.Event(), "webp")
+        # rejected before the screencast is started
+        self.assertEqual(driver.executed, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from lib.daemon import (
+    RECORDING_FAILED,
+    RECORDING_JOINING,
+    RECORDING_RECORDING,
+    RECORDING_STOPPED,
+    RecorderClient,
+    RecorderDaemon,
+    RecorderError,
+    make_server,
+)
+
+
+class FakeBot:
+    def __init__(self, x_cookie_file, space_id, x_bearer, headless=True, pool=None):
+        self.space_id = space_id
+        self.pool = pool
+        self.stop_event = threading.Event()
+        self.joined_space_at = None
+        self.failure = None
+        self.run_opts = None
+
+    def run(self, **kwargs):
+        self.run_opts = kwargs
+        if self.space_id == "ended":
+            # gives up on its own, as the bot does when the space can't be joined
+            self.failure = "failed to join: the space has ended"
+            return self.stop()
+        self.joined_space_at = 1.0
+        self.stop_event.wait()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def status(self):
+        return {
+            "space_id": self.space_id,
+            "frames": 0,
+            "fps": None,
+            "audio_bytes": 0,
+            "speakers_seen": [],
+        }
+
+
+@mock.patch("lib.daemon.XSpaceBot", FakeBot)
+class TestRecorderDaemon(unittest.TestCase):
+    def setUp(self):
+        self.daemon = RecorderDaemon("cookies.json", "bearer", pool_size=0)
+        self.addCleanup(self.daemon.shutdown)
+        server = make_server(self.daemon, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.client = RecorderClient(port=server.server_address[1], timeout=5)
+
+    def wait_for(self, space_id, state):
+        for _ in range(100):
+            status = self.client.status(space_id)
+            if status["state"] == state:
+                return status
+            threading.Event().wait(0.01)
+        self.fail(f"space {space_id} never got {state}")
+
+    def test_start_returns_before_joining(self):
+        status = self.client.start("abc", take_screenshots=True, opts={"fps": 2})
+        self.assertIn(status["state"], (RECORDING_JOINING, RECORDING_RECORDING))
+        self.wait_for("abc", RECORDING_RECORDING)
+
+        bot = self.daemon._get("abc").bot
+        self.assertEqual(bot.run_opts["opts"], {"fps": 2})
+        self.assertTrue(bot.run_opts["take_screenshots"])
+        self.assertEqual([r["space_id"] for r in self.client.list()], ["abc"])
+
+    def test_stop(self):
+        self.client.start("abc")
+        self.wait_for("abc", RECORDING_RECORDING)
+        self.assertEqual(self.client.stop("abc")["state"], RECORDING_STOPPED)
+        # a stopped space can be recorded again
+        self.client.start("abc")
+        self.wait_for("abc", RECORDING_RECORDING)
+
+    def test_join_failure(self):
+        self.client.start("ended")
+        status = self.wait_for("ended", RECORDING_FAILED)
+        self.assertEqual(status["error"], "failed to join: the space has ended")
+
+    def test_pooled_with_the_daemon_cookies(self):
+        self.daemon.pool = mock.Mock()
+        self.client.start("abc", x_cookie_file="./cookies.json")
+        self.assertIs(self.daemon._get("abc").bot.pool, self.daemon.pool)
+        self.client.start("xyz", x_cookie_file="other.json")
+        self.assertIsNone(self.daemon._get("xyz").bot.pool)
+
+    def test_finished_recordings_are_pruned(self):
+        with mock.patch("lib.daemon.MAX_FINISHED_RECORDINGS", 2):
+            for space_id in ("a", "b", "c", "d"):
+                self.client.start(space_id)
+                self.wait_for(space_id, RECORDING_RECORDING)
+                self.client.stop(space_id)
+            self.client.start("e")
+        self.assertEqual([r["space_id"] for r in self.client.list()], ["c", "d", "e"])
+
+    def test_refused_requests(self):
+        self.client.start("abc")
+        with self.assertRaisesRegex(RecorderError, "already being recorded"):
+            self.client.start("abc")
+        with self.assertRaisesRegex(RecorderError, "no recording of space other"):
+            self.client.stop("other")
+        with self.assertRaisesRegex(RecorderError, "invalid request"):
+            self.client.start("xyz", unknown_option=True)
+
+    def test_daemon_not_running(self):
+        client = RecorderClient(port=1, timeout=1)
+        with self.assertRaisesRegex(RecorderError, "not running"):
+            client.list()
+
+
+class FakeDriver:
+    """A space page that keeps loading, it never shows a join state"""
+
+    def __init__(self):
+        self.polling = threading.Event()
+        self.used_after_checkin = False
+        self.checked_in = False
+
+    def get(self, url):
+        self.used_after_checkin |= self.checked_in
+
+    def execute_script(self, script, *args):
+        self.used_after_checkin |= self.checked_in
+        self.polling.set()
+        return None
+
+
+class FakePool:
+    def __init__(self):
+        self.driver = FakeDriver()
+        self.checking_out = threading.Event()
+        self.available = threading.Event()
+        self.available.set()
+        self.checkins = []
+
+    def checkout(self, timeout=30):
+        self.checking_out.set()
+        self.available.wait(5)
+        return self.driver
+
+    def checkin(self, driver, recycle=False):
+        driver.checked_in = True
+        self.checkins.append((driver, recycle))
+
+    def close(self):
+        pass
+
+
+@mock.patch("lib.bot.TwspaceDL", mock.Mock())
+@mock.patch("lib.bot.Twspace", mock.Mock())
+@mock.patch("lib.bot.API", mock.Mock())
+@mock.patch("lib.bot.load_cookies", mock.Mock())
+class TestStopWhileJoining(unittest.TestCase):
+    """A recording stopped before it joined, with the real bot in a fake pooled browser"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # the bot writes to data/<space_id> under the working directory
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp.name)
+        self.daemon = RecorderDaemon("cookies.json", "bearer", pool_size=0)
+        self.daemon.pool = self.pool = FakePool()
+
+    def start(self):
+        self.daemon.start_recording("abc", fetch_audio=False, fetch_space_metadata=False)
+        return self.daemon._get("abc")
+
+    def assert_stopped_cleanly(self, recording):
+        recording.thread.join(10)
+        self.assertFalse(recording.thread.is_alive())
+        status = recording.status()
+        self.assertEqual(status["state"], RECORDING_STOPPED)
+        self.assertIsNone(status["error"])
+        # handed back once, after the run was done with it, and nothing started
+        self.assertEqual(self.pool.checkins, [(self.pool.driver, True)])
+        self.assertFalse(self.pool.driver.used_after_checkin)
+        self.assertEqual(recording.bot.threads, [])
+        self.assertFalse(recording.bot.scheduler._thread)
+
+    def test_stop_during_checkout(self):
+        self.pool.available.clear()
+        recording = self.start()
+        self.assertTrue(self.pool.checking_out.wait(5))
+        self.assertEqual(self.daemon.stop_recording("abc")["state"], RECORDING_STOPPED)
+
+        # the browser checked out after the stop goes back to the pool
+        self.pool.available.set()
+        self.assert_stopped_cleanly(recording)
+
+    def test_stop_while_waiting_for_the_join_button(self):
+        recording = self.start()
+        self.assertTrue(self.pool.driver.polling.wait(5))
+        # the run is still using the browser, it hands it back itself once it sees the stop
+        self.assertEqual(self.daemon.stop_recording("abc")["state"], RECORDING_STOPPED)
+        self.assert_stopped_cleanly(recording)
+
+
+if __name__ == "__main__":
+    unittest.main()
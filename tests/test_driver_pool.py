@@ -0,0 +1,154 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from lib.bot import read_cookie_file
+from lib.driver_pool import DriverPool
+
+
+class FakeDriver:
+    def __init__(self, headless=True, extra_args=(), user_data_dir=None):
+        self.user_data_dir = user_data_dir
+        self.window_handles = ["main"]
+        self.urls = []
+        self.quit_called = False
+        self.switch_to = mock.Mock()
+
+    def get(self, url):
+        self.urls.append(url)
+
+    def quit(self):
+        self.quit_called = True
+
+
+def wait_for_idle(pool, idle=1, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        stats = pool.stats()
+        if stats["idle"] >= idle and not stats["pending"]:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"pool never got {idle} idle browsers: {pool.stats()}")
+
+
+@mock.patch("lib.driver_pool.load_cookies_into_driver")
+@mock.patch("lib.driver_pool.create_webdriver", side_effect=FakeDriver)
+class TestDriverPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_pool(self, **kwargs):
+        pool = DriverPool("cookies.txt", profiles_dir=self.tmp.name, **kwargs)
+        pool.start()
+        wait_for_idle(pool, kwargs.get("size", 1))
+        return pool
+
+    def test_warm_browser_is_reused(self, create_webdriver, load_cookies):
+        pool = self.make_pool(size=1)
+        driver = pool.checkout(timeout=1)
+        self.assertEqual(driver.user_data_dir, os.path.join(self.tmp.name, "0"))
+        driver.get("https://x.com/i/spaces/space")
+        pool.checkin(driver)
+        wait_for_idle(pool)
+
+        self.assertIs(pool.checkout(timeout=1), driver)
+        self.assertEqual(driver.urls[-1], "https://x.com")
+        self.assertEqual(create_webdriver.call_count, 1)
+        self.assertEqual(load_cookies.call_count, 1)
+        self.assertEqual(pool.stats()["warm_checkouts"], 2)
+
+    def test_worn_out_browser_is_relaunched(self, create_webdriver, load_cookies):
+        pool = self.make_pool(size=1, max_uses=1)
+        driver = pool.checkout(timeout=1)
+        pool.checkin(driver)
+        wait_for_idle(pool)
+
+        self.assertTrue(driver.quit_called)
+        replacement = pool.checkout(timeout=1)
+        self.assertIsNot(replacement, driver)
+        self.assertEqual(replacement.user_data_dir, driver.user_data_dir)
+        self.assertEqual(pool.stats()["recycled"], 1)
+
+    def test_cold_checkout_when_pool_is_empty(self, create_webdriver, load_cookies):
+        pool = self.make_pool(size=1)
+        pool.checkout(timeout=1)
+        extra = pool.checkout(timeout=1)
+
+        # launched on the spot, without a profile, and quit when handed back
+        self.assertIsNone(extra.user_data_dir)
+        pool.checkin(extra)
+        self.assertTrue(extra.quit_called)
+        self.assertEqual(pool.stats()["cold_checkouts"], 1)
+
+    def test_profile_in_use_by_another_pool(self, create_webdriver, load_cookies):
+        pool = self.make_pool(size=1)
+        other = self.make_pool(size=1)
+        driver = pool.checkout(timeout=1)
+        other_driver = other.checkout(timeout=1)
+
+        # the second pool can't have the locked profile, it gets a temporary one
+        self.assertEqual(driver.user_data_dir, os.path.join(self.tmp.name, "0"))
+        self.assertNotEqual(other_driver.user_data_dir, driver.user_data_dir)
+        self.assertTrue(os.path.isdir(other_driver.user_data_dir))
+        # removed once the pool is closed and its browser quit
+        other.close()
+        self.assertTrue(os.path.isdir(other_driver.user_data_dir))
+        other.checkin(other_driver)
+        self.assertFalse(os.path.exists(other_driver.user_data_dir))
+
+        # closing the first pool keeps the profile locked for the browser still checked out
+        pool.close()
+        third = self.make_pool(size=1)
+        self.assertNotEqual(third.checkout(timeout=1).user_data_dir, driver.user_data_dir)
+        third.close()
+
+        # and frees it once that browser is handed back
+        pool.checkin(driver)
+        self.assertTrue(driver.quit_called)
+        fourth = self.make_pool(size=1)
+        self.addCleanup(fourth.close)
+        self.assertEqual(fourth.checkout(timeout=1).user_data_dir, driver.user_data_dir)
+
+
+class TestReadCookieFile(unittest.TestCase):
+    def test_http_only_and_session_cookies(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("# Netscape HTTP Cookie File\n")
+            f.write("#HttpOnly_.x.com\tTRUE\t/\tTRUE\t1893456000\tauth_token\tsecret\n")
+            f.write(".x.com\tTRUE\t/\tFALSE\t0\tlang\ten\n")
+        try:
+            cookies = read_cookie_file(f.name)
+        finally:
+            os.remove(f.name)
+
+        self.assertEqual(
+            cookies,
+            [
+                {
+                    "name": "auth_token",
+                    "value": "secret",
+                    "domain": ".x.com",
+                    "path": "/",
+                    "secure": True,
+                    "httpOnly": True,
+                    "expires": 1893456000,
+                },
+                {
+                    "name": "lang",
+                    "value": "en",
+                    "domain": ".x.com",
+                    "path": "/",
+                    "secure": False,
+                    "httpOnly": False,
+                },
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
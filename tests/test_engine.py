@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from lib.bot import JOIN_ENDED, JOIN_START_LISTENING, SPEAKER_CAPTURE_SCRIPT
+from lib.engine import CDPEngine
+from lib.roster import RosterCache
+
+JOIN_FOUND = {"state": JOIN_START_LISTENING, "x": 120.5, "y": 300.0}
+
+
+class FakePage:
+    """A devtools page session, loading on navigate and answering the engine's scripts"""
+
+    def __init__(self, join_found=JOIN_FOUND, snapshots=None):
+        self.join_found = join_found
+        self.snapshots = snapshots
+        self.sent = []
+        self.evaluated = []
+        self.subscribers = {}
+        self.closed = False
+
+    async def send(self, method, params=None, **kwargs):
+        self.sent.append((method, params))
+        if method == "Page.navigate":
+            self.emit("Network.loadingFinished", {"encodedDataLength": 2048})
+            self.emit("Page.loadEventFired", {})
+        if method == "Performance.getMetrics":
+            return {"metrics": [{"name": "JSHeapUsedSize", "value": 1000}]}
+        return {}
+
+    async def evaluate(self, expression, await_promise=False, **kwargs):
+        self.evaluated.append(expression)
+        if await_promise:
+            return self.join_found
+        if "ParticipantsWrapper" in expression and self.snapshots is not None:
+            snapshot = self.snapshots.pop(0) if len(self.snapshots) > 1 else self.snapshots[0]
+            if isinstance(snapshot, Exception):
+                raise snapshot
+            return snapshot
+        return None
+
+    def subscribe(self, method):
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(method, []).append(queue)
+        return queue
+
+    def unsubscribe(self, method, queue):
+        self.subscribers[method].remove(queue)
+
+    def emit(self, method, params):
+        for queue in self.subscribers.get(method, []):
+            queue.put_nowait(params)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    closed = False
+
+    def __init__(self, page):
+        self.page = page
+
+    async def new_page(self, url="about:blank"):
+        return self.page
+
+
+class FakeBot:
+    def __init__(self):
+        self.driver = object()
+        self.space_id = "space"
+        self.space_url = "https://x.com/i/spaces/space"
+        self.lean_browser = False
+        self.speaker_capture_mode = SPEAKER_CAPTURE_SCRIPT
+        self.roster_cache = RosterCache()
+        self.adaptive_rate = None
+        self.stop_event = threading.Event()
+        self.joined_space_at = None
+        self.join_latency = []
+        self.failure = None
+        self.page_usage = None
+        self.frames = []
+        self.adapted = []
+        self.stopped = threading.Event()
+
+    def _track_browser_usage(self):
+        pass
+
+    def mark_join_latency(self, milestone):
+        self.join_latency.append(milestone)
+
+    def _mark_joined(self):
+        self.joined_space_at = time.time()
+
+    def speaker_tick_interval(self):
+        return 0.01
+
+    def _speakers_from_snapshot(self, snapshot):
+        return snapshot
+
+    def _adapt_speaker_rate(self, frame, calls):
+        self.adapted.append(calls)
+
+    def buffer_frames(self, frames):
+        self.frames.extend(frames)
+
+    def flush_frame_batch(self):
+        pass
+
+    def start_audio_download(self):
+        pass
+
+    def stop(self):
+        self.stopped.set()
+
+
+class TestCDPEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = CDPEngine()
+        self.engine.start()
+        self.addCleanup(self.engine.loop.call_soon_threadsafe, self.engine.loop.stop)
+        patcher = mock.patch("lib.engine.debugger_address", return_value="127.0.0.1:9222")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, page, bot):
+        self.engine._connections["127.0.0.1:9222"] = FakeConnection(page)
+        return self.engine.record(bot, fetch_audio=False, take_screenshots=False)
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("condition never met")
+
+    def test_joins_and_snapshots_the_speakers(self):
+        page = FakePage(snapshots=[["alice"], ["alice", "bob"]])
+        bot = FakeBot()
+        space = self.record(page, bot)
+        self.wait_for(lambda: len(bot.frames) >= 3)
+
+        self.assertEqual(bot.join_latency, ["page_loaded", JOIN_START_LISTENING])
+        self.assertIsNotNone(bot.joined_space_at)
+        clicks = [params for method, params in page.sent if method == "Input.dispatchMouseEvent"]
+        self.assertEqual([click["type"] for click in clicks], ["mousePressed", "mouseReleased"])
+        self.assertEqual({(click["x"], click["y"]) for click in clicks}, {(120.5, 300.0)})
+        self.assertEqual(bot.frames[0]["speakers"], ["alice"])
+        self.assertEqual(bot.frames[1]["speakers"], ["alice", "bob"])
+        timestamps = [frame["timestamp"] for frame in bot.frames]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+        space.stop()
+        self.assertTrue(space.task.done())
+        self.assertTrue(page.closed)
+        # measured before the page is closed, with the bytes of its network events
+        self.assertEqual(
+            bot.page_usage,
+            {"JSHeapUsedSize": 1000, "transfer_bytes": 2048, "requests": 1},
+        )
+        self.assertFalse(bot.stopped.is_set())
+        # stopping twice is harmless
+        space.stop()
+
+    def test_failed_snapshots_are_skipped(self):
+        page = FakePage(snapshots=[RuntimeError("context destroyed"), ["alice"]])
+        bot = FakeBot()
+        bot.adaptive_rate = object()
+        space = self.record(page, bot)
+        self.wait_for(lambda: bot.frames)
+        space.stop()
+
+        self.assertEqual(bot.frames[0]["speakers"], ["alice"])
+        # one evaluate a snapshot, and none for the failed one
+        self.assertEqual(bot.adapted, [1] * len(bot.frames))
+
+    def test_space_that_has_ended(self):
+        page = FakePage(join_found={"state": JOIN_ENDED, "x": 0, "y": 0})
+        bot = FakeBot()
+        space = self.record(page, bot)
+        self.assertTrue(bot.stopped.wait(5))
+
+        self.assertTrue(bot.stop_event.is_set())
+        self.assertEqual(bot.failure, "failed to join: the space has ended")
+        self.assertIsNone(bot.joined_space_at)
+        self.assertNotIn("Input.dispatchMouseEvent", [method for method, _ in page.sent])
+        space.stop()
+        self.assertTrue(page.closed)
+
+    def test_join_button_never_shown(self):
+        bot = FakeBot()
+        space = self.record(FakePage(join_found=None), bot)
+        self.assertTrue(bot.stopped.wait(5))
+        self.assertEqual(bot.failure, "failed to join: the join button was not found")
+        space.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
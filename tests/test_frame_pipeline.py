@@ -0,0 +1,163 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from lib.frame_pipeline import DROP_OLDEST, SKIP_TICK, FramePipeline, VideoSink
+
+
+class StubSink:
+    def __init__(self, ordered=False, fail_on=()):
+        self.ordered = ordered
+        self.fail_on = fail_on
+        self.frames = []
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def write(self, data, frame_number, timestamp, data_format):
+        if frame_number in self.fail_on:
+            raise OSError("disk full")
+        with self._lock:
+            if data in [frame[0] for frame in self.frames]:
+                return False
+            self.frames.append((data, frame_number))
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+class FakeFfmpeg:
+    def __init__(self, cmd, stdin=None):
+        self.cmd = cmd
+        self.stdin = io.BytesIO()
+        self.stdin.close = lambda: None
+
+    def wait(self):
+        return 0
+
+
+class TestFramePipeline(unittest.TestCase):
+    def submit_all(self, pipeline, count):
+        # the workers are not started yet, so the queue fills up
+        return [pipeline.submit(b"frame %d" % i, i) for i in range(count)]
+
+    def test_drop_oldest(self):
+        sink = StubSink()
+        pipeline = FramePipeline(sink, max_queue=2, drop_policy=DROP_OLDEST)
+        self.assertEqual(self.submit_all(pipeline, 4), [True, True, False, False])
+        pipeline.start()
+        pipeline.stop()
+
+        self.assertEqual(sorted(frame for _, frame in sink.frames), [2, 3])
+        self.assertTrue(sink.closed)
+        stats = pipeline.stats()
+        self.assertEqual(stats["captured"], 4)
+        self.assertEqual(stats["dropped"], 2)
+        self.assertEqual(stats["encoded"], 2)
+        self.assertEqual(stats["queued"], 0)
+
+    def test_skip_tick(self):
+        sink = StubSink()
+        pipeline = FramePipeline(sink, max_queue=2, drop_policy=SKIP_TICK)
+        self.assertEqual(self.submit_all(pipeline, 4), [True, True, False, False])
+        pipeline.start()
+        pipeline.stop()
+
+        self.assertEqual(sorted(frame for _, frame in sink.frames), [0, 1])
+        self.assertEqual(pipeline.stats()["dropped"], 2)
+
+    def test_duplicates_and_failures_are_counted(self):
+        sink = StubSink(ordered=True, fail_on=(2,))
+        pipeline = FramePipeline(sink, workers=4)
+        # an ordered sink gets a single worker
+        self.assertEqual(pipeline.workers, 1)
+        pipeline.start()
+        for frame_number, data in enumerate([b"a", b"a", b"b", b"c"]):
+            pipeline.submit(data, frame_number)
+        pipeline.stop()
+
+        self.assertEqual(sink.frames, [(b"a", 0), (b"c", 3)])
+        stats = pipeline.stats()
+        self.assertEqual(stats["encoded"], 2)
+        self.assertEqual(stats["duplicates"], 1)
+        self.assertEqual(stats["failed"], 1)
+
+    def test_stop_with_a_stalled_sink(self):
+        sink = StubSink()
+        writing, stalled = threading.Event(), threading.Event()
+        write = sink.write
+        sink.write = lambda *frame: writing.set() or stalled.wait() and write(*frame)
+        self.addCleanup(stalled.set)
+        pipeline = FramePipeline(sink, workers=1, max_queue=2)
+        pipeline.start()
+        # the worker is stuck on the first frame, the next two fill the queue
+        pipeline.submit(b"frame 0", 0)
+        self.assertTrue(writing.wait(5))
+        pipeline.submit(b"frame 1", 1)
+        pipeline.submit(b"frame 2", 2)
+
+        started_at = time.time()
+        with self.assertLogs(level="WARNING"):
+            pipeline.stop(timeout=0.1)
+        self.assertLess(time.time() - started_at, 2)
+        self.assertTrue(sink.closed)
+        self.assertEqual(pipeline.stats()["dropped"], 1)
+
+    def test_unknown_drop_policy(self):
+        with self.assertRaises(ValueError):
+            FramePipeline(StubSink(), drop_policy="drop_newest")
+
+
+@mock.patch("lib.frame_pipeline.subprocess.Popen", side_effect=FakeFfmpeg)
+@mock.patch("lib.frame_pipeline.shutil.which", return_value="/usr/bin/ffmpeg")
+class TestVideoSink(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.video_path = os.path.join(self.tmp.name, "screenshots.mp4")
+
+    def test_identical_frames_are_skipped(self, which, popen):
+        sink = VideoSink(self.video_path, fps=2)
+        self.assertTrue(sink.write(b"a", 0, 10.0, "png"))
+        self.assertFalse(sink.write(b"a", 1, 10.5, "png"))
+        self.assertTrue(sink.write(b"b", 2, 11.0, "jpeg"))
+        # the same as an earlier frame, but not the last one
+        self.assertTrue(sink.write(b"a", 3, 11.5, "png"))
+        sink.close()
+
+        self.assertEqual(sink._process.stdin.getvalue(), b"aba")
+        cmd = popen.call_args[0][0]
+        self.assertEqual(cmd[cmd.index("-framerate") + 1], "2")
+        self.assertEqual(cmd[-1], self.video_path)
+
+    def test_sidecar_maps_video_frames(self, which, popen):
+        sink = VideoSink(self.video_path)
+        for frame_number, data in enumerate([b"a", b"a", b"b"]):
+            sink.write(data, frame_number, 10.0 + frame_number, "png")
+        sink.close()
+
+        self.assertEqual(sink.sidecar_path, os.path.join(self.tmp.name, "screenshots.jsonl"))
+        with open(sink.sidecar_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(
+            records,
+            [
+                {"video_frame": 0, "frame": 0, "timestamp": 10.0},
+                {"video_frame": 1, "frame": 2, "timestamp": 12.0},
+            ],
+        )
+
+    def test_ffmpeg_not_installed(self, which, popen):
+        which.return_value = None
+        with self.assertRaises(FileNotFoundError):
+            VideoSink(self.video_path)
+        popen.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
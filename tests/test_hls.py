@@ -0,0 +1,331 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from lib.hls import (
+    AUDIO_SEGMENTS_STREAM,
+    Chunk,
+    ChunkDownloader,
+    DownloadCancelled,
+    LiveTail,
+    PlaylistCache,
+    asr_file,
+    audio_time_at,
+    find_asr_file,
+    format_playlist,
+    new_session,
+    parse_master_playlist,
+    parse_playlist,
+    strip_id3,
+)
+from lib.space_data import SpaceDataStore, read_stream
+
+CHUNKS = {f"chunk_{i}_a.aac": bytes([i]) * (1000 + i) for i in range(20)}
+# the timestamp tag packed audio segments start with
+ID3_TAG = b"ID3\x04\x00\x00\x00\x00\x00\x05" + b"tag!!"
+
+
+class HlsHandler(BaseHTTPRequestHandler):
+    """Serves the playlist and its chunks, failing the first request of the flaky ones"""
+
+    requests = Counter()
+    flaky = set()
+
+    def do_GET(self):
+        name = self.path.lstrip("/")
+        self.requests[name] += 1
+        if name == "playlist.m3u8":
+            etag = f'"{hash(self.server.playlist)}"'
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(b"", 304)
+            return self._send(self.server.playlist.encode("utf-8"), headers={"ETag": etag})
+        if name not in CHUNKS:
+            return self._send(b"", 404)
+        if name in self.flaky and self.requests[name] == 1:
+            return self._send(b"", 503)
+        self._send(ID3_TAG + CHUNKS[name] if self.server.id3 else CHUNKS[name])
+
+    def _send(self, body, code=200, headers={}):
+        self.send_response(code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HlsServerTestCase(unittest.TestCase):
+    def setUp(self):
+        HlsHandler.requests = Counter()
+        HlsHandler.flaky = set()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), HlsHandler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:3", "#EXT-X-MEDIA-SEQUENCE:7"]
+        for name in CHUNKS:
+            lines += ["#EXTINF:3.000,", name]
+        self.server.playlist = "\n".join(lines + ["#EXT-X-ENDLIST"])
+        self.server.id3 = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.chunk_dir = os.path.join(self.tmp_dir, "space.chunks")
+
+    def playlist(self):
+        return parse_playlist(self.server.playlist, self.base_url)
+
+
+class TestChunkDownloader(HlsServerTestCase):
+    def test_parse_playlist(self):
+        playlist = self.playlist()
+        self.assertEqual(len(playlist.chunks), len(CHUNKS))
+        self.assertEqual(playlist.chunks[0].url, self.base_url + "chunk_0_a.aac")
+        self.assertEqual(playlist.chunks[0].duration, 3.0)
+        self.assertEqual(playlist.media_sequence, 7)
+        self.assertTrue(playlist.ended)
+
+    def test_format_playlist(self):
+        playlist = self.playlist()
+        self.assertEqual(parse_playlist(format_playlist(playlist)), playlist)
+        self.assertEqual(
+            parse_master_playlist(
+                "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\n/a/playlist.m3u8", self.base_url
+            ),
+            [self.base_url + "a/playlist.m3u8"],
+        )
+
+    def test_playlist_cache_revalidates(self):
+        cache = PlaylistCache(new_session(1))
+        url = self.base_url + "playlist.m3u8"
+        parsed = []
+
+        def parse(text):
+            parsed.append(text)
+            return parse_playlist(text, self.base_url)
+
+        playlist = cache.get(url, parse, ttl=10, now=0)
+        self.assertIs(cache.get(url, parse, ttl=10, now=5), playlist)
+        # past the ttl, unchanged: a 304, nothing parsed
+        self.assertIs(cache.get(url, parse, ttl=10, now=11), playlist)
+        self.server.playlist += "\n#EXTINF:3.000,\nchunk_20_a.aac"
+        self.assertEqual(len(cache.get(url, parse, ttl=10, now=22).chunks), len(CHUNKS) + 1)
+
+        self.assertEqual(len(parsed), 2)
+        self.assertEqual(HlsHandler.requests["playlist.m3u8"], 3)
+        self.assertEqual(cache.stats(), {"requests": 3, "not_modified": 1, "hits": 1})
+
+    def test_fetches_every_chunk_with_retries(self):
+        HlsHandler.flaky = {"chunk_3_a.aac", "chunk_11_a.aac"}
+        paths = ChunkDownloader(self.chunk_dir, workers=4).fetch(self.playlist())
+
+        for path, (name, data) in zip(paths, CHUNKS.items()):
+            self.assertEqual(os.path.basename(path), name)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), data)
+        self.assertEqual(HlsHandler.requests["chunk_3_a.aac"], 2)
+        with open(os.path.join(self.chunk_dir, "manifest.json")) as f:
+            manifest = json.load(f)["chunks"]
+        self.assertEqual(manifest, {name: len(data) for name, data in CHUNKS.items()})
+
+    def test_resumes_with_the_missing_chunks(self):
+        cancel_event = threading.Event()
+        cancel_event.set()
+        with self.assertRaises(DownloadCancelled):
+            ChunkDownloader(self.chunk_dir, cancel_event=cancel_event).fetch(self.playlist())
+
+        # an interrupted download: half of the chunks fetched, one of them cut short
+        ChunkDownloader(self.chunk_dir).fetch(
+            self.playlist()._replace(chunks=self.playlist().chunks[:10])
+        )
+        with open(os.path.join(self.chunk_dir, "chunk_5_a.aac"), "wb") as f:
+            f.write(b"cut")
+        HlsHandler.requests.clear()
+
+        downloader = ChunkDownloader(self.chunk_dir)
+        downloader.fetch(self.playlist())
+        self.assertEqual(downloader.resumed, 9)
+        self.assertEqual(downloader.fetched, 11)
+        self.assertEqual(set(HlsHandler.requests), {"chunk_5_a.aac"} | set(list(CHUNKS)[10:]))
+
+    def test_mux_runs_ffmpeg_once_on_the_local_chunks(self):
+        downloader = ChunkDownloader(self.chunk_dir)
+        output_file = os.path.join(self.tmp_dir, "space.m4a")
+        with mock.patch("lib.hls.subprocess.run") as run:
+            downloader.download(self.playlist(), output_file, ["-metadata", "title=space"])
+
+        run.assert_called_once()
+        cmd = run.call_args.args[0]
+        self.assertEqual(cmd[-3:], ["-metadata", "title=space", output_file])
+        self.assertFalse(os.path.exists(self.chunk_dir))
+
+    def test_mux_plays_the_tail_after_the_chunks(self):
+        downloader = ChunkDownloader(self.chunk_dir)
+        downloader.fetch(self.playlist())
+        tail_file = os.path.join(self.tmp_dir, "space.aac")
+        muxed = []
+
+        def run(cmd, **kwargs):
+            with open(cmd[cmd.index("-i") + 1]) as f:
+                muxed.append(parse_playlist(f.read()))
+
+        with mock.patch("lib.hls.subprocess.run", run):
+            downloader.mux(
+                self.playlist(), os.path.join(self.tmp_dir, "space.m4a"), tail=Chunk(tail_file, 9)
+            )
+
+        (playlist,) = muxed
+        self.assertEqual([chunk.url for chunk in playlist.chunks[:-1]], list(CHUNKS))
+        self.assertEqual(playlist.chunks[-1], Chunk(tail_file, 9.0))
+
+    def test_mux_writes_the_transcription_input_in_the_same_run(self):
+        downloader = ChunkDownloader(self.chunk_dir)
+        output_file = os.path.join(self.tmp_dir, "audio.m4a")
+        flac_file = os.path.join(self.tmp_dir, "audio_16k.flac")
+        with mock.patch("lib.hls.subprocess.run") as run:
+            downloader.download(self.playlist(), output_file, asr_format="flac")
+
+        cmd = run.call_args.args[0]
+        self.assertEqual(cmd.count("-i"), 1)
+        self.assertEqual(
+            cmd[cmd.index(output_file) + 1 :][-7:],
+            ["-ac", "1", "-ar", "16000", "-c:a", "flac", flac_file],
+        )
+        self.assertEqual(asr_file(output_file, "flac"), flac_file)
+
+        self.assertIsNone(find_asr_file(output_file))
+        open(flac_file, "wb").close()
+        self.assertEqual(find_asr_file(output_file), flac_file)
+
+
+class TestLiveTail(HlsServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.id3 = True
+        self.store = SpaceDataStore(self.tmp_dir, fsync_interval=None)
+        self.addCleanup(self.store.close)
+        self.output_file = os.path.join(self.tmp_dir, "audio.aac")
+
+    # a live window of the chunks first to last
+    def window(self, first, last):
+        lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:3", f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+        for i in range(first, last + 1):
+            lines += ["#EXTINF:3.000,", f"chunk_{i}_a.aac"]
+        self.server.playlist = "\n".join(lines)
+
+    def make_tail(self):
+        fetch = lambda: parse_playlist(self.server.playlist, self.base_url)
+        return LiveTail(fetch, self.output_file, self.store)
+
+    def test_strip_id3(self):
+        self.assertEqual(strip_id3(ID3_TAG + b"audio"), b"audio")
+        self.assertEqual(strip_id3(b"audio"), b"audio")
+
+    def test_appends_only_new_segments(self):
+        tail = self.make_tail()
+        tail.resume()
+        self.window(0, 2)
+        self.assertEqual(tail.poll(now=100), 3)
+        self.window(1, 4)
+        self.assertEqual(tail.poll(now=106), 2)
+        self.window(7, 8)
+        self.assertEqual(tail.poll(now=112), 2)
+
+        with open(self.output_file, "rb") as f:
+            expected = [CHUNKS[f"chunk_{i}_a.aac"] for i in (0, 1, 2, 3, 4, 7, 8)]
+            self.assertEqual(f.read(), b"".join(expected))
+        self.assertEqual(HlsHandler.requests["chunk_1_a.aac"], 1)
+
+        segments = list(read_stream(self.tmp_dir, AUDIO_SEGMENTS_STREAM))
+        self.assertEqual([s["sequence"] for s in segments], [0, 1, 2, 3, 4, 7, 8])
+        self.assertEqual(segments[5]["missed"], 2)
+        self.assertEqual(segments[5]["offset"], sum(len(data) for data in expected[:5]))
+        self.assertEqual(segments[5]["audio_start"], 15)
+        # estimated from the live edge: the first window ended at 100
+        self.assertEqual(segments[0]["started_at"], 91)
+        self.assertTrue(segments[0]["estimated"])
+        self.assertEqual(audio_time_at(segments, 92.5), 1.5)
+        self.assertIsNone(audio_time_at(segments, 50))
+
+    def test_program_date_time(self):
+        self.window(0, 0)
+        self.server.playlist = self.server.playlist.replace(
+            "#EXTINF", "#EXT-X-PROGRAM-DATE-TIME:2024-01-01T00:00:10.000Z\n#EXTINF"
+        )
+        tail = self.make_tail()
+        tail.resume()
+        tail.poll(now=0)
+        (segment,) = read_stream(self.tmp_dir, AUDIO_SEGMENTS_STREAM)
+        self.assertEqual(segment["started_at"], 1704067210)
+        self.assertFalse(segment["estimated"])
+
+    def test_resumes_after_the_last_logged_segment(self):
+        tail = self.make_tail()
+        tail.resume()
+        self.window(0, 2)
+        tail.poll(now=100)
+        # a crash in the middle of appending the next segment
+        with open(self.output_file, "ab") as f:
+            f.write(b"torn")
+        HlsHandler.requests.clear()
+
+        tail = self.make_tail()
+        tail.resume()
+        self.assertEqual(tail.last_sequence, 2)
+        self.window(0, 3)
+        self.assertEqual(tail.poll(now=103), 1)
+        self.assertEqual(set(HlsHandler.requests), {"chunk_3_a.aac"})
+        with open(self.output_file, "rb") as f:
+            self.assertEqual(f.read(), b"".join(CHUNKS[f"chunk_{i}_a.aac"] for i in range(4)))
+
+    def test_skips_the_archived_segments(self):
+        tail = LiveTail(
+            lambda: parse_playlist(self.server.playlist, self.base_url),
+            self.output_file,
+            self.store,
+            skip={"chunk_0_a.aac", "chunk_1_a.aac"},
+            audio_start=6,
+        )
+        tail.resume()
+        self.window(0, 3)
+        self.assertEqual(tail.poll(now=100), 2)
+
+        segments = list(read_stream(self.tmp_dir, AUDIO_SEGMENTS_STREAM))
+        self.assertEqual([s["sequence"] for s in segments], [2, 3])
+        # audio times count the archived audio muxed before the tail
+        self.assertEqual([s["audio_start"] for s in segments], [6, 9])
+        self.assertEqual(segments[0]["missed"], 0)
+
+    def test_unlogged_output_is_kept(self):
+        with open(self.output_file, "wb") as f:
+            f.write(b"audio of an earlier tail")
+        tail = self.make_tail()
+        with mock.patch("lib.hls.time.time", return_value=1000):
+            tail.resume()
+
+        self.assertEqual(os.path.getsize(self.output_file), 0)
+        with open(self.output_file + ".1000", "rb") as f:
+            self.assertEqual(f.read(), b"audio of an earlier tail")
+
+    def test_runs_until_the_playlist_ends(self):
+        self.window(0, 1)
+        self.server.playlist += "\n#EXT-X-ENDLIST"
+        tail = self.make_tail()
+        tail.poll_interval = 0
+        tail.run()
+        self.assertTrue(tail.ended)
+        self.assertEqual(tail.appended, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import tempfile
+import unittest
+
+from lib.hls import AUDIO_OFFSET
+from lib.intervals import (
+    INTERVALS_CLOSED_AT,
+    INTERVALS_STREAM,
+    IntervalIndex,
+    SpeakingInterval,
+    frames_to_intervals,
+    load_intervals,
+    timeline_to_intervals,
+)
+from lib.space_data import SpaceDataStore
+from lib.timeline import SpeakerTimeline
+
+FRAMES = {
+    "0": {"timestamp": 0.0, "speakers": [{"username": "alice", "confidence": 0.2}]},
+    "1": {"timestamp": 1.0, "speakers": [{"username": "alice", "confidence": 0.4}]},
+    "2": {
+        "timestamp": 2.0,
+        "speakers": [{"username": "alice", "confidence": 0.4}, {"username": "bob"}],
+    },
+    "3": {"timestamp": 3.0, "speakers": [{"username": "bob", "confidence": 0.5}]},
+    "4": {"timestamp": 4.0, "speakers": []},
+    "5": {"timestamp": 5.0, "speakers": [{"username": "carol", "confidence": 0.3}]},
+}
+
+
+class TestSpeakingIntervals(unittest.TestCase):
+    def test_frames_are_merged(self):
+        self.assertEqual(
+            frames_to_intervals(FRAMES, end=6.5),
+            [
+                SpeakingInterval("alice", 0.0, 3.0, 0.333),
+                SpeakingInterval("bob", 2.0, 4.0, 0.5),
+                # still speaking when the recording stopped
+                SpeakingInterval("carol", 5.0, 6.5, 0.3),
+            ],
+        )
+        # without the stop time the last frame is all there is
+        self.assertEqual(frames_to_intervals(FRAMES)[-1], SpeakingInterval("carol", 5.0, 5.0, 0.3))
+
+    def test_timeline_gives_the_same_intervals(self):
+        timeline = SpeakerTimeline.from_frames(FRAMES)
+        self.assertEqual(
+            timeline_to_intervals(timeline, end=6.5), frames_to_intervals(FRAMES, end=6.5)
+        )
+
+    def test_logged_intervals_need_the_close_marker(self):
+        with tempfile.TemporaryDirectory() as space_dir:
+            store = SpaceDataStore(space_dir, fsync_interval=None)
+            store.reset()
+            store.append_frames(FRAMES)
+            # a crashed run: bob's interval logged, alice's and carol's still open
+            store.append(INTERVALS_STREAM, [SpeakingInterval("bob", 2.0, 4.0, 0.5)._asdict()])
+            store.close()
+            self.assertEqual(len(load_intervals(store.metadata_path)), 3)
+
+            store.update(INTERVALS_CLOSED_AT, 6.5)
+            self.assertEqual(len(load_intervals(store.metadata_path)), 1)
+
+    def test_queries(self):
+        index = IntervalIndex(frames_to_intervals(FRAMES))
+        self.assertEqual([i.username for i in index.overlapping(3.5, 4.5)], ["bob"])
+        self.assertEqual(index.speakers_between(1.0, 3.0), {"alice": 2.0, "bob": 1.0})
+        self.assertEqual(index.sole_speakers_between(0, 10), ["alice", "bob"])
+        self.assertEqual(index.sole_speakers_between(2.0, 3.0), [])
+        self.assertEqual(index.sole_speakers_between(4.0, 4.5), [])
+
+    def test_audio_time_starts_before_the_join(self):
+        with tempfile.TemporaryDirectory() as space_dir:
+            store = SpaceDataStore(space_dir, fsync_interval=None)
+            store.reset()
+            store.append_frames(FRAMES)
+            store.update(INTERVALS_CLOSED_AT, 6.5)
+            store.close()
+            self.assertEqual(
+                load_intervals(store.metadata_path).sole_speakers_between(0, 2), ["alice"]
+            )
+
+            # 30s of replay fetched ahead of the tail: the first 30s of audio are from before
+            # the join, nobody was captured speaking then
+            store.update(AUDIO_OFFSET, 30.0)
+            intervals = load_intervals(store.metadata_path, audio_time=True)
+            self.assertEqual(intervals.sole_speakers_between(0, 30), [])
+            # transcript segments, timed from the start of the audio
+            self.assertEqual(intervals.sole_speakers_between(30, 32), ["alice"])
+            self.assertEqual(intervals.sole_speakers_between(33, 34), ["bob"])
+            self.assertEqual(intervals.sole_speakers_between(35, 36.5), ["carol"])
+            # frame time is kept without audio_time
+            self.assertEqual(load_intervals(store.metadata_path).sole_speakers_between(30, 40), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
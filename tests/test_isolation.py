@@ -0,0 +1,99 @@
+import math
+import tempfile
+import unittest
+
+from lib.intervals import INTERVALS_STREAM
+from lib.isolation import (
+    FRAME_RECORD_SIZE,
+    USERNAME_BYTES,
+    JitterMeter,
+    ProcessIsolation,
+    pack_frame,
+    unpack_frame,
+)
+from lib.ring_buffer import RingBuffer
+from lib.space_data import FRAMES_STREAM, read_stream
+
+
+class TestRingBuffer(unittest.TestCase):
+    def setUp(self):
+        self.ring = RingBuffer.create(slots=2, record_size=8)
+        self.addCleanup(self.ring.close)
+
+    def test_records_come_out_in_order_across_attachments(self):
+        other = RingBuffer.attach(self.ring.name)
+        self.addCleanup(other.close)
+        for record in (b"a", b"bb", b"ccc"):
+            self.assertTrue(self.ring.put(record))
+            self.assertEqual(other.get(), record)
+        self.assertIsNone(other.get())
+
+    def test_full_ring_drops_records(self):
+        self.assertTrue(self.ring.put(b"1"))
+        self.assertTrue(self.ring.put(b"2"))
+        self.assertFalse(self.ring.put(b"3"))
+        self.assertEqual(self.ring.dropped, 1)
+        self.assertEqual(self.ring.drain(), [b"1", b"2"])
+        self.assertEqual(len(self.ring), 0)
+
+    def test_oversized_records_are_refused(self):
+        with self.assertRaises(ValueError):
+            self.ring.put(b"123456789")
+
+
+class TestFrameRecords(unittest.TestCase):
+    def test_round_trip(self):
+        frame = {
+            "timestamp": 12.345,
+            "speakers": [
+                {"username": "alice", "confidence": 0.5},
+                {"username": "bob", "confidence": None},
+            ],
+        }
+        record = pack_frame(7, frame)
+        self.assertEqual(len(record), FRAME_RECORD_SIZE)
+        self.assertEqual(unpack_frame(record), (7, frame))
+
+    def test_long_usernames_are_cut_on_a_character(self):
+        frame = {"timestamp": 1.0, "speakers": [{"username": "é" * USERNAME_BYTES}]}
+        _, unpacked = unpack_frame(pack_frame(0, frame))
+        self.assertEqual(unpacked["speakers"][0]["username"], "é" * (USERNAME_BYTES // 2))
+
+
+class TestJitterMeter(unittest.TestCase):
+    def test_deviation_from_the_interval(self):
+        jitter = JitterMeter()
+        for now in (0, 1.0, 2.5, 3.5):
+            jitter.tick(1, now=now)
+        stats = jitter.stats()
+        self.assertEqual(stats["ticks"], 4)
+        self.assertEqual(stats["max_ms"], 500)
+        self.assertTrue(math.isclose(stats["mean_ms"], 166.7))
+
+
+class TestProcessIsolation(unittest.TestCase):
+    def test_persistence_process_writes_the_frames(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            isolation = ProcessIsolation(output_dir, fsync_interval=None)
+            isolation.start_persistence()
+            for number in range(3):
+                speakers = [{"username": "alice", "confidence": 0.5}] if number < 2 else []
+                isolation.push_frame(number, {"timestamp": number, "speakers": speakers})
+            isolation.push_frame(3, {"timestamp": 3, "speakers": [{"username": "bob"}]})
+            reports = isolation.stop(stopped_at=4.5)
+
+            frames = list(read_stream(output_dir, FRAMES_STREAM))
+            self.assertEqual([frame["frame"] for frame in frames], [0, 1, 2, 3])
+            self.assertEqual(reports["persistence"]["frames"], 4)
+            self.assertEqual(reports["persistence"]["ring_dropped"], 0)
+            self.assertEqual(reports["persistence"]["intervals_closed_at"], 4.5)
+            intervals = list(read_stream(output_dir, INTERVALS_STREAM))
+            # bob was still speaking when the recording stopped
+            self.assertEqual(
+                [(i["username"], i["start"], i["end"]) for i in intervals],
+                [("alice", 0, 2), ("bob", 3, 4.5)],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
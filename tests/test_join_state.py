@@ -0,0 +1,139 @@
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from lib.bot import (
+    JOIN_ENDED,
+    JOIN_ERROR,
+    JOIN_LOGIN_WALL,
+    JOIN_START_LISTENING,
+    XSpaceBot,
+)
+from lib.page_scripts import JOIN_STATE_JS
+from lib.space_data import SpaceDataStore
+
+HAS_NODE = shutil.which("node") is not None
+
+# runs JOIN_STATE_JS against a page of spans, each {"textContent": str, "shown": bool}
+PAGE_JS = """
+const spans = %s;
+const login = %s;
+const element = (spec) => ({
+    ...spec,
+    getBoundingClientRect: () => (spec.shown ? {width: 80, height: 20} : {width: 0, height: 0}),
+});
+const document = {
+    getElementsByTagName: () => spans.map(element),
+    querySelector: () => (login ? element(login) : null),
+};
+const found = (function () {
+%s
+})();
+console.log(JSON.stringify(found && {state: found.state, text: found.element.textContent}));
+"""
+
+
+def join_state(spans, login=None):
+    script = PAGE_JS % (json.dumps(spans), json.dumps(login), JOIN_STATE_JS)
+    output = subprocess.run(["node", "-e", script], capture_output=True, check=True, text=True)
+    return json.loads(output.stdout)
+
+
+def span(text, shown=True):
+    return {"textContent": text, "shown": shown}
+
+
+@unittest.skipUnless(HAS_NODE, "node not installed")
+class TestJoinStateScript(unittest.TestCase):
+    def test_each_state(self):
+        self.assertIsNone(join_state([span("Loading")]))
+        self.assertEqual(join_state([span("Play recording")])["state"], JOIN_ENDED)
+        self.assertEqual(join_state([span("Start listening")])["state"], JOIN_START_LISTENING)
+        login = span("Log in")
+        self.assertEqual(join_state([], login=login)["state"], JOIN_LOGIN_WALL)
+        self.assertEqual(join_state([span("Something went wrong")])["state"], JOIN_ERROR)
+
+    def test_hidden_elements_are_ignored(self):
+        self.assertIsNone(join_state([span("Start listening", shown=False)]))
+        self.assertIsNone(join_state([span("Something went wrong", shown=False)]))
+        self.assertIsNone(join_state([], login=span("Log in", shown=False)))
+
+    def test_join_wins_over_an_error(self):
+        spans = [span("This space doesn't exist"), span("Start listening")]
+        self.assertEqual(
+            join_state(spans), {"state": JOIN_START_LISTENING, "text": "Start listening"}
+        )
+        spans = [span("Something went wrong"), span("Play recording")]
+        self.assertEqual(join_state(spans)["state"], JOIN_ENDED)
+
+
+class FakeDriver:
+    def __init__(self, *states):
+        self.states = list(states)
+
+    def execute_script(self, script):
+        return self.states.pop(0) if len(self.states) > 1 else self.states[0]
+
+
+class TestPollJoin(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def make_bot(self, driver):
+        # the constructor looks the space up online, poll_join only needs the page and the store
+        bot = XSpaceBot.__new__(XSpaceBot)
+        bot.driver = driver
+        bot.stop_event = threading.Event()
+        bot.store = SpaceDataStore(self.tmp.name)
+        bot.joined_space_at = None
+        bot.join_started_at = time.time()
+        bot.join_latency = {}
+        return bot
+
+    def test_clicks_the_join_button(self):
+        button = mock.Mock()
+        driver = FakeDriver(None, None, {"state": JOIN_START_LISTENING, "element": button})
+        bot = self.make_bot(driver)
+
+        self.assertEqual(bot.poll_join(timeout=5), "joined")
+        button.click.assert_called_once()
+        self.assertIsNotNone(bot.joined_space_at)
+        self.assertEqual(set(bot.join_latency), {JOIN_START_LISTENING, "joined"})
+
+    def test_other_states_are_returned(self):
+        for state in (JOIN_ENDED, JOIN_LOGIN_WALL, JOIN_ERROR):
+            bot = self.make_bot(FakeDriver({"state": state, "element": None}))
+            self.assertEqual(bot.poll_join(timeout=5), state)
+            self.assertIsNone(bot.joined_space_at)
+            self.assertEqual(list(bot.join_latency), [state])
+
+    def test_nothing_shown(self):
+        bot = self.make_bot(FakeDriver(None))
+        self.assertIsNone(bot.poll_join())
+        self.assertIsNone(bot.poll_join(timeout=0.3))
+        self.assertEqual(bot.join_latency, {})
+
+    def test_stop_ends_the_wait(self):
+        bot = self.make_bot(FakeDriver(None))
+        bot.stop_event.set()
+        started_at = time.time()
+        self.assertIsNone(bot.poll_join(timeout=5))
+        self.assertLess(time.time() - started_at, 1)
+
+    def test_rejoin_keeps_the_join_latency(self):
+        button = mock.Mock()
+        bot = self.make_bot(FakeDriver({"state": JOIN_START_LISTENING, "element": button}))
+        self.assertEqual(bot.poll_join(rejoin=True), "joined")
+        button.click.assert_called_once()
+        self.assertIsNone(bot.joined_space_at)
+        self.assertEqual(bot.join_latency, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
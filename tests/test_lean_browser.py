@@ -0,0 +1,96 @@
+import json
+import unittest
+
+from lib.lean_browser import (
+    AVATAR_URLS,
+    NetworkTransfer,
+    blocked_url_patterns,
+    measure_page,
+    page_setup_commands,
+    page_usage,
+)
+
+
+class FakeDriver:
+    """A chrome logging its network events, in two windows"""
+
+    current_window_handle = "A1"
+
+    def __init__(self, events):
+        self.log = [
+            {"message": json.dumps({"message": {"method": method, "params": params}, "webview": w})}
+            for w, method, params in events
+        ]
+
+    def get_log(self, kind):
+        log, self.log = self.log, []
+        return log
+
+    def execute_cdp_cmd(self, method, params):
+        return {"metrics": [{"name": "Nodes", "value": 10}]}
+
+
+class TestPageSetup(unittest.TestCase):
+    def test_usage_is_measured_without_lean(self):
+        methods = [method for method, _ in page_setup_commands(lean=False)]
+        self.assertEqual(methods, ["Performance.enable", "Network.enable"])
+
+    def test_avatars_are_only_kept_for_screenshots(self):
+        def blocked(keep_avatars):
+            commands = dict(page_setup_commands(lean=True, keep_avatars=keep_avatars))
+            return commands["Network.setBlockedURLs"]["urls"]
+
+        self.assertIn("*.m3u8*", blocked(True))
+        self.assertNotIn(AVATAR_URLS[0], blocked(True))
+        self.assertIn(AVATAR_URLS[0], blocked(False))
+
+    def test_only_the_periscope_media_hosts_are_blocked(self):
+        pscp = [pattern for pattern in blocked_url_patterns() if "pscp.tv" in pattern]
+        self.assertEqual(pscp, ["*.video.pscp.tv/*"])
+
+
+class TestPageUsage(unittest.TestCase):
+    def test_metrics_and_transfer_are_merged(self):
+        metrics = [
+            {"name": "TaskDuration", "value": 1.5},
+            {"name": "Frames", "value": 12},
+            {"name": "JSHeapUsedSize", "value": 2048},
+        ]
+        transfer = {"transfer_bytes": 100, "encoded_bytes": 80, "requests": 2}
+        self.assertEqual(
+            page_usage(metrics, transfer),
+            {
+                "TaskDuration": 1.5,
+                "JSHeapUsedSize": 2048,
+                "transfer_bytes": 100,
+                "encoded_bytes": 80,
+                "requests": 2,
+            },
+        )
+        self.assertEqual(page_usage(metrics, None), {"TaskDuration": 1.5, "JSHeapUsedSize": 2048})
+
+
+class TestNetworkTransfer(unittest.TestCase):
+    def test_bytes_by_window(self):
+        driver = FakeDriver(
+            [
+                ("A1", "Network.loadingFinished", {"encodedDataLength": 1200}),
+                # cross origin, counted all the same
+                ("A1", "Network.loadingFinished", {"encodedDataLength": 300}),
+                ("A1", "Network.responseReceived", {}),
+                ("B2", "Network.loadingFinished", {"encodedDataLength": 50}),
+            ]
+        )
+        transfer = NetworkTransfer()
+        transfer.read_log(driver)
+        self.assertEqual(transfer.totals("A1"), {"transfer_bytes": 1500, "requests": 2})
+        self.assertEqual(transfer.totals("B2"), {"transfer_bytes": 50, "requests": 1})
+        self.assertIsNone(transfer.totals("C3"))
+
+    def test_measure_page_reads_the_log_first(self):
+        driver = FakeDriver([("A1", "Network.loadingFinished", {"encodedDataLength": 10})])
+        self.assertEqual(measure_page(driver), {"Nodes": 10, "transfer_bytes": 10, "requests": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from lib.memory_watchdog import MemoryWatchdog
+from lib.page_scripts import SPEAKER_SAMPLER_DRAIN_JS
+from lib.scheduler import DriverScheduler
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def new_window(self, kind):
+        handle = f"window-{len(self.driver.windows)}"
+        self.driver.windows.append(handle)
+        self.driver.current_window_handle = handle
+
+    def window(self, handle):
+        if handle not in self.driver.windows:
+            raise RuntimeError(f"no such window: {handle}")
+        self.driver.current_window_handle = handle
+
+
+class FakeDriver:
+    def __init__(self):
+        self.current_window_handle = "main"
+        self.windows = ["main"]
+        self.switch_to = FakeSwitchTo(self)
+        # the chrome processes are measured under this process
+        self.service = SimpleNamespace(process=SimpleNamespace(pid=os.getpid()))
+        self.navigated = {}
+        self.drained = {}
+
+    def get_window_size(self):
+        return {"width": 375, "height": 2000}
+
+    def set_window_size(self, width, height):
+        pass
+
+    def execute_cdp_cmd(self, method, params):
+        if method == "Page.navigate":
+            self.navigated[self.current_window_handle] = params["url"]
+        return {}
+
+    def execute_script(self, script, *args):
+        if script == SPEAKER_SAMPLER_DRAIN_JS:
+            self.drained[self.current_window_handle] = True
+            events = [{"t": 10_000, "username": "alice", "speaking": True, "score": 0.5}]
+            return {"events": events, "dropped": 0, "roster": {}}
+        # the participants rect
+        return {"x": 0, "y": 0, "width": 375, "height": 500}
+
+    def close(self):
+        self.windows.remove(self.current_window_handle)
+
+
+class FakeBot:
+    def __init__(self, join_state="joined"):
+        self.driver = FakeDriver()
+        self.space_id = "space"
+        self.space_url = "https://x.com/i/spaces/space"
+        self.stop_event = threading.Event()
+        self.scheduler = DriverScheduler()
+        self.store = mock.Mock()
+        self.lean_browser = False
+        self.frame_pipeline = None
+        self.frame_batch_buffer = {}
+        self.joined_space_at = 0
+        self.sampler_installed = False
+        self.sampler_hz = 1000
+        self.sampler_speaking = {"bob": 0.4}
+        self.frames = []
+        self.join_state = join_state
+        self.join_windows = []
+
+    def poll_join(self, timeout=None, rejoin=False):
+        assert rejoin
+        self.join_windows.append(self.driver.current_window_handle)
+        return self.join_state
+
+    def _install_speaker_sampler(self, hz):
+        pass
+
+    def _drain_speaker_sampler(self):
+        return []
+
+    def _frames_from_sampler_drain(self, drained):
+        for event in drained["events"]:
+            self.sampler_speaking[event["username"]] = event["score"]
+
+    def buffer_frames(self, frames):
+        self.frames += frames
+
+
+@mock.patch("lib.memory_watchdog.RECYCLE_SETTLE_SECONDS", 0)
+class TestWindowRecycle(unittest.TestCase):
+    def make_watchdog(self, bot):
+        bot.scheduler.start()
+        self.addCleanup(bot.scheduler.stop)
+        return MemoryWatchdog(bot)
+
+    def test_fresh_window_takes_over(self):
+        bot = FakeBot()
+        watchdog = self.make_watchdog(bot)
+
+        self.assertTrue(watchdog.recycle_window())
+        self.assertEqual(bot.driver.windows, ["window-1"])
+        self.assertEqual(bot.driver.current_window_handle, "window-1")
+        self.assertEqual(bot.driver.navigated, {"window-1": bot.space_url})
+        self.assertEqual(bot.join_windows, ["window-1"])
+        bot.store.update.assert_called_once_with("window_recycles", watchdog.recycles)
+
+    def test_sampler_state_is_carried_over(self):
+        bot = FakeBot()
+        bot.sampler_installed = True
+        watchdog = self.make_watchdog(bot)
+
+        self.assertTrue(watchdog.recycle_window())
+        # the old speakers are replaced by the fresh sampler's, in a single frame
+        self.assertEqual(bot.driver.drained, {"window-1": True})
+        self.assertEqual(len(bot.frames), 1)
+        self.assertEqual(bot.frames[0]["speakers"], [{"username": "alice", "confidence": 0.5}])
+
+    def test_old_window_stays_when_the_space_ended(self):
+        bot = FakeBot(join_state="ended")
+        watchdog = self.make_watchdog(bot)
+
+        self.assertFalse(watchdog.recycle_window())
+        self.assertEqual(bot.driver.windows, ["main"])
+        self.assertEqual(bot.driver.current_window_handle, "main")
+        bot.store.update.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from unittest import mock
+
+from lib.roster import RosterCache
+
+
+class TestRosterCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = RosterCache()
+        self.assertIsNone(cache.get("element-1"))
+        cache.put("element-1", "alice")
+        cache.put("element-2", "bob")
+        self.assertEqual(cache.get("element-1"), "alice")
+        self.assertEqual(cache.get("element-2"), "bob")
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 1, "invalidations": 0})
+
+    def test_invalidate(self):
+        cache = RosterCache()
+        cache.put("element-1", "alice")
+        cache.invalidate()
+        self.assertIsNone(cache.get("element-1"))
+        self.assertEqual(cache.stats(), {"hits": 0, "misses": 1, "invalidations": 1})
+
+    @mock.patch("lib.roster.time.time")
+    def test_entries_expire_after_the_refresh_interval(self, now):
+        now.return_value = 100.0
+        cache = RosterCache(refresh_interval=60)
+        cache.put("element-1", "alice")
+
+        now.return_value = 160.0
+        self.assertEqual(cache.get("element-1"), "alice")
+        now.return_value = 160.5
+        self.assertIsNone(cache.get("element-1"))
+
+        # the refresh interval starts over from the rebuild
+        cache.put("element-1", "alice")
+        now.return_value = 220.0
+        self.assertEqual(cache.get("element-1"), "alice")
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 1, "invalidations": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import threading
+import time
+import unittest
+
+from lib.scheduler import (
+    PRIORITY_HOUSEKEEPING,
+    PRIORITY_SCREENSHOTS,
+    PRIORITY_SPEAKERS,
+    CommandExpired,
+    DriverScheduler,
+)
+
+
+class TestDriverScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = DriverScheduler()
+        self.scheduler.start()
+        # holds the scheduler thread so commands queue up behind it
+        self.release = threading.Event()
+        self.scheduler.submit(self.release.wait, PRIORITY_SPEAKERS, "blocker")
+
+    def tearDown(self):
+        self.release.set()
+        self.scheduler.stop()
+
+    def test_commands_run_in_priority_order(self):
+        ran = []
+        futures = [
+            self.scheduler.submit(lambda: ran.append("housekeeping"), PRIORITY_HOUSEKEEPING, "h"),
+            self.scheduler.submit(lambda: ran.append("screenshots"), PRIORITY_SCREENSHOTS, "s"),
+            self.scheduler.submit(lambda: ran.append("speakers"), PRIORITY_SPEAKERS, "p"),
+        ]
+        self.release.set()
+        for future in futures:
+            future.result(timeout=1)
+
+        self.assertEqual(ran, ["speakers", "screenshots", "housekeeping"])
+
+    def test_queued_ticks_are_coalesced(self):
+        ran = []
+        first = self.scheduler.submit(
+            lambda: ran.append(1), PRIORITY_SPEAKERS, "speakers", coalesce_key="speakers"
+        )
+        second = self.scheduler.submit(
+            lambda: ran.append(2), PRIORITY_SPEAKERS, "speakers", coalesce_key="speakers"
+        )
+        self.release.set()
+
+        self.assertIs(first, second)
+        first.result(timeout=1)
+        self.assertEqual(ran, [1])
+        self.assertEqual(self.scheduler.stats()["speakers"]["coalesced"], 1)
+
+    def test_stale_commands_expire(self):
+        ran = []
+        future = self.scheduler.submit(
+            lambda: ran.append(1), PRIORITY_SCREENSHOTS, "screenshots", deadline=0.01
+        )
+        time.sleep(0.05)
+        self.release.set()
+
+        with self.assertRaises(CommandExpired):
+            future.result(timeout=1)
+        self.assertEqual(ran, [])
+        stats = self.scheduler.stats()["screenshots"]
+        self.assertEqual((stats["run"], stats["expired"]), (0, 1))
+
+    def test_delays_and_failures_are_measured(self):
+        def fail():
+            raise ValueError("stale element")
+
+        future = self.scheduler.submit(fail, PRIORITY_HOUSEKEEPING, "housekeeping")
+        time.sleep(0.05)
+        self.release.set()
+
+        with self.assertRaises(ValueError):
+            future.result(timeout=1)
+        stats = self.scheduler.stats()["housekeeping"]
+        self.assertEqual((stats["run"], stats["failed"]), (1, 1))
+        self.assertGreaterEqual(stats["avg_queue_ms"], 40)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+
+from lib.space_data import (
+    FRAMES_STREAM,
+    SpaceDataStore,
+    count_space_frames,
+    load_space_data,
+    stream_path,
+)
+
+
+class TestSpaceDataStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.space_dir = self.tmp.name
+        self.store = SpaceDataStore(self.space_dir, fsync_interval=0)
+        self.store.reset()
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_frames_round_trip(self):
+        self.store.write_metadata({"id": "space", "title": "title"})
+        self.store.update("joined_at", 100.5)
+        self.store.append_frames({"0": {"timestamp": 0.0, "speakers": []}})
+        self.store.append_frames(
+            {"1": {"timestamp": 1.0, "speakers": [{"username": "alice", "confidence": 0.3}]}}
+        )
+
+        space_data = load_space_data(self.store.metadata_path)
+        self.assertEqual(space_data["title"], "title")
+        self.assertEqual(space_data["joined_at"], 100.5)
+        self.assertEqual(
+            space_data["frames"],
+            {
+                "0": {"timestamp": 0.0, "speakers": []},
+                "1": {"timestamp": 1.0, "speakers": [{"username": "alice", "confidence": 0.3}]},
+            },
+        )
+        self.assertEqual(count_space_frames(self.store.metadata_path, space_data), 2)
+
+    def test_torn_last_line_is_skipped(self):
+        self.store.append_frames({"0": {"timestamp": 0.0, "speakers": []}})
+        self.store.close()
+        with open(stream_path(self.space_dir, FRAMES_STREAM), "a") as f:
+            f.write('{"frame": 1, "timest')
+
+        space_data = load_space_data(self.store.metadata_path)
+        self.assertEqual(list(space_data["frames"]), ["0"])
+
+    def test_legacy_layout(self):
+        legacy = {"title": "legacy", "frames": {"0": {"timestamp": 0, "speakers": []}}}
+        with open(self.store.metadata_path, "w") as f:
+            json.dump(legacy, f)
+
+        space_data = load_space_data(self.store.metadata_path)
+        self.assertEqual(space_data, legacy)
+        metadata = load_space_data(self.store.metadata_path, frames=False)
+        self.assertEqual(count_space_frames(self.store.metadata_path, metadata), 1)
+
+    def test_reset_truncates_only_the_given_streams(self):
+        self.store.append_frames({"0": {"timestamp": 0.0, "speakers": []}})
+        self.store.append("audio_segments", [{"sequence": 0}])
+        self.store.reset()
+
+        self.assertFalse(os.path.exists(stream_path(self.space_dir, FRAMES_STREAM)))
+        self.assertTrue(os.path.exists(stream_path(self.space_dir, "audio_segments")))
+        self.store.reset([FRAMES_STREAM, "audio_segments"])
+        self.assertFalse(os.path.exists(stream_path(self.space_dir, "audio_segments")))
+
+    def test_missing_space_data(self):
+        self.assertIsNone(load_space_data(os.path.join(self.space_dir, "missing.json")))
+
+
+if __name__ == "__main__":
+    unittest.main()
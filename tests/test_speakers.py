@@ -0,0 +1,303 @@
+import json
+import shutil
+import subprocess
+import unittest
+from unittest import mock
+
+from selenium.webdriver.common.by import By
+
+from lib.bot import SPEAKING_SCORE_THRESHOLD, XSpaceBot, score_above_threshold
+from lib.page_scripts import CANVAS_SCORE_JS, ROSTER_VERSION_JS, SPEAKER_SAMPLER_DRAIN_JS
+from lib.roster import RosterCache
+
+HAS_NODE = shutil.which("node") is not None
+
+# scores fake canvases with CANVAS_SCORE_JS, each {"width": int, "height": int, "opaque": int,
+# "context": "2d" | "webgl" | "tainted"}, the first opaque pixels fully covered
+CANVASES_JS = """
+const specs = %s;
+const pixels = (spec) => {
+    const data = new Uint8ClampedArray(spec.width * spec.height * 4);
+    for (let i = 0; i < spec.opaque; i++) {
+        data[i * 4 + 3] = 255;
+    }
+    return data;
+};
+const context2d = (source) => ({
+    source: source,
+    drawImage(canvas) {
+        this.source = canvas.spec;
+    },
+    getImageData() {
+        if (this.source.context === "tainted") {
+            throw new Error("SecurityError: the canvas has been tainted");
+        }
+        return {data: pixels(this.source)};
+    },
+});
+const canvas = (spec) => ({
+    spec: spec,
+    width: spec.width,
+    height: spec.height,
+    getContext: (type) => (spec.context === "webgl" ? null : context2d(spec)),
+});
+const document = {
+    createElement: () => {
+        const scratch = {width: 0, height: 0};
+        scratch.getContext = () => context2d(null);
+        return scratch;
+    },
+};
+// the script body reads the canvas from arguments[0], as execute_script passes it
+const canvasScoreOf = (arg) => (function () {
+%s
+})(arg);
+console.log(JSON.stringify(specs.map((spec) => canvasScoreOf(canvas(spec)))));
+"""
+
+
+def canvas_scores(*specs):
+    script = CANVASES_JS % (json.dumps(specs), CANVAS_SCORE_JS)
+    output = subprocess.run(["node", "-e", script], capture_output=True, check=True, text=True)
+    return json.loads(output.stdout)
+
+
+def ring(opaque, context="2d"):
+    # a 40x25 speaker canvas
+    return {"width": 40, "height": 25, "opaque": opaque, "context": context}
+
+
+class FakeElement:
+    def __init__(self, element_id, username, score, driver):
+        self.id = element_id
+        self.username = username
+        self.score = score
+        self.driver = driver
+
+    def find_element(self, by, value):
+        if by == By.TAG_NAME:
+            return self
+        self.driver.username_lookups += 1
+        return type("Username", (), {"text": f" {self.username} "})()
+
+
+class FakeDriver:
+    """A page of participant elements, their canvas is the element itself"""
+
+    def __init__(self, participants):
+        self.username_lookups = 0
+        # the page load and the count of changes to the participant rows
+        self.roster_version = [1.0, 0]
+        self.elements = [
+            FakeElement(f"element-{i}", username, score, self)
+            for i, (username, score) in enumerate(participants)
+        ]
+
+    def find_elements(self, by, value):
+        return self.elements
+
+    def execute_script(self, script, *args):
+        if script == ROSTER_VERSION_JS:
+            return self.roster_version
+        return args[0].score
+
+
+class FakeSamplerDriver:
+    """A page whose sampler drains are canned, None for a sampler lost to a reload"""
+
+    def __init__(self, *drains):
+        self.drains = list(drains)
+        self.installs = 0
+
+    def execute_script(self, script, *args):
+        if script == SPEAKER_SAMPLER_DRAIN_JS:
+            return self.drains.pop(0)
+        self.installs += 1
+
+
+def drain(*events, dropped=0, unreadable=()):
+    return {
+        "events": [
+            {"t": t, "username": username, "speaking": score is not None, "score": score}
+            for t, username, score in events
+        ],
+        "dropped": dropped,
+        "unreadable": list(unreadable),
+        "roster": {"hits": 0, "misses": 0, "invalidations": 0},
+    }
+
+
+def make_bot(driver=None):
+    # the constructor looks the space up online, the speaker capture only needs the page
+    bot = XSpaceBot.__new__(XSpaceBot)
+    bot.driver = driver
+    bot.speaking_threshold = SPEAKING_SCORE_THRESHOLD
+    bot.roster_cache = RosterCache()
+    bot.page_roster_stats = None
+    bot.roster_version = None
+    bot.unreadable_canvases = set()
+    bot.webdriver_calls = 0
+    bot.joined_space_at = 1000.0
+    bot.sampler_hz = 15
+    bot.sampler_installed = False
+    bot.sampler_speaking = {}
+    return bot
+
+
+class TestSpeakerSnapshot(unittest.TestCase):
+    SNAPSHOT = {
+        "participants": [
+            {"username": "alice", "score": 0.19912},
+            {"username": "bob", "score": 0.067},
+            # a canvas whose pixels can't be read
+            {"username": "carol", "score": None},
+            # no canvas at all
+            {"username": "dave", "score": 0},
+        ],
+        "roster": {"hits": 3, "misses": 1, "invalidations": 0},
+    }
+
+    def test_speakers_of_a_snapshot(self):
+        bot = make_bot()
+        with self.assertLogs("lib.bot", "WARNING") as logs:
+            speakers = bot._speakers_from_snapshot(self.SNAPSHOT)
+            # warned about once per user
+            bot._speakers_from_snapshot(self.SNAPSHOT)
+
+        self.assertEqual(speakers, [{"username": "alice", "confidence": 0.199}])
+        self.assertEqual(bot.page_roster_stats, {"hits": 3, "misses": 1, "invalidations": 0})
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("can't read the speaker canvas of carol", logs.output[0])
+
+    def test_threshold_from_the_opts(self):
+        bot = make_bot()
+        bot.speaking_threshold = 0.05
+        usernames = [s["username"] for s in bot._speakers_from_snapshot(self.SNAPSHOT)]
+        self.assertEqual(usernames, ["alice", "bob"])
+
+    def test_snapshot_script_returned_nothing(self):
+        with self.assertRaises(RuntimeError):
+            make_bot()._speakers_from_snapshot(None)
+
+
+@unittest.skipUnless(HAS_NODE, "node not installed")
+class TestCanvasScore(unittest.TestCase):
+    def test_reference_canvases(self):
+        # the muted and the speaking reference rings: 67 and 199 of 1000 pixels covered
+        muted, speaking, blank = canvas_scores(ring(67), ring(199), ring(0))
+        self.assertAlmostEqual(muted, 0.067)
+        self.assertAlmostEqual(speaking, 0.199)
+        self.assertEqual(blank, 0)
+        self.assertFalse(score_above_threshold(muted))
+        self.assertTrue(score_above_threshold(speaking))
+        self.assertFalse(score_above_threshold(blank))
+
+    def test_webgl_and_unreadable_canvases(self):
+        webgl, tainted, empty = canvas_scores(
+            ring(199, context="webgl"), ring(199, context="tainted"), ring(0) | {"width": 0}
+        )
+        # a webgl canvas is copied onto a 2d one and scored the same
+        self.assertAlmostEqual(webgl, 0.199)
+        self.assertIsNone(tainted)
+        self.assertEqual(empty, 0)
+        self.assertFalse(score_above_threshold(tainted))
+        self.assertFalse(score_above_threshold(None, threshold=0))
+
+
+class TestSpeakersByElement(unittest.TestCase):
+    def test_speakers_and_unreadable_canvases(self):
+        driver = FakeDriver([("alice", 0.199), ("bob", 0.067), ("carol", None)])
+        bot = make_bot(driver)
+        with self.assertLogs("lib.bot", "WARNING") as logs:
+            speakers = bot._find_speakers_by_element()
+            bot._find_speakers_by_element()
+
+        self.assertEqual(speakers, [{"username": "alice", "confidence": 0.199}])
+        # named by their username, not the element id
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("can't read the speaker canvas of carol", logs.output[0])
+        # the usernames were only looked up on the first tick
+        self.assertEqual(driver.username_lookups, 2)
+
+    def test_usernames_are_looked_up_again_when_the_rows_change(self):
+        driver = FakeDriver([("alice", 0.199), ("bob", 0.3)])
+        bot = make_bot(driver)
+        bot._find_speakers_by_element()
+
+        # the row of alice is re-rendered for dave, keeping its element
+        driver.elements[0].username = "dave"
+        driver.roster_version = [1.0, 1]
+        speakers = bot._find_speakers_by_element()
+        self.assertEqual([s["username"] for s in speakers], ["dave", "bob"])
+        self.assertEqual(driver.username_lookups, 4)
+        self.assertEqual(bot.roster_cache.stats()["invalidations"], 1)
+
+        # a reload starts the count over on a new page
+        driver.roster_version = [2.0, 1]
+        bot._find_speakers_by_element()
+        self.assertEqual(bot.roster_cache.stats()["invalidations"], 2)
+
+
+class TestSpeakerSampler(unittest.TestCase):
+    def test_frames_from_drained_events(self):
+        driver = FakeSamplerDriver(
+            drain(
+                (1001000, "alice", 0.2),
+                # sampled at the same moment, one frame
+                (1001000, "bob", 0.31234),
+                (1002500, "alice", None),
+            ),
+            drain((1003000, "carol", 0.4)),
+            drain(),
+        )
+        bot = make_bot(driver)
+        # the first tick installs the sampler
+        self.assertEqual(bot._drain_speaker_sampler(), [])
+        self.assertEqual(driver.installs, 1)
+
+        alice = {"username": "alice", "confidence": 0.2}
+        bob = {"username": "bob", "confidence": 0.312}
+        carol = {"username": "carol", "confidence": 0.4}
+        self.assertEqual(
+            bot._drain_speaker_sampler(),
+            [
+                {"timestamp": 1.0, "speakers": [alice, bob]},
+                {"timestamp": 2.5, "speakers": [bob]},
+            ],
+        )
+        # whoever is still speaking carries over to the next drain
+        self.assertEqual(
+            bot._drain_speaker_sampler(), [{"timestamp": 3.0, "speakers": [bob, carol]}]
+        )
+        self.assertEqual(bot._drain_speaker_sampler(), [])
+        self.assertEqual(driver.installs, 1)
+
+    def test_dropped_events_and_unreadable_canvases(self):
+        bot = make_bot()
+        with self.assertLogs("lib.bot", "WARNING") as logs:
+            frames = bot._frames_from_sampler_drain(
+                drain((1001000, "alice", 0.2), dropped=12, unreadable=["carol"])
+            )
+        self.assertEqual(len(frames), 1)
+        self.assertIn("speaker sampler dropped 12 events", logs.output[0])
+        self.assertIn("can't read the speaker canvas of carol", logs.output[1])
+
+    @mock.patch("lib.bot.time.time", return_value=1010.0)
+    def test_sampler_lost_to_a_reload_is_reinstalled(self, now):
+        driver = FakeSamplerDriver(drain((1001000, "alice", 0.2)), None, None, drain())
+        bot = make_bot(driver)
+        bot.sampler_installed = True
+        bot._drain_speaker_sampler()
+
+        with self.assertLogs("lib.bot", "WARNING"):
+            # the fresh sampler knows nothing of alice speaking, alice is closed with an empty frame
+            self.assertEqual(bot._drain_speaker_sampler(), [{"timestamp": 10.0, "speakers": []}])
+            # nobody left to close
+            self.assertEqual(bot._drain_speaker_sampler(), [])
+        self.assertEqual(driver.installs, 2)
+        self.assertEqual(bot.sampler_speaking, {})
+        self.assertEqual(bot._drain_speaker_sampler(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
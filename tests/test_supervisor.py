@@ -0,0 +1,179 @@
+import time
+import unittest
+
+from lib.supervisor import (
+    DEFAULT_LIMITS,
+    SPACE_FAILED,
+    SPACE_RECORDING,
+    SPACE_STOPPED,
+    SharedBrowser,
+    SpaceSupervisor,
+    SupervisedSpace,
+)
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def new_window(self, kind):
+        handle = f"window-{len(self.driver.opened)}"
+        self.driver.opened.append(handle)
+        self.driver.windows.append(handle)
+        self.driver.current_window_handle = handle
+
+    def window(self, handle):
+        if handle not in self.driver.windows:
+            raise RuntimeError(f"no such window: {handle}")
+        self.driver.current_window_handle = handle
+
+
+class FakeDriver:
+    def __init__(self):
+        self.current_window_handle = "home"
+        self.windows = ["home"]
+        self.opened = []
+        self.switch_to = FakeSwitchTo(self)
+
+    def set_window_size(self, width, height):
+        pass
+
+    def get(self, url):
+        pass
+
+    def close(self):
+        self.windows.remove(self.current_window_handle)
+
+    def quit(self):
+        pass
+
+
+class FakeStore:
+    def __init__(self):
+        self.metadata = {}
+
+    def update(self, key, value):
+        self.metadata[key] = value
+
+
+class FakeBot:
+    def __init__(self, driver, space_id, fail=False):
+        self.driver = driver
+        self.space_id = space_id
+        self.space_url = f"https://x.com/i/spaces/{space_id}"
+        self.frame_batch_buffer = {}
+        self.store = FakeStore()
+        self.fail = fail
+        self.ticks = 0
+        self.windows = set()
+        self.stopped = False
+        self.adaptive_rate = None
+        self.tick_interval = 0.02
+
+    def mark_join_latency(self, milestone):
+        pass
+
+    def prepare_window(self, keep_avatars=True):
+        pass
+
+    def measure_page_usage(self):
+        pass
+
+    def poll_join(self):
+        return "joined"
+
+    def start_supervised_threads(self, fetch_audio=True):
+        pass
+
+    def capture_speaker_tick(self):
+        if self.fail:
+            raise RuntimeError("page crashed")
+        self.windows.add(self.driver.current_window_handle)
+        self.ticks += 1
+        return 1
+
+    def dismiss_got_it(self):
+        pass
+
+    def speaker_tick_interval(self):
+        return self.tick_interval
+
+    def stop(self):
+        self.stopped = True
+
+
+class TestSharedBrowser(unittest.TestCase):
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.browser = SharedBrowser(
+            0, self.driver, {**DEFAULT_LIMITS, "max_consecutive_errors": 3}
+        )
+
+    def record(self, bots, seconds, interval=0.02):
+        self.browser.start()
+        for bot in bots:
+            self.browser.add(SupervisedSpace(bot, fetch_audio=False, interval=interval))
+        time.sleep(seconds)
+        health = self.browser.health()
+        self.browser.stop()
+        return health
+
+    def test_ticks_are_shared_fairly_between_windows(self):
+        bots = [FakeBot(self.driver, f"space{i}") for i in range(3)]
+        health = self.record(bots, 0.5)
+
+        ticks = [bot.ticks for bot in bots]
+        self.assertGreater(min(ticks), 5)
+        self.assertLessEqual(max(ticks) - min(ticks), 2)
+        # every space only ever ticked in its own window
+        self.assertEqual([len(bot.windows) for bot in bots], [1, 1, 1])
+        self.assertEqual(len(set().union(*(bot.windows for bot in bots))), 3)
+        for bot in bots:
+            self.assertEqual(health[bot.space_id]["state"], SPACE_RECORDING)
+            self.assertTrue(bot.stopped)
+            self.assertEqual(bot.store.metadata["supervisor_health"]["state"], SPACE_STOPPED)
+        # only the home window is left open
+        self.assertEqual(self.driver.windows, ["home"])
+
+    def test_failing_space_is_given_up(self):
+        healthy = FakeBot(self.driver, "healthy")
+        failing = FakeBot(self.driver, "failing", fail=True)
+        health = self.record([healthy, failing], 0.3)
+
+        self.assertEqual(health["failing"]["state"], SPACE_FAILED)
+        self.assertEqual(health["failing"]["errors"], 3)
+        self.assertTrue(failing.stopped)
+        self.assertEqual(health["healthy"]["state"], SPACE_RECORDING)
+        self.assertGreater(healthy.ticks, 5)
+
+    def test_interval_follows_the_adaptive_rate(self):
+        bot = FakeBot(self.driver, "adaptive")
+        bot.adaptive_rate = True
+        space = SupervisedSpace(bot, fetch_audio=False, interval=0.5)
+
+        bot.tick_interval = 2
+        self.browser._follow_adaptive_rate(space)
+        self.assertEqual((space.interval, space.target_interval), (2, 2))
+        # never faster than max_fps
+        bot.tick_interval = 0
+        self.browser._follow_adaptive_rate(space)
+        self.assertEqual(space.interval, 1 / DEFAULT_LIMITS["max_fps"])
+
+        # throttled for its slow ticks: the rate only slows it down further
+        space.interval = 4
+        bot.tick_interval = 1
+        self.browser._follow_adaptive_rate(space)
+        self.assertEqual((space.interval, space.target_interval), (4, 1))
+
+
+class TestSpaceSupervisor(unittest.TestCase):
+    def test_add_space_before_start(self):
+        supervisor = SpaceSupervisor("cookies.txt", "bearer")
+        with self.assertLogs("lib.supervisor", "ERROR"):
+            self.assertFalse(supervisor.add_space("space"))
+        self.assertEqual(supervisor.active_spaces(), 0)
+        self.assertEqual(supervisor.health(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from lib.space_data import SPACE_JSON
+from lib.timeline import SpeakerTimeline
+
+FRAMES = {
+    "0": {"timestamp": 0.0, "speakers": []},
+    "1": {"timestamp": 1.0, "speakers": [{"username": "alice", "confidence": 0.3}]},
+    "2": {
+        "timestamp": 2.0,
+        "speakers": [{"username": "alice", "confidence": 0.4}, {"username": "bob"}],
+    },
+    "3": {"timestamp": 3.5, "speakers": [{"username": "bob", "confidence": 0.2}]},
+}
+
+
+class TestSpeakerTimeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.space_data_json = os.path.join(self.tmp.name, SPACE_JSON)
+        with open(self.space_data_json, "w") as f:
+            json.dump({"frames": FRAMES}, f)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_queries(self):
+        timeline = SpeakerTimeline.from_frames(FRAMES)
+        self.assertEqual(timeline.usernames, ["alice", "bob"])
+        self.assertEqual(timeline.speakers_between(0.5, 1.5), {"alice": 1})
+        self.assertEqual(timeline.speakers_between(1.5, 2.5), {"alice": 2, "bob": 1})
+        # frame 3 holds from 3.5 onwards
+        self.assertEqual(timeline.sole_speakers_between(2.5, 10), ["bob"])
+        self.assertEqual(timeline.sole_speakers_between(0, 10), ["alice", "bob"])
+        self.assertEqual(timeline.sole_speakers_between(-5, -1), [])
+
+    def test_load_or_build_is_memory_mapped(self):
+        built = SpeakerTimeline.load_or_build(self.space_data_json)
+        loaded = SpeakerTimeline.load_or_build(self.space_data_json)
+        self.assertEqual(len(loaded), len(FRAMES))
+        self.assertEqual(loaded.usernames, built.usernames)
+        self.assertIsInstance(loaded.timestamps, np.memmap)
+        self.assertEqual(loaded.sole_speakers_between(0, 10), ["alice", "bob"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import glob
 import json
 import os
 import re
@@ -13,6 +14,18 @@ PATH_TRANSCRIPT_IDENTIFIED = f"{DIR_SPACE}/transcript_updated.json"
 PATH_TRANSCRIPT_CONSOLIDATED = f"{DIR_SPACE}/transcript_consolidated.json"
 PATH_TRANSCRIPT_SUMMARY = f"{DIR_SPACE}/transcript_summary.txt"
 PATH_SPACE_DATA = f"{DIR_SPACE}/space_data.json"
+# where a recording's audio can be: the m4a the bot writes beside the space data, else one left
+# under audio/ by older versions of the downloader
+AUDIO_M4A_PATTERNS = (f"{DIR_SPACE}/audio*.m4a", f"{DIR_SPACE}/audio/*/audio_new.m4a")
+
+
+def find_space_audio(space_id: str) -> Optional[str]:
+    """The recorded m4a of a space, None if it has none"""
+    for pattern in AUDIO_M4A_PATTERNS:
+        paths = sorted(glob.glob(pattern.format(space_id=space_id)))
+        if paths:
+            return paths[0]
+    return None
 
 
 def read_env_file(file_path):